@@ -0,0 +1,158 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max
+
+from .models import Annotation, AnnotationRevision, Tag
+
+
+def annotations_cache():
+    return caches[settings.ANNOTATIONS_CACHE]
+
+
+def reference_segments_key(exercise, tier, revision):
+    return 'reference_segments:%s:%s:%s:%s:%s' % (exercise.id, exercise.reference_sound_id, revision, tier.id,
+                                                  tier.version)
+
+
+def get_annotations_stats(sound_id, tier, revision):
+    """
+    Get the number of annotations of a tier of a sound and the length of the longest one, they are cached with the
+    revision of the annotations
+    Returns:
+        dict with 'count' and 'max_length'
+    """
+    cache = annotations_cache()
+    key = 'annotations_stats:%s:%s:%s' % (sound_id, tier.id, revision)
+    stats = cache.get(key)
+    if stats is None:
+        length = ExpressionWrapper(F('end_time') - F('start_time'),
+                                   output_field=DecimalField(max_digits=6, decimal_places=3))
+        stats = Annotation.objects.filter(sound=sound_id, tier=tier).aggregate(count=Count('id'),
+                                                                                max_length=Max(length))
+        stats['max_length'] = stats['max_length'] or Decimal(0)
+        cache.set(key, stats)
+    return stats
+
+
+def is_windowed(sound_id, tier, revision):
+    """
+    Whether the annotation interface gets the segments of a tier of a sound by windows of time, because it has more
+    than SEGMENTS_WINDOW_THRESHOLD of them
+    """
+    return get_annotations_stats(sound_id, tier, revision)['count'] > settings.SEGMENTS_WINDOW_THRESHOLD
+
+
+def get_reference_segments(exercise, tier, revision, windows=False):
+    """
+    Get the segments of the reference sound of an exercise and the annotation tags of a tier. They are the same for
+    all the sounds of the exercise, so they are cached once per exercise and tier.
+    Args:
+        exercise: exercise object
+        tier: tier object
+        revision: revision of the annotations of the tier of the reference sound
+        windows: if the interface can get the segments by windows of time. In that case, the segments of a reference
+            sound with many segments aren't included
+
+    Returns:
+        dict with 'segments_ref', 'annotationTags' and 'segments_window_ref', the duration of the windows of the
+        segments of the reference sound or None if all of them are included
+    """
+    if windows and exercise.reference_sound_id and is_windowed(exercise.reference_sound_id, tier, revision):
+        return {
+            'annotationTags': list(Tag.objects.filter(tiers=tier).values_list('name', flat=True)),
+            'segments_ref': [],
+            'segments_window_ref': settings.SEGMENTS_WINDOW,
+        }
+
+    cache = annotations_cache()
+    key = reference_segments_key(exercise, tier, revision)
+    reference_segments = cache.get(key)
+    if reference_segments is None:
+        reference_segments = {
+            'annotationTags': list(Tag.objects.filter(tiers=tier).values_list('name', flat=True)),
+            'segments_ref': exercise.reference_sound.get_annotations_for_tier(tier),
+        }
+        cache.set(key, reference_segments)
+    reference_segments['segments_window_ref'] = None
+    return reference_segments
+
+
+def cache_reference_segments(exercise):
+    """
+    Compute and cache the segments of the reference sound for all the tiers of an exercise. It should be called when
+    the annotations of the reference sound change, so the annotators get them from the cache.
+    """
+    if not exercise.reference_sound_id:
+        return
+    revisions = dict(AnnotationRevision.objects.filter(sound=exercise.reference_sound_id).
+                     values_list('tier_id', 'revision'))
+    for tier in exercise.tiers.all():
+        get_reference_segments(exercise, tier, revisions.get(tier.id, 0))
+
+
+def get_annotations_payload(sound, tier, user, windows=False):
+    """
+    Get the segments of a sound and of its reference sound, and the annotation tags of the tier, as they are sent to
+    the annotation interface. They are cached with a key that includes the revisions of the annotations of both sounds
+    and the version of the tier, which change every time the annotations, the tier or its tags change, so a cached
+    payload is never outdated.
+    Args:
+        sound: sound object
+        tier: tier object
+        user: user object, staff users get the similarities of all the users
+        windows: if the interface can get the segments by windows of time (see get_annotations_window). The segments
+            of the sounds with more than SEGMENTS_WINDOW_THRESHOLD segments aren't included then
+
+    Returns:
+        dict with 'segments', 'segments_ref', 'annotationTags', the 'revision' of the annotations of the sound and
+        'segments_window' and 'segments_window_ref', the duration of the windows of the segments of each sound or None
+        if all of them are included
+    """
+    exercise = sound.exercise
+    ref_sound_id = exercise.reference_sound_id
+    revisions = dict(AnnotationRevision.objects.filter(sound__in=[sound.id, ref_sound_id], tier=tier).
+                     values_list('sound_id', 'revision'))
+    key = 'annotations:%s:%s:%s:%s:%s:%s' % (sound.id, revisions.get(sound.id, 0), ref_sound_id,
+                                             revisions.get(ref_sound_id, 0), tier.id, tier.version)
+    key += ':staff' if user.is_staff else ':%s' % user.id
+
+    if windows and is_windowed(sound.id, tier, revisions.get(sound.id, 0)):
+        segments = []
+        segments_window = settings.SEGMENTS_WINDOW
+    else:
+        cache = annotations_cache()
+        segments = cache.get(key)
+        if segments is None:
+            segments = sound.get_annotations_for_tier(tier, user)
+            cache.set(key, segments)
+        segments_window = None
+
+    payload = get_reference_segments(exercise, tier, revisions.get(ref_sound_id, 0), windows)
+    payload['segments'] = segments
+    payload['segments_window'] = segments_window
+    payload['revision'] = revisions.get(sound.id, 0)
+    return payload
+
+
+def get_annotations_window(sound, tier, user, start, end):
+    """
+    Get the segments of a sound that overlap the window of time [start, end), for the interface of the sounds with
+    many segments. The windows aren't cached, the query reads a range of the index on (sound, tier, start_time).
+    Args:
+        sound: sound object
+        tier: tier object
+        user: user object, or False for the segments of a reference sound (without similarities)
+        start: start of the window in seconds
+        end: end of the window in seconds
+
+    Returns:
+        dict with 'segments' and the 'revision' of the annotations of the sound
+    """
+    revision = sound.get_annotation_revision(tier)
+    max_length = get_annotations_stats(sound.id, tier, revision)['max_length']
+    return {
+        'segments': sound.get_annotations_for_tier(tier, user, window=(start, end, max_length)),
+        'revision': revision,
+    }
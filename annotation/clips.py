@@ -0,0 +1,258 @@
+import os
+import math
+import mmap
+import struct
+import tempfile
+
+import numpy
+from django.conf import settings
+
+from .diskcache import DiskLRUCache
+
+SEEK_MAGIC = b'SEK1'
+MP3 = 1
+WAV = 2
+# magic, kind of sound, sample rate, samples per frame (mp3) or bytes per sample frame (wav), number of frames (mp3)
+# or size of the fmt chunk (wav)
+HEADER = struct.Struct('<4sIIII')
+# offset and size of the samples of a wav, followed by its fmt chunk
+WAV_HEADER = struct.Struct('<QQ')
+# the bit reservoir of a layer III frame can start this many bytes before the frame
+MAX_RESERVOIR = 511
+# bigger clips are not cached, they are read from the sound
+MAX_CACHED_CLIP_SIZE = 16 * 1024 * 1024
+
+# bitrates in kbit/s by (MPEG-1, layer) and (MPEG-2 or 2.5, layer), the layer is 1, 2 or 3
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# sample rates by the version bits of the frame header: MPEG-2.5, reserved, MPEG-2, MPEG-1
+SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+_caches = {}
+
+
+def clips_cache():
+    key = (settings.CLIPS_CACHE_ROOT, settings.CLIPS_CACHE_SIZE)
+    if key not in _caches:
+        _caches[key] = DiskLRUCache(*key)
+    return _caches[key]
+
+
+def seek_table_path(sound_path):
+    return sound_path + '.seek'
+
+
+def parse_frame_header(data, offset):
+    """
+    Parse the header of an mp3 frame
+    Returns:
+        (version bits, layer, sample rate, samples per frame, length in bytes of the frame), or None if there isn't a
+        valid frame header at offset
+    """
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2 = data[offset + 1], data[offset + 2]
+    version = (b1 >> 3) & 3
+    layer = 4 - ((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 3
+    # free format bitrates are not supported, the length of their frames is unknown
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        return version, layer, sample_rate, 384, (12 * bitrate // sample_rate + padding) * 4
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    return version, layer, sample_rate, samples, samples // 8 * bitrate // sample_rate + padding
+
+
+def scan_mp3(data):
+    """
+    Find the offsets of the frames of an mp3, skipping its ID3v2 tag and the Xing/Info frame, which has no samples.
+    The frames must have the version, layer and sample rate of the first one, the bytes between frames are skipped.
+    Returns:
+        (sample rate, samples per frame, list of the offsets of the frames followed by the end of the last frame)
+    """
+    offset = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        # the size of the tag is a 28 bit syncsafe integer
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        offset = 10 + size + (10 if data[5] & 0x10 else 0)
+    first = None
+    offsets = []
+    end = offset
+    while offset + 4 <= len(data):
+        header = parse_frame_header(data, offset)
+        if header is None or (first is not None and header[:3] != first[:3]) or offset + header[4] > len(data):
+            offset += 1
+            continue
+        if first is None:
+            first = header
+            if data.find(b'Xing', offset + 4, offset + 40) >= 0 or data.find(b'Info', offset + 4, offset + 40) >= 0:
+                offset += header[4]
+                continue
+        offsets.append(offset)
+        offset += header[4]
+        end = offset
+    if first is None:
+        raise ValueError("No mp3 frames found")
+    return first[2], first[3], offsets + [end]
+
+
+def scan_wav(data):
+    """
+    Find the fmt and data chunks of a wav
+    Returns:
+        (sample rate, bytes per sample frame, fmt chunk, offset of the samples, size of the samples)
+    """
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError("Not a wav file")
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size, = struct.unpack('<I', data[offset + 4:offset + 8])
+        if chunk_id == b'fmt ':
+            fmt = bytes(data[offset + 8:offset + 8 + chunk_size])
+        elif chunk_id == b'data' and fmt is not None:
+            # the size of the data of a wav written as a stream can be wrong
+            size = min(chunk_size, len(data) - offset - 8)
+            _, _, sample_rate, _, block_align = struct.unpack('<HHIIH', fmt[:14])
+            return sample_rate, block_align, fmt, offset + 8, size - size % block_align
+        # the chunks are aligned to 2 bytes
+        offset += 8 + chunk_size + chunk_size % 2
+    raise ValueError("No data chunk found")
+
+
+def write_seek_table(sound_path, path):
+    """
+    Write the seek table of a sound: a header and, for an mp3, the offsets of its frames as little endian uint64, or,
+    for a wav, the offset and size of its samples and its fmt chunk. The file is written with another name and
+    renamed, so a partial file is never read.
+    """
+    with open(sound_path, 'rb') as sound, mmap.mmap(sound.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:4] == b'RIFF':
+            sample_rate, block_align, fmt, data_offset, data_size = scan_wav(data)
+            content = HEADER.pack(SEEK_MAGIC, WAV, sample_rate, block_align, len(fmt)) + \
+                WAV_HEADER.pack(data_offset, data_size) + fmt
+        else:
+            sample_rate, samples_per_frame, offsets = scan_mp3(data)
+            content = HEADER.pack(SEEK_MAGIC, MP3, sample_rate, samples_per_frame, len(offsets) - 1) + \
+                numpy.array(offsets, dtype='<u8').tobytes()
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.part', delete=False) as f:
+        f.write(content)
+    os.rename(f.name, path)
+
+
+def create_seek_table(sound_path):
+    """
+    Build the seek table of a sound and write it in the seek file next to it
+    """
+    path = seek_table_path(sound_path)
+    write_seek_table(sound_path, path)
+    return path
+
+
+class Clip(object):
+    """
+    Part of a sound between two times, cut at frame boundaries (mp3) or sample boundaries (wav) without decoding it.
+    The clip is a header followed by length bytes of the sound from offset.
+    """
+    def __init__(self, sound_path, content_type, start_time, header, offset, length):
+        self.sound_path = sound_path
+        self.content_type = content_type
+        # time of the sound where the clip starts, it can be before the requested time
+        self.start_time = start_time
+        self.header = header
+        self.offset = offset
+        self.length = length
+        self.size = len(header) + length
+
+    @property
+    def extension(self):
+        return 'mp3' if self.content_type == 'audio/mpeg' else 'wav'
+
+    def read(self, start, length, chunk_size=64 * 1024):
+        """
+        Yield length bytes of the clip from start, the sound is memory mapped and only that part of it is read
+        """
+        if start < len(self.header):
+            yield self.header[start:start + length]
+            length -= len(self.header) - start
+            start = len(self.header)
+        if length <= 0:
+            return
+        with open(self.sound_path, 'rb') as sound, mmap.mmap(sound.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = self.offset + start - len(self.header)
+            end = position + min(length, self.size - start)
+            while position < end:
+                yield data[position:min(position + chunk_size, end)]
+                position += chunk_size
+
+
+def mp3_clip(sound_path, path, sample_rate, samples_per_frame, num_frames, start, end):
+    offsets = numpy.memmap(path, dtype='<u8', mode='r', offset=HEADER.size, shape=(num_frames + 1,))
+    first = min(math.floor(start * sample_rate / samples_per_frame), num_frames)
+    last = min(math.ceil(end * sample_rate / samples_per_frame), num_frames)
+    # the first frame of layer III can use bytes of the previous frames, they are sent so the decoder has them
+    lead_in = first
+    while lead_in > 0 and offsets[first] - offsets[lead_in] < MAX_RESERVOIR:
+        lead_in -= 1
+    offset = int(offsets[lead_in])
+    return Clip(sound_path, 'audio/mpeg', lead_in * samples_per_frame / sample_rate, b'', offset,
+                int(offsets[last]) - offset)
+
+
+def wav_clip(sound_path, sample_rate, block_align, fmt, data_offset, data_size, start, end):
+    num_samples = data_size // block_align
+    first = min(math.floor(start * sample_rate), num_samples)
+    last = min(math.ceil(end * sample_rate), num_samples)
+    length = (last - first) * block_align
+    fmt_chunk = b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'\0' * (len(fmt) % 2)
+    header = b'RIFF' + struct.pack('<I', 4 + len(fmt_chunk) + 8 + length) + b'WAVE' + fmt_chunk + \
+        b'data' + struct.pack('<I', length)
+    return Clip(sound_path, 'audio/wav', first / sample_rate, header, data_offset + first * block_align, length)
+
+
+def get_clip(sound_path, start, end):
+    """
+    Clip of a sound between start and end seconds (floats), building the seek table of the sound first if it doesn't
+    have one or it is older than the sound
+    """
+    path = seek_table_path(sound_path)
+    sound_mtime = os.path.getmtime(sound_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < sound_mtime:
+        create_seek_table(sound_path)
+    with open(path, 'rb') as f:
+        magic, kind, sample_rate, unit, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != SEEK_MAGIC:
+            raise ValueError("%s is not a seek table" % path)
+        if kind == WAV:
+            data_offset, data_size = WAV_HEADER.unpack(f.read(WAV_HEADER.size))
+            return wav_clip(sound_path, sample_rate, unit, f.read(count), data_offset, data_size, start, end)
+    return mp3_clip(sound_path, path, sample_rate, unit, count, start, end)
+
+
+def get_cached_clip(clip, sound_id):
+    """
+    Path of a copy of a clip in the clips cache, written the first time it is requested. The key of a clip is the part
+    of the sound it has, so the requests of close times share it, and it changes with the modification time and size
+    of the sound.
+    """
+    stat = os.stat(clip.sound_path)
+    key = os.path.join(str(sound_id), '%x_%x_%x-%x.%s' % (clip.offset, clip.length, int(stat.st_mtime), stat.st_size,
+                                                         clip.extension))
+    cache = clips_cache()
+    path = cache.get(key)
+    if path is None:
+        path = cache.set(key, b''.join(clip.read(0, clip.size)))
+    return path
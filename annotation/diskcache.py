@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+
+class DiskLRUCache(object):
+    """
+    Cache of files in a directory. When the files take more than max_size bytes, the least recently used ones are
+    removed. The modification time of a file is the time it was last used. The size is checked every sweep_interval
+    files added by the process, so the cache can be a few files over max_size between checks.
+    """
+    def __init__(self, root, max_size, sweep_interval=50):
+        self.root = root
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self.writes = 0
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """
+        Path of the file of a key, or None if it is not in the cache
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def set(self, key, data):
+        """
+        Add a file with the given content to the cache. It is written with another name and renamed, so a partial
+        file is never used.
+        Returns:
+            path of the file
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.part', delete=False) as f:
+            f.write(data)
+        os.rename(f.name, path)
+        # the first write of a process checks the size too, the cache can be full when it starts
+        if self.writes % self.sweep_interval == 0:
+            self.evict()
+        self.writes += 1
+        return path
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache takes less than max_size bytes
+        """
+        files = []
+        total_size = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.part'):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
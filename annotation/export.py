@@ -0,0 +1,90 @@
+import os
+import json
+import zipfile
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Sound, ExportJob
+from .serializers import iter_sounds_annotations
+
+
+class ZipStream(object):
+    """
+    Write-only file object that keeps what zipfile writes until it is read with pop(). zipfile doesn't need to seek
+    in it, so a zip file can be sent while it is being created.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def annotations_file_name(sound):
+    return os.path.splitext(sound.filename)[0] + '.json'
+
+
+def annotations_zip_stream(sounds):
+    """
+    Create a zip file with a .json file with the annotations of each sound, yielding its content as it is created
+    Args:
+        sounds: iterable of sound objects
+
+    Yields:
+        chunks of bytes of the zip file
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for sound, annotations in iter_sounds_annotations(sounds):
+            zip_file.writestr(annotations_file_name(sound), json.dumps(annotations))
+            yield stream.pop()
+    yield stream.pop()
+
+
+def run_export_job(job, progress_interval=100):
+    """
+    Create the zip file of the annotations of the data set of an export job, updating its progress. When it is
+    finished the zip files of the previous jobs of the data set are removed.
+    Args:
+        job: export job object, claimed with ExportJob.claim()
+        progress_interval: number of sounds exported between updates of the progress
+    """
+    sounds = Sound.objects.filter(exercise__data_set=job.data_set_id)
+    total = sounds.count()
+    ExportJob.objects.filter(id=job.id).update(total=total, progress=0)
+
+    os.makedirs(settings.EXPORT_JOBS_ROOT, exist_ok=True)
+    file_path = os.path.join(settings.EXPORT_JOBS_ROOT, '%s_%s.zip' % (job.data_set_id, job.version))
+    # the file is written with another name, so an unfinished file is never sent
+    tmp_file_path = '%s.%s.part' % (file_path, job.id)
+    try:
+        with open(tmp_file_path, 'wb') as f:
+            for i, chunk in enumerate(annotations_zip_stream(sounds.iterator())):
+                f.write(chunk)
+                if i and i % progress_interval == 0:
+                    ExportJob.objects.filter(id=job.id).update(progress=min(i, total), updated_at=timezone.now())
+        os.rename(tmp_file_path, file_path)
+    except Exception as e:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        ExportJob.objects.filter(id=job.id).update(status=ExportJob.FAILED, error=str(e), updated_at=timezone.now())
+        raise
+
+    ExportJob.objects.filter(id=job.id).update(status=ExportJob.DONE, progress=total, file_path=file_path,
+                                               updated_at=timezone.now())
+
+    old_jobs = ExportJob.objects.filter(data_set=job.data_set_id, status=ExportJob.DONE).exclude(file_path=file_path)
+    for old_file_path in set(old_jobs.values_list('file_path', flat=True)):
+        if os.path.exists(old_file_path):
+            os.remove(old_file_path)
+    old_jobs.update(file_path='')
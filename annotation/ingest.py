@@ -0,0 +1,288 @@
+import os
+from itertools import chain
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Exercise, Tier, Tag, Sound, Annotation, DailyStatistics, ExerciseStatistics, \
+    increment_sounds_annotation_revisions, revisions_incremented_by_caller, to_annotation_time
+from .cache import cache_reference_segments
+from .jsonstream import iter_tier_segments, JSONStreamError
+
+BATCH_SIZE = 1000
+TIME_FIELD = Annotation._meta.get_field('end_time')
+MAX_ANNOTATION_TIME = 10 ** (TIME_FIELD.max_digits - TIME_FIELD.decimal_places)
+
+
+def create_tiers(exercise, tiers_data):
+    """
+    Create the tiers of a rubric that don't exist in the exercise, and add the tags of the rubric to the tiers
+    Args:
+        exercise: exercise object
+        tiers_data: dict of tier name -> tier description of the rubric file
+
+    Returns:
+        dict of tier name -> tier object
+    """
+    tiers = {t.name: t for t in exercise.tiers.all()}
+    new_tiers = []
+    for tier_name, tier_data in tiers_data.items():
+        point_annotations = 'point_annotations' in tier_data
+        for name in (tier_name, tier_data.get('parent_tier'), tier_data.get('special_parent_tier')):
+            if name and name not in tiers:
+                tiers[name] = Tier(name=name, exercise=exercise, point_annotations=point_annotations)
+                new_tiers.append(tiers[name])
+    Tier.objects.bulk_create(new_tiers)
+
+    new_tier_names = {t.name for t in new_tiers}
+    for tier_name, tier_data in tiers_data.items():
+        if tier_name not in new_tier_names:
+            continue
+        values = {}
+        if 'parent_tier' in tier_data:
+            values['parent_tier'] = tiers[tier_data['parent_tier']]
+        if 'special_parent_tier' in tier_data:
+            values['special_parent_tier'] = tiers[tier_data['special_parent_tier']]
+        if tier_name.find('Overall') != -1 or tier_name.find('entire') != -1:
+            values['entire_sound'] = True
+        if 'similarity_dimensions' in tier_data:
+            values['similarity_keys'] = tier_data['similarity_dimensions']
+        if values:
+            Tier.objects.filter(id=tiers[tier_name].id).update(**values)
+        print("Created tier %s in exercise %s" % (tier_name, exercise.name))
+    if new_tiers:
+        exercise.update_tier_graph()
+
+    # CREATE TAGS IF DEFINED IN THE RUBRIC FILE
+    tier_tags = {tiers[tier_name].id: tier_data['rubric']['ratings'] for tier_name, tier_data in tiers_data.items()
+                 if 'rubric' in tier_data}
+    tag_names = set(chain.from_iterable(tier_tags.values()))
+    tags = {}
+    for tag in Tag.objects.filter(name__in=tag_names).order_by('id'):
+        tags.setdefault(tag.name, tag)
+    new_tags = [Tag(name=name) for name in tag_names if name not in tags]
+    Tag.objects.bulk_create(new_tags)
+    for tag in new_tags:
+        tags[tag.name] = tag
+        print("Created tag: %s" % tag.name)
+
+    TagTier = Tag.tiers.through
+    existing = set(TagTier.objects.filter(tier__in=list(tier_tags)).values_list('tag_id', 'tier_id'))
+    new_tag_tiers = {(tags[name].id, tier_id) for tier_id, names in tier_tags.items() for name in names} - existing
+    TagTier.objects.bulk_create([TagTier(tag_id=tag_id, tier_id=tier_id) for tag_id, tier_id in new_tag_tiers])
+    # the annotation tags of a tier are cached with its version
+    Tier.objects.filter(id__in={tier_id for _, tier_id in new_tag_tiers}).update(version=F('version') + 1)
+    return tiers
+
+
+def get_or_create_sounds(exercise, sounds_data):
+    """
+    Get the sounds of an exercise, creating the ones that don't exist
+    Args:
+        exercise: exercise object
+        sounds_data: list of (filename, original filename, name) of the sounds
+
+    Returns:
+        dict of (filename, original filename) -> sound object
+    """
+    sounds = {}
+    for sound in exercise.sounds.filter(filename__in=[filename for filename, _, _ in sounds_data]).order_by('id'):
+        sounds.setdefault((sound.filename, sound.original_filename), sound)
+    new_sounds = []
+    for filename, original_filename, name in sounds_data:
+        if (filename, original_filename) not in sounds:
+            sounds[(filename, original_filename)] = Sound(filename=filename, original_filename=original_filename,
+                                                          name=name, exercise=exercise)
+            new_sounds.append(sounds[(filename, original_filename)])
+    Sound.objects.bulk_create(new_sounds)
+    ExerciseStatistics.add(exercise.id, sounds=len(new_sounds))
+    for sound in new_sounds:
+        print("Created sound %s:%s of exercise %s" % (sound.id, sound.filename, exercise.name))
+    return sounds
+
+
+def read_annotations(annotations_file_path, sound, tiers, user, reference=False):
+    """
+    Read the annotations of a sound from an annotations file. The file is parsed while the annotations are created,
+    so it is never loaded in memory. The invalid segments are reported with their line and skipped, and if the file
+    is not valid JSON the annotations before the error are kept.
+    Args:
+        annotations_file_path: path of the json file with a list of annotations for each tier name
+        sound: sound object
+        tiers: dict of tier name -> tier object of the exercise of the sound
+        user: user object creating the annotations
+        reference: the labels of the annotations are kept only in reference sounds
+
+    Yields:
+        annotation objects, not saved
+    """
+    print("SOUND: %s" % sound.original_filename)
+    counts = Counter()
+    missing_tiers = set()
+    with open(annotations_file_path) as annotations_file:
+        try:
+            for tier_name, segment, line in iter_tier_segments(annotations_file):
+                if tier_name not in tiers:
+                    if tier_name not in missing_tiers:
+                        print("The tier %s of %s doesn't exist" % (tier_name, annotations_file_path))
+                        missing_tiers.add(tier_name)
+                    continue
+                try:
+                    start_time = to_annotation_time(segment['start_time'])
+                    end_time = to_annotation_time(segment['end_time'])
+                    name = str(segment['label']) if reference else ''
+                    if start_time < 0 or end_time < start_time:
+                        raise ValueError("the times are not a valid interval")
+                    if end_time >= MAX_ANNOTATION_TIME:
+                        raise ValueError("the times can't be stored")
+                except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                    print("%s:%s: invalid segment of tier %s: %r" % (annotations_file_path, line, tier_name, e))
+                    continue
+                counts[tier_name] += 1
+                yield Annotation(name=name, start_time=start_time, end_time=end_time, sound=sound,
+                                 tier=tiers[tier_name], user=user)
+        except JSONStreamError as e:
+            print("%s:%s: %s, the rest of the file is skipped" % (annotations_file_path, e.line, e.message))
+    for tier_name, count in counts.items():
+        print("TIER: %s" % tier_name)
+        print("num tier annotations: %s" % count)
+
+
+def unique_annotations(annotations, existing=()):
+    """
+    Skip the annotations with the same tier, times and name of a previous one or of the existing ones
+    Args:
+        annotations: iterable of annotation objects
+        existing: iterable of (tier id, start time, end time, name) of existing annotations
+    """
+    seen = set((tier_id, to_annotation_time(start_time), to_annotation_time(end_time), name)
+               for tier_id, start_time, end_time, name in existing)
+    for a in annotations:
+        key = (a.tier_id, to_annotation_time(a.start_time), to_annotation_time(a.end_time), a.name)
+        if key not in seen:
+            seen.add(key)
+            yield a
+
+
+def create_annotations(annotations, exercise):
+    """
+    Insert annotations in batches, and update the revisions of the annotations of their sounds and the statistics of
+    the exercise
+    Args:
+        annotations: iterable of annotation objects, not saved
+        exercise: exercise object of the sounds of the annotations
+
+    Returns:
+        number of annotations created
+    """
+    num_created = 0
+    sound_ids = set()
+    batch = []
+    for a in chain(annotations, [None]):
+        if a is not None:
+            batch.append(a)
+            sound_ids.add(a.sound_id)
+        if batch and (a is None or len(batch) == BATCH_SIZE):
+            Annotation.objects.bulk_create(batch)
+            num_created += len(batch)
+            batch = []
+    if sound_ids:
+        increment_sounds_annotation_revisions(list(sound_ids), list(exercise.tiers.values_list('id', flat=True)))
+    DailyStatistics.add(exercise, segments=num_created)
+    return num_created
+
+
+def ingest_exercise(data_set, exercise_id, exercise_description, dataset_path, media_filenames, user,
+                    rubric_data=None, force_annotations=False, create_segments=None):
+    """
+    Create the exercise of a description file with its tiers, tags, sounds and annotations. Existing objects are
+    resolved with a query for each kind of object and the new ones are inserted in bulk, in a transaction so a failed
+    exercise is not left half created.
+    Args:
+        data_set: data set object
+        exercise_id: id of the exercise in the description file
+        exercise_description: description of the exercise
+        dataset_path: path of the directory of the data set
+        media_filenames: dict of relative path of a file of the description -> filename of the file in media. The
+            sounds that are not in it are not created.
+        user: user object creating the annotations
+        rubric_data: optional rubric with the tiers and tags of the exercise
+        force_annotations: remove the annotations of the sounds with an annotations file and create them again
+        create_segments: optional (start time, end time) of a segment to create in every tier of every sound
+
+    Returns:
+        exercise object
+    """
+    with transaction.atomic():
+        exercise, _ = Exercise.objects.get_or_create(exercise_id=exercise_id, data_set=data_set,
+                                                     defaults={'name': exercise_description['name']})
+
+        # CREATE TIERS
+        if rubric_data:
+            tiers = create_tiers(exercise, rubric_data)
+        else:
+            # create initial tier "whole sound"
+            tiers = {t.name: t for t in exercise.tiers.all()}
+            if "entire sound" not in tiers:
+                tiers["entire sound"] = Tier.objects.create(name="entire sound", exercise=exercise,
+                                                            entire_sound=True)
+
+        # CREATE REFERENCE PITCH
+        if exercise_description.get('tanpura') in media_filenames:
+            exercise.reference_pitch_sound.name = media_filenames[exercise_description['tanpura']]
+        else:
+            print("The exercise %s does not have a pitch reference" % exercise.name)
+
+        # CREATE SOUNDS
+        sounds_data = []
+        annotation_files = []
+        reference_path = exercise_description.get('ref_media')
+        if reference_path in media_filenames:
+            source_path = os.path.join(dataset_path, reference_path)
+            sounds_data.append((media_filenames[reference_path], source_path, "%s %s" % (exercise.name, 'reference')))
+            annotation_files.append((sounds_data[-1], os.path.splitext(source_path)[0] + '.trans_json', True))
+        else:
+            print("The exercise %s does not have reference sound" % exercise.name)
+        for sound_description in exercise_description['recs']:
+            if sound_description['path'] in media_filenames:
+                source_path = os.path.join(dataset_path, sound_description['path'])
+                sounds_data.append((media_filenames[sound_description['path']], source_path,
+                                    sound_description.get('_id')))
+                annotation_files.append((sounds_data[-1], os.path.splitext(source_path)[0] + '.json', False))
+        sounds = get_or_create_sounds(exercise, sounds_data)
+
+        if reference_path in media_filenames:
+            exercise.reference_sound = sounds[sounds_data[0][:2]]
+        exercise.save()
+
+        # CREATE ANNOTATIONS
+        annotation_files = [(sounds[sound_data[:2]], path, reference) for sound_data, path, reference
+                            in annotation_files if os.path.exists(path)]
+        if force_annotations:
+            removed_annotations = Annotation.objects.filter(sound__in=[sound for sound, _, _ in annotation_files])
+            removed_sound_ids = list(removed_annotations.values_list('sound_id', flat=True).distinct())
+            DailyStatistics.remove(exercise, removed_annotations)
+            with revisions_incremented_by_caller():
+                removed_annotations.delete()
+            if removed_sound_ids:
+                increment_sounds_annotation_revisions(removed_sound_ids,
+                                                      list(exercise.tiers.values_list('id', flat=True)))
+        sounds_with_annotations = set(Annotation.objects.filter(sound__in=list(sounds.values())).
+                                      values_list('sound_id', flat=True).distinct())
+        annotations = []
+        for sound, path, reference in annotation_files:
+            if sound.id not in sounds_with_annotations:
+                sound_annotations = read_annotations(path, sound, tiers, user, reference)
+                # the reference annotations are not repeated
+                annotations.append(unique_annotations(sound_annotations) if reference else sound_annotations)
+        # Create annotations for each sound according to parameter
+        if create_segments:
+            start_time, end_time = create_segments
+            annotations.append(Annotation(name="", start_time=start_time, end_time=end_time, sound=sound, tier=tier,
+                                          user=user)
+                               for sound in sounds.values() for tier in tiers.values())
+        create_annotations(chain.from_iterable(annotations), exercise)
+
+    cache_reference_segments(exercise)
+    return exercise
@@ -0,0 +1,132 @@
+import re
+import json
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# end of a buffer cut in the middle of a value, from the position of the decoding error: a string, a literal or a
+# number that continue in the next chunk
+INCOMPLETE_END = re.compile(r'"(?:[^"\\]|\\.)*\\?|[-+.\w]*')
+
+
+class JSONStreamError(ValueError):
+    """
+    Raised when a file read by iter_tier_segments is not valid JSON or doesn't have the format of an annotations file
+    """
+    def __init__(self, message, line):
+        super(JSONStreamError, self).__init__("line %s: %s" % (line, message))
+        self.message = message
+        self.line = line
+
+
+class StreamReader(object):
+    """
+    Read JSON values from a file one at a time, keeping in memory only the part of the file that is being decoded
+    """
+    def __init__(self, f, chunk_size=64 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        # line at counted_pos of the buffer, the lines are counted only once
+        self.counted_line = 1
+        self.counted_pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    @property
+    def line(self):
+        self.count_lines()
+        return self.counted_line
+
+    def count_lines(self):
+        self.counted_line += self.buffer.count('\n', self.counted_pos, self.pos)
+        self.counted_pos = self.pos
+
+    def fill(self):
+        """
+        Read the next chunk of the file, dropping the part of the buffer that was already decoded
+        Returns:
+            False at the end of the file
+        """
+        if self.eof:
+            return False
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.count_lines()
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        self.counted_pos = 0
+        return True
+
+    def peek(self):
+        """
+        Next character that is not whitespace, without consuming it, or '' at the end of the file
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, characters):
+        c = self.peek()
+        if not c or c not in characters:
+            found = repr(c) if c else 'the end'
+            raise JSONStreamError("expected %s, found %s" % (' or '.join(map(repr, characters)), found), self.line)
+        self.pos += 1
+        return c
+
+    def value(self):
+        """
+        Decode the next value. The buffer is filled until the value is complete, a value that is not valid before the
+        end of the buffer is an error without reading the rest of the file.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as e:
+                if INCOMPLETE_END.fullmatch(self.buffer, getattr(e, 'pos', self.pos)) and self.fill():
+                    continue
+                raise JSONStreamError(getattr(e, 'msg', str(e)), self.line)
+            # a number at the end of the buffer can continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_tier_segments(f, chunk_size=64 * 1024):
+    """
+    Read an annotations file, a json object with a list of segments for each tier name, without loading it in memory
+    Args:
+        f: file object open in text mode
+        chunk_size: number of characters read at a time
+
+    Yields:
+        (tier name, segment, line number of the segment)
+
+    Raises:
+        JSONStreamError with the line where the file is not valid. The segments before it have already been yielded.
+    """
+    reader = StreamReader(f, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        line = reader.line
+        tier_name = reader.value()
+        if not isinstance(tier_name, str):
+            raise JSONStreamError("expected a tier name", line)
+        reader.expect(':')
+        reader.expect('[')
+        if reader.peek() == ']':
+            reader.pos += 1
+        else:
+            while True:
+                line = reader.line
+                yield tier_name, reader.value(), line
+                if reader.expect(',]') == ']':
+                    break
+        if reader.expect(',}') == '}':
+            return
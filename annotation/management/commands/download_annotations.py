@@ -1,46 +1,121 @@
 import os
 import json
+import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from django.core.management.base import BaseCommand
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
-from annotation.models import Exercise, Sound, DataSet
+from django.utils import timezone
+from annotation.models import Exercise, Sound, DataSet, DataSetExportMark
+from annotation.serializers import iter_sounds_annotations
+
+# changes committed a bit after the start of an export could have an older updated_at than the high-water mark
+HIGH_WATER_MARK_OVERLAP = datetime.timedelta(minutes=1)
+
+
+def annotations_file_path(sound):
+    export_directory = [settings.EXPORT_PATH]
+    if sound.exercise.data_set.name not in sound.original_filename:
+        export_directory.append(sound.exercise.data_set.name)
+    export_path_list = export_directory + sound.original_filename.split(os.sep)[2:]
+    export_path = "/".join(export_path_list)
+    # change file extension to .json
+    return os.path.splitext(export_path)[0] + '.json'
+
+
+def write_annotations_file(annotation_file_path, annotations):
+    """
+    Write the annotations file of a sound. It is written with another name and renamed, so a failed write doesn't
+    leave a truncated file that --incremental would skip. The errors are raised.
+    """
+    os.makedirs(os.path.dirname(annotation_file_path), exist_ok=True)
+    tmp_file_path = annotation_file_path + '.part'
+    try:
+        with open(tmp_file_path, 'w') as outfile:
+            json.dump(annotations, outfile)
+        os.rename(tmp_file_path, annotation_file_path)
+    except Exception:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        raise
+
+
+def check_written(futures):
+    """
+    Print the errors of the writes of the annotations files
+    Returns:
+        number of failed writes
+    """
+    failed = 0
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print("Error while writing %s: %s" % (future.annotation_file_path, e))
+            failed += 1
+    return failed
 
 
 class Command(BaseCommand):
     """
     Download annotations in the CAMUT file system. It will download one annotations file per sound in the CAMUT format
-    into the original location of the sound file
+    into the original location of the sound file. With --incremental only the sounds with annotations changed since
+    the last download, or without annotations file, are downloaded.
     """
 
     @staticmethod
     def add_arguments(parser):
         parser.add_argument('dataset', type=str, default=False, help='dataset name')
+        parser.add_argument('--incremental', action='store_true',
+                            help='download only the annotations changed since the last download')
+        parser.add_argument('--workers', type=int, default=4, help='number of threads writing the files')
 
     def handle(self, *args, **options):
         data_set_name = options['dataset']
 
         try:
-            DataSet.objects.get(name=data_set_name)
+            data_set = DataSet.objects.get(name=data_set_name)
         except ObjectDoesNotExist:
             print("this data set does not exists in the database")
             return 0
 
-        for sound in Sound.objects.filter(exercise__in=Exercise.objects.filter(data_set__name=data_set_name)).\
-                filter(is_discarded=False):
-            print("SOUND: %s %s" % (sound.id, sound.filename))
-            # only download annotations for sound that are not the reference of the exercise
-            if sound != sound.exercise.reference_sound:
-                try:
-                    export_directory = [settings.EXPORT_PATH]
-                    if sound.exercise.data_set.name not in sound.original_filename:
-                        export_directory.append(sound.exercise.data_set.name)
-                    export_path_list = export_directory + sound.original_filename.split(os.sep)[2:]
-                    export_path = "/".join(export_path_list)
-                    # change file extension to .json
-                    annotation_file_path = os.path.splitext(export_path)[0] + '.json'
-                    annotations = sound.get_annotations_as_dict()
-                    os.makedirs(os.path.dirname(annotation_file_path), exist_ok=True)
-                    with open(annotation_file_path, 'w') as outfile:
-                        json.dump(annotations, outfile)
-                except Exception as e:
-                    print(e)
+        started_at = timezone.now()
+        tiers_version = data_set.get_tiers_version()
+        changed_sound_ids = None
+        try:
+            mark = data_set.export_mark
+            # a change in the tiers changes the annotations of all the sounds
+            if options['incremental'] and mark.tiers_version == tiers_version:
+                changed_sound_ids = data_set.get_changed_sound_ids(mark.exported_at - HIGH_WATER_MARK_OVERLAP)
+        except ObjectDoesNotExist:
+            pass
+
+        sounds = Sound.objects.filter(exercise__in=Exercise.objects.filter(data_set__name=data_set_name)).\
+            filter(is_discarded=False).select_related('exercise__data_set')
+        # only download annotations for sound that are not the reference of the exercise
+        sounds = (s for s in sounds.iterator() if s.id != s.exercise.reference_sound_id)
+        if changed_sound_ids is not None:
+            sounds = (s for s in sounds
+                      if s.id in changed_sound_ids or not os.path.exists(annotations_file_path(s)))
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            pending = set()
+            for sound, annotations in iter_sounds_annotations(sounds):
+                print("SOUND: %s %s" % (sound.id, sound.filename))
+                # don't keep in memory the annotations of more sounds than the ones being written
+                if len(pending) >= options['workers'] * 10:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    failed += check_written(done)
+                file_path = annotations_file_path(sound)
+                future = executor.submit(write_annotations_file, file_path, annotations)
+                future.annotation_file_path = file_path
+                pending.add(future)
+        failed += check_written(pending)
+
+        if failed:
+            # the next incremental download writes again the files of all the sounds changed since the last mark
+            print("%s annotations files could not be written, the download mark is not updated" % failed)
+            return
+        DataSetExportMark.objects.update_or_create(data_set=data_set, defaults={'exported_at': started_at,
+                                                                                'tiers_version': tiers_version})
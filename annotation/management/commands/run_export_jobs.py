@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from annotation.models import ExportJob
+from annotation.export import run_export_job
+
+
+class Command(BaseCommand):
+    """
+    Process the queued export jobs. It keeps waiting for new jobs unless --once is given, several workers can run at
+    the same time.
+    """
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('--once', action='store_true', help='exit when there are no queued jobs')
+        parser.add_argument('--sleep', type=float, default=5, help='seconds between checks of the queue')
+
+    def handle(self, *args, **options):
+        while True:
+            job = ExportJob.claim()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+
+            print("EXPORT JOB: %s data set %s" % (job.id, job.data_set_id))
+            try:
+                run_export_job(job)
+            except Exception as e:
+                print(e)
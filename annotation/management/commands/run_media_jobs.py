@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from annotation.models import MediaJob
+from annotation.media_jobs import run_media_job
+
+
+class Command(BaseCommand):
+    """
+    Process the queued media jobs, like the peaks of the sounds that don't have them. It keeps waiting for new jobs
+    unless --once is given, several workers can run at the same time.
+    """
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('--once', action='store_true', help='exit when there are no queued jobs')
+        parser.add_argument('--sleep', type=float, default=1, help='seconds between checks of the queue')
+
+    def handle(self, *args, **options):
+        while True:
+            job = MediaJob.claim()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+
+            print("MEDIA JOB: %s %s of sound %s" % (job.id, job.kind, job.sound_id))
+            try:
+                run_media_job(job)
+            except Exception as e:
+                print(e)
@@ -1,8 +1,61 @@
-import os
-import json
+import time
+from collections import defaultdict
 from django.core.management.base import BaseCommand
 from django.core.exceptions import ObjectDoesNotExist
-from annotation.models import Exercise, AnnotationSimilarity, DataSet, Complete
+from django.db import transaction
+from django.db.models import Count, F
+from annotation.models import Exercise, Sound, Tier, Annotation, AnnotationSimilarity, DataSet, Complete
+
+
+def completed_sounds(exercises, user_ids, completed):
+    """
+    Compute which sounds each user completed with a few aggregate queries, with the rules of the loop this command
+    used to run over every sound, tier and user. The tiers of a sound are checked in order: a Complete is created if
+    the tier has as many annotations as the reference sound and the user has a similarity for each of them, and an
+    existing one is removed if the numbers of annotations differ and the user has a similarity for each annotation.
+    The reference sounds and the exercises without a reference sound are not checked.
+    Args:
+        exercises: queryset of exercises
+        user_ids: list of user ids
+        completed: set of (sound id, user id) with a Complete object
+
+    Returns:
+        set of (sound id, user id) that have a Complete object afterwards
+    """
+    exercises = exercises.filter(reference_sound__isnull=False)
+    sounds = list(Sound.objects.filter(exercise__in=exercises).exclude(exercise__reference_sound=F('id')).
+                  values_list('id', 'exercise_id', 'exercise__reference_sound_id'))
+    tiers = defaultdict(list)
+    for tier_id, exercise_id in Tier.objects.filter(exercise__in=exercises).order_by('id').\
+            values_list('id', 'exercise_id'):
+        tiers[exercise_id].append(tier_id)
+
+    annotation_counts = defaultdict(int)
+    for a in Annotation.objects.filter(sound__exercise__in=exercises).values('sound_id', 'tier_id').\
+            annotate(count=Count('id')):
+        annotation_counts[(a['sound_id'], a['tier_id'])] = a['count']
+
+    similarity_counts = defaultdict(int)
+    for s in AnnotationSimilarity.objects.filter(similar_sound__sound__exercise__in=exercises, user__in=user_ids).\
+            values('similar_sound__sound_id', 'similar_sound__tier_id', 'user_id').annotate(count=Count('id')):
+        similarity_counts[(s['similar_sound__sound_id'], s['similar_sound__tier_id'], s['user_id'])] = s['count']
+
+    checked_sound_ids = {sound_id for sound_id, _, _ in sounds}
+    result = {key for key in completed if key[0] not in checked_sound_ids}
+    for sound_id, exercise_id, reference_sound_id in sounds:
+        for user_id in user_ids:
+            complete = (sound_id, user_id) in completed
+            for tier_id in tiers[exercise_id]:
+                num_annotations = annotation_counts[(sound_id, tier_id)]
+                same_as_reference = num_annotations == annotation_counts[(reference_sound_id, tier_id)]
+                all_similarities = similarity_counts[(sound_id, tier_id, user_id)] == num_annotations
+                if complete and not same_as_reference and all_similarities:
+                    complete = False
+                elif not complete and same_as_reference and all_similarities:
+                    complete = True
+            if complete:
+                result.add((sound_id, user_id))
+    return result
 
 
 class Command(BaseCommand):
@@ -15,6 +68,8 @@ class Command(BaseCommand):
     @staticmethod
     def add_arguments(parser):
         parser.add_argument('dataset', type=str, default=False, help='dataset name')
+        parser.add_argument('--exercise', type=str, help='update only the exercise with this name')
+        parser.add_argument('--dry-run', action='store_true', help='report the changes without applying them')
 
     def handle(self, *args, **options):
         data_set_name = options['dataset']
@@ -25,22 +80,37 @@ class Command(BaseCommand):
             print("this data set does not exists in the database")
             return 0
 
-        for exercise in Exercise.objects.filter(data_set=data_set).all():
-            for sound in exercise.sounds.all():
-                for tier in exercise.tiers.all():
-                    for user in data_set.users.all():
-                        annotations = tier.annotations.filter(sound=sound, tier=tier).all()
-                        reference_annotations = exercise.reference_sound.annotations.filter(tier=tier)
-                        similarities = AnnotationSimilarity.objects.filter(similar_sound__in=annotations, user=user)
-
-                        try:
-                            complete = Complete.objects.get(user=user, sound=sound)
-                            if not annotations.count() == reference_annotations.count() and similarities.count() == \
-                                    annotations.count():
-                                complete.delete()
-                                print("User %s hasn't completed annotations for sound %s" % (user.username, sound.name))
-                        except ObjectDoesNotExist:
-                            if annotations.count() == reference_annotations.count() and similarities.count() == \
-                                    annotations.count():
-                                Complete.objects.create(user=user, sound=sound)
-                                print("User %s has completed annotations for sound %s" % (user.username, sound.name))
+        start = time.time()
+        exercises = Exercise.objects.filter(data_set=data_set)
+        if options['exercise']:
+            exercises = exercises.filter(name=options['exercise'])
+        user_ids = list(data_set.users.values_list('id', flat=True))
+
+        existing = defaultdict(list)
+        for complete_id, sound_id, user_id in Complete.objects.filter(sound__exercise__in=exercises,
+                                                                      user__in=user_ids).\
+                values_list('id', 'sound_id', 'user_id'):
+            existing[(sound_id, user_id)].append(complete_id)
+        completed = completed_sounds(exercises, user_ids, set(existing))
+        to_create = completed - set(existing)
+        to_delete = [complete_id for key, complete_ids in existing.items() if key not in completed
+                     for complete_id in complete_ids]
+        print("Computed in %.2f seconds" % (time.time() - start))
+
+        if options['verbosity'] > 1:
+            for sound_id, user_id in sorted(to_create):
+                print("User %s has completed annotations for sound %s" % (user_id, sound_id))
+            for key in sorted(set(existing) - completed):
+                print("User %s hasn't completed annotations for sound %s" % (key[1], key[0]))
+
+        if options['dry_run']:
+            print("%s Complete objects would be created and %s deleted" % (len(to_create), len(to_delete)))
+            return
+
+        start = time.time()
+        with transaction.atomic():
+            Complete.objects.bulk_create([Complete(sound_id=sound_id, user_id=user_id)
+                                          for sound_id, user_id in to_create])
+            Complete.objects.filter(id__in=to_delete).delete()
+        print("%s Complete objects created and %s deleted in %.2f seconds" % (len(to_create), len(to_delete),
+                                                                               time.time() - start))
@@ -1,9 +1,12 @@
 import os
 import json
+from concurrent.futures import ProcessPoolExecutor, Future, as_completed
 from django.core.management.base import BaseCommand
+from django.db import connections
 from django.core.exceptions import ObjectDoesNotExist
-from annotation.models import DataSet, Exercise, Tier, Tag, Annotation, User
+from annotation.models import DataSet, User, MediaFile
 import annotation.utils
+import annotation.ingest
 
 
 class Command(BaseCommand):
@@ -28,51 +31,72 @@ class Command(BaseCommand):
                             help='force re-upload annotations')
         parser.add_argument('--create_segments', type=str, default=False,
                             help='create segments for all sounds with specific start/end times')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='number of processes copying and transcoding the sounds')
 
     @staticmethod
-    def create_tiers(tiers_data, exercise):
-        for tier_name, tier_data in tiers_data.items():
-            point_annotations = False
-            if 'point_annotations' in tier_data:
-                point_annotations = True
-            try:
-                tier = Tier.objects.get(name=tier_name, exercise=exercise)
-            except ObjectDoesNotExist:
-                if 'parent_tier' in tier_data or 'special_parent_tier' in tier_data:
-                    tier = Tier.objects.create(name=tier_name, exercise=exercise, point_annotations=point_annotations)
-                    if 'parent_tier' in tier_data:
-                        try:
-                            parent_tier = Tier.objects.get(name=tier_data['parent_tier'], exercise=exercise)
-                        except ObjectDoesNotExist:
-                            parent_tier = Tier.objects.create(name=tier_data['parent_tier'], exercise=exercise,
-                                                              point_annotations=point_annotations)
-                        tier.parent_tier = parent_tier
-                    if 'special_parent_tier' in tier_data:
-                        try:
-                            special_parent_tier = Tier.objects.get(name=tier_data['special_parent_tier'],
-                                                                   exercise=exercise)
-                        except ObjectDoesNotExist:
-                            special_parent_tier = Tier.objects.create(name=tier_data['special_parent_tier'],
-                                                                      exercise=exercise,
-                                                                      point_annotations=point_annotations)
-                        tier.special_parent_tier = special_parent_tier
-                    tier.save()
+    def submit_media_files(pool, dataset_path, data_set, descriptions):
+        """
+        Copy the sounds of all the exercises into media and transcode them in a pool of processes. The files with the
+        same size and modification time as in the manifest are not processed, and the ones with the same content are
+        not copied again.
+        Returns:
+            dict of (exercise id, relative path of the file) -> (destination, future of the result of the copy)
+        """
+        manifest = {m['destination']: m for m in data_set.media_files.values('destination', 'content_hash', 'size',
+                                                                            'mtime', 'filename')}
+        # the connections are closed before the processes of the pool start, so they don't share them
+        connections.close_all()
+
+        media_files = {}
+        for exercise_id, exercise_description in descriptions.items():
+            exercise_name = exercise_description['name']
+            exercise_directory = annotation.utils.create_exercise_directory(data_set.name, exercise_name)
+            relative_paths = [exercise_description[key] for key in ('tanpura', 'ref_media')
+                              if key in exercise_description]
+            relative_paths += [sound_description['path'] for sound_description in exercise_description['recs']]
+            for relative_path in relative_paths:
+                source_path = os.path.join(dataset_path, relative_path)
+                destination = os.path.join(exercise_directory, os.path.basename(relative_path))
+                media_file = manifest.get(destination)
+                # the manifest is used only if the file is still in media
+                if media_file and not os.path.exists(os.path.join(exercise_directory, media_file['filename'])):
+                    media_file = None
+                try:
+                    stat = os.stat(source_path)
+                except OSError:
+                    stat = None
+                if media_file and stat and stat.st_size == media_file['size'] and \
+                        abs(stat.st_mtime - media_file['mtime']) < 0.001:
+                    future = Future()
+                    future.set_result(dict(media_file, seconds=0, copied=False, unchanged=True))
                 else:
-                    tier = Tier.objects.create(name=tier_name, exercise=exercise, point_annotations=point_annotations)
-                if tier_name.find('Overall') != -1 or tier_name.find('entire') != -1:
-                    tier.entire_sound = True
-                if 'similarity_dimensions' in tier_data:
-                    tier.similarity_keys = tier_data['similarity_dimensions']
-                tier.save()
-                print("Created tier %s in exercise %s" % (tier.name, exercise.name))
-            # CREATE TAGS IF DEFINED IN THE RUBRIC FILE
-            if 'rubric' in tier_data:
-                for tag_data in tier_data['rubric']['ratings']:
-                    tag, created = Tag.objects.get_or_create(name=tag_data)
-                    if created:
-                        print("Created tag: %s" % tag.name)
-                    if tier not in tag.tiers.all():
-                        tag.tiers.add(tier)
+                    future = pool.submit(annotation.utils.process_sound_file, source_path, data_set.name,
+                                         exercise_name, os.path.basename(relative_path), media_file)
+                media_files[(exercise_id, relative_path)] = (destination, future)
+        return media_files
+
+    @staticmethod
+    def media_file_result(data_set, dataset_path, relative_path, destination, future):
+        """
+        Get the filename in media of a file copied by the pool, and update its manifest
+        """
+        result = future.result()
+        if result.get('unchanged'):
+            return result['filename']
+        if result['copied']:
+            print("Copied %s in %.2f seconds" % (relative_path, result['seconds']))
+        else:
+            print("%s has the same content, checked in %.2f seconds" % (relative_path, result['seconds']))
+        MediaFile.objects.update_or_create(destination=destination, defaults={
+            'data_set': data_set,
+            'source_path': os.path.join(dataset_path, relative_path),
+            'content_hash': result['content_hash'],
+            'size': result['size'],
+            'mtime': result['mtime'],
+            'filename': result['filename'],
+        })
+        return result['filename']
 
     def handle(self, *args, **options):
         dataset_path = options['path']
@@ -89,116 +113,38 @@ class Command(BaseCommand):
         data_set.save()
 
         description_file_path = os.path.join(dataset_path, options['description'])
-        descriptions = json.load(open(description_file_path))
-        for exercise_id, exercise_description in descriptions.items():
-            exercise_name = exercise_description['name']
+        with open(description_file_path) as description_file:
+            descriptions = json.load(description_file)
+        # # Riyaz tier creation definition
+        # check if there is a rubric file to create the tiers and labels
+        rubric_data = None
+        rubric_file_path = os.path.join(dataset_path, 'rubric.json')
+        if os.path.exists(rubric_file_path):
+            with open(rubric_file_path) as rubric_file:
+                rubric_data = json.load(rubric_file)
+        create_segments = None
+        if options['create_segments']:
+            create_segments = [int(i) for i in str(options['create_segments'])]
+
+        # the sounds are copied and transcoded ahead of the creation of the objects in the database
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            media_files = self.submit_media_files(pool, dataset_path, data_set, descriptions)
+            for exercise_id, exercise_description in descriptions.items():
+                media_filenames = {}
+                exercise_files = {future: (relative_path, destination) for (file_exercise_id, relative_path),
+                                  (destination, future) in media_files.items() if file_exercise_id == exercise_id}
+                for future in as_completed(exercise_files):
+                    relative_path, destination = exercise_files[future]
+                    try:
+                        media_filenames[relative_path] = self.media_file_result(data_set, dataset_path,
+                                                                                relative_path, destination, future)
+                    except Exception as e:
+                        print("Error while copying %s: %s" % (relative_path, e))
 
-            # CREATE EXERCISE
-
-            try:
-                exercise = Exercise.objects.get(exercise_id=exercise_id, data_set=data_set)
-            except ObjectDoesNotExist:
-                exercise = Exercise.objects.create(name=exercise_name, data_set=data_set, exercise_id=exercise_id)
-                annotation.utils.create_exercise_directory(dataset_name, exercise_name)
-
-            # CREATE TIERS
-            # check if there is a rubric file to create the tiers and labels
-
-            # # Riyaz tier creation definition
-            rubric_file_path = os.path.join(dataset_path, 'rubric.json')
-            if os.path.exists(rubric_file_path):
-                rubric_data = json.load(open(rubric_file_path))
-                self.create_tiers(rubric_data, exercise)
-            else:
-                # create initial tier "whole sound"
-                Tier.objects.create(name="entire sound", exercise=exercise, entire_sound=True)
-
-            # CREATE REFERENCE PITCH
-
-            try:
-                reference_pitch_file_relative_path = exercise_description['tanpura']
-                source_path = os.path.join(dataset_path, reference_pitch_file_relative_path)
-                reference_pitch_filename = os.path.basename(reference_pitch_file_relative_path)
-                # copy the file into media
-                destination_path = annotation.utils.copy_sound_into_media(source_path, dataset_name, exercise_name,
-                                                                          reference_pitch_filename)
-                exercise.reference_pitch_sound.name = destination_path
-                exercise.save()
-            except KeyError:
-                print("The exercise %s does not have a pitch reference")
-
-            # CREATE REFERENCE SOUND
-
-            try:
-                reference_sound_file_relative_path = exercise_description['ref_media']
-                source_path = os.path.join(dataset_path, reference_sound_file_relative_path)
-                reference_sound_filename = os.path.basename(reference_sound_file_relative_path)
-
-                # copy the sound into media
-                reference_sound_filename = annotation.utils.copy_sound_into_media(source_path, dataset_name,
-                                                                                  exercise_name,
-                                                                                  reference_sound_filename)
-                name = "%s %s" % (exercise.name, 'reference')
-                reference_sound = annotation.utils.get_or_create_sound_object(exercise, reference_sound_filename,
-                                                                              source_path, name=name)
-                exercise.reference_sound = reference_sound
-                exercise.save()
-
-                # CREATE REFERENCE ANNOTATIONS
-
-                reference_sound_annotations_file_path = os.path.splitext(source_path)[0] + '.trans_json'
-                if os.path.exists(reference_sound_annotations_file_path):
-                    if options['force_annotations']:
-                        reference_sound.annotations.all().delete()
-                    if not reference_sound.annotations.all():
-                        annotation.utils.create_annotations(reference_sound_annotations_file_path, reference_sound,
-                                                            username, True)
-                # Create annotations for reference sound according to parameter
-                if options['create_segments']:
-                    start_time, end_time = [int(i) for i in str(options['create_segments'])]
-                    for tier in exercise.tiers.all():
-                        Annotation.objects.create(name="",
-                                                  start_time=start_time,
-                                                  end_time=end_time, sound=reference_sound, tier=tier,
-                                                  user=user)
-            except KeyError:
-                print("The exercise %s does not have reference sound" % exercise_name)
-
-            # CREATE SOUNDS
-
-            for sound_description in exercise_description['recs']:
                 try:
-                    sound_file_relative_path = sound_description['path']
-                    source_path = os.path.join(dataset_path, sound_file_relative_path)
-                    sound_filename = os.path.basename(sound_file_relative_path)
-
-                    # copy the sound into media
-                    sound_filename = annotation.utils.copy_sound_into_media(source_path, dataset_name, exercise_name,
-                                                                            sound_filename)
-                    name = None
-                    if '_id' in sound_description:
-                        name = sound_description['_id']
-                    sound = annotation.utils.get_or_create_sound_object(exercise, sound_filename, source_path,
-                                                                        name=name)
-
-                    # CREATE ANNOTATIONS
-
-                    sound_annotations_file_path = os.path.splitext(source_path)[0] + '.json'
-                    if os.path.exists(sound_annotations_file_path):
-                        if options['force_annotations']:
-                            sound.annotations.all().delete()
-                        if not sound.annotations.all():
-                            annotation.utils.create_annotations(sound_annotations_file_path, sound, username, False)
-
-                    # Create annotations for each sound according to parameter
-                    if options['create_segments']:
-                        start_time, end_time = [int(i) for i in str(options['create_segments'])]
-                        user = User.objects.get(username=username)
-                        for tier in exercise.tiers.all():
-                            Annotation.objects.create(name="",
-                                                      start_time=start_time,
-                                                      end_time=end_time, sound=sound, tier=tier,
-                                                      user=user)
+                    annotation.ingest.ingest_exercise(data_set, exercise_id, exercise_description, dataset_path,
+                                                      media_filenames, user, rubric_data,
+                                                      options['force_annotations'], create_segments)
                 except Exception as e:
-                    print("Error while creating sounds and annotations from files: %s" % e)
-
+                    print("Error while creating exercise %s, none of its objects were created: %s" %
+                          (exercise_description['name'], e))
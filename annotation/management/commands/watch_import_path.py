@@ -0,0 +1,100 @@
+import os
+import json
+import time
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from annotation.watch import get_watcher
+
+
+def read_description(description_file_path):
+    """
+    Read a description file, or None if it doesn't exist or it is not complete yet
+    """
+    try:
+        with open(description_file_path) as description_file:
+            return json.load(description_file)
+    except (OSError, ValueError):
+        return None
+
+
+def missing_files(dataset_path, descriptions):
+    """
+    Relative paths of the sounds of a description that are not in the data set directory yet
+    """
+    relative_paths = []
+    for exercise_description in descriptions.values():
+        relative_paths += [exercise_description[key] for key in ('tanpura', 'ref_media') if key in exercise_description]
+        relative_paths += [sound_description['path'] for sound_description in exercise_description.get('recs', [])]
+    return [p for p in relative_paths if not os.path.exists(os.path.join(dataset_path, p))]
+
+
+def upload_data_set(dataset_path, description, dataset_name, username, workers):
+    """
+    Upload a data set in the main thread, upload_data_set starts a pool of processes that must not be forked from
+    another thread
+    """
+    print("Uploading %s" % dataset_name)
+    try:
+        call_command('upload_data_set', dataset_path, description, dataset_name, username, workers=workers)
+        print("Uploaded %s" % dataset_name)
+    except Exception as e:
+        print("Error while uploading %s: %s" % (dataset_name, e))
+    finally:
+        # the connections are not used until the next upload, which can be much later
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Watch the import directory and upload the data sets that change in it. Each directory of the import directory is
+    a data set with a description file. A data set is uploaded when its files have not changed for --settle seconds
+    and its description file is complete, so the files that are still being written are not uploaded. The files
+    already uploaded are skipped by upload_data_set, so a data set is uploaded again every time a recording is added.
+    The data sets are uploaded one at a time, the sounds of each one are transcoded by the processes of
+    upload_data_set.
+    """
+
+    help = 'Watch the import directory and upload the data sets that change in it'
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('user', type=str, help='user name to create the annotations')
+        parser.add_argument('--path', type=str, default=settings.IMPORT_PATH, help='directory to watch')
+        parser.add_argument('--description', type=str, default='description.json',
+                            help='name of the description file of the data sets')
+        parser.add_argument('--settle', type=float, default=10,
+                            help='seconds without changes before a data set is uploaded')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='seconds between scans of the directory when inotify is not available')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='number of processes copying and transcoding the sounds of a data set')
+
+    def handle(self, *args, **options):
+        root = options['path']
+        watcher = get_watcher(root, options['interval'])
+        # the data sets added while the command was not running are uploaded too
+        pending = {d: time.time() - options['settle'] for d in os.listdir(root) if os.path.isdir(os.path.join(root, d))}
+
+        while True:
+            for dataset_name in watcher.changes(timeout=1):
+                pending[dataset_name] = time.time()
+
+            # a data set is pending only once however many times it changes, the data sets are uploaded one at a time
+            # and the changes made during an upload are found by the next scan
+            settled = [(changed_at, dataset_name) for dataset_name, changed_at in pending.items()
+                       if time.time() - changed_at >= options['settle']]
+            if not settled:
+                continue
+            _, dataset_name = min(settled)
+            del pending[dataset_name]
+            dataset_path = os.path.join(root, dataset_name)
+            descriptions = read_description(os.path.join(dataset_path, options['description']))
+            if descriptions is None:
+                # it is checked again when the description file changes
+                continue
+            missing = missing_files(dataset_path, descriptions)
+            if missing:
+                print("%s sounds of %s are not there yet" % (len(missing), dataset_name))
+            upload_data_set(dataset_path, options['description'], dataset_name, options['user'], options['workers'])
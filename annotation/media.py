@@ -0,0 +1,67 @@
+import os
+import mimetypes
+import posixpath
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import HttpResponse
+from django.utils._os import safe_join
+
+from .models import DataSet, Exercise, Sound
+from .ranges import ranged_file_response
+
+
+def media_file_path(path):
+    """
+    Path in media of the path of a media url
+    Returns:
+        (path relative to MEDIA_ROOT, absolute path), or None if the path is out of MEDIA_ROOT
+    """
+    relative_path = posixpath.normpath(path).lstrip('/')
+    try:
+        return relative_path, safe_join(settings.MEDIA_ROOT, relative_path)
+    except SuspiciousFileOperation:
+        return None
+
+
+def can_access_media(user, relative_path):
+    """
+    Check if a user can get a file of media: the sounds are in the directory of their data set and the reference pitch
+    sounds in the directory of their exercise, the user has to be a user of the data set
+    """
+    name = relative_path.split('/', 1)[0]
+    if DataSet.objects.filter(name=name, users=user).exists():
+        return True
+    return Exercise.objects.filter(reference_pitch_sound=relative_path, data_set__users=user).exists()
+
+
+def user_sounds(user):
+    """
+    Sounds whose media a user can get, the ones of the data sets of the user like in can_access_media
+    """
+    return Sound.objects.filter(exercise__data_set__users=user)
+
+
+def media_response(request, relative_path, path):
+    """
+    Send a file of media. With MEDIA_OFFLOAD the response only has a header telling the front server (or uwsgi) which
+    file to send, so the worker is free during the transfer, otherwise it is sent with ranged_file_response.
+    """
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    offload = settings.MEDIA_OFFLOAD
+    if not offload:
+        return ranged_file_response(request, path, content_type)
+    response = HttpResponse(content_type=content_type)
+    if offload == 'x-accel-redirect':
+        # nginx sends the file of an internal location with MEDIA_ROOT as its alias
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative_path)
+    elif offload == 'x-sendfile':
+        # Apache's mod_xsendfile unescapes the path
+        response['X-Sendfile'] = quote(path)
+    elif offload == 'uwsgi':
+        # the static route of uwsgi.ini sends it from the offload threads
+        response['X-Sendfile'] = path
+    else:
+        raise ValueError("Unknown MEDIA_OFFLOAD %s" % offload)
+    return response
@@ -0,0 +1,24 @@
+from django.utils import timezone
+
+from .models import MediaJob
+from .peaks import has_peaks, create_peaks_file
+from .spectrogram import get_spectrogram_tile, create_spectrogram_tile
+
+
+def run_media_job(job):
+    """
+    Compute the file of a media job, unless it was computed after the job was queued. The job is removed when it is
+    done, and marked as failed with the error otherwise.
+    Args:
+        job: media job object, claimed with MediaJob.claim()
+    """
+    try:
+        sound_path = job.sound.get_media_path()
+        if job.kind == MediaJob.PEAKS and not has_peaks(sound_path):
+            create_peaks_file(sound_path)
+        elif job.kind == MediaJob.SPECTROGRAM_TILE and get_spectrogram_tile(sound_path, job.level, job.index) is None:
+            create_spectrogram_tile(sound_path, job.level, job.index)
+    except Exception as e:
+        MediaJob.objects.filter(id=job.id).update(status=MediaJob.FAILED, error=str(e), updated_at=timezone.now())
+        raise
+    job.delete()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+from annotation.tier_graph import build_tier_graph
+
+
+def update_tier_graphs(apps, schema_editor):
+    Exercise = apps.get_model('annotation', 'Exercise')
+    Tier = apps.get_model('annotation', 'Tier')
+    for exercise in Exercise.objects.all():
+        graph = build_tier_graph(Tier.objects.filter(exercise=exercise).
+                                 values_list('id', 'parent_tier_id', 'special_parent_tier_id'))
+        for tier_id, related_tiers in graph.items():
+            Tier.objects.filter(id=int(tier_id)).update(related_tiers=related_tiers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0022_auto_20171009_1423'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='related_tiers',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(update_tier_graphs, migrations.RunPython.noop),
+    ]
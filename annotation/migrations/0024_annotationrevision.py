@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0023_tier_related_tiers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveIntegerField(default=0)),
+                ('sound', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_revisions', to='annotation.Sound')),
+                ('tier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_revisions', to='annotation.Tier')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='annotationrevision',
+            unique_together=set([('sound', 'tier')]),
+        ),
+    ]
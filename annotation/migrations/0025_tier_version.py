@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0024_annotationrevision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0026_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotationrevision',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='DataSetExportMark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exported_at', models.DateTimeField()),
+                ('tiers_version', models.CharField(max_length=100)),
+                ('data_set', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='export_mark', to='annotation.DataSet')),
+            ],
+        ),
+    ]
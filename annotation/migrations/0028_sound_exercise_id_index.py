@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0027_incremental_export'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='sound',
+            index_together=set([('exercise', 'id')]),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def compute_statistics(apps, schema_editor):
+    Exercise = apps.get_model('annotation', 'Exercise')
+    Sound = apps.get_model('annotation', 'Sound')
+    Annotation = apps.get_model('annotation', 'Annotation')
+    AnnotationSimilarity = apps.get_model('annotation', 'AnnotationSimilarity')
+    ExerciseStatistics = apps.get_model('annotation', 'ExerciseStatistics')
+    DailyStatistics = apps.get_model('annotation', 'DailyStatistics')
+
+    completed = dict(Sound.objects.filter(annotation_state='C').values('exercise_id').
+                     annotate(count=Count('id')).values_list('exercise_id', 'count'))
+    ExerciseStatistics.objects.bulk_create([
+        ExerciseStatistics(exercise_id=exercise_id, number_of_sounds=number_of_sounds,
+                           number_of_completed_sounds=completed.get(exercise_id, 0))
+        for exercise_id, number_of_sounds in Exercise.objects.annotate(count=Count('sounds')).
+        values_list('id', 'count')])
+
+    days = defaultdict(lambda: {'segments': 0, 'similarities': 0})
+    for a in Annotation.objects.annotate(date=TruncDate('created_at')).\
+            values('sound__exercise_id', 'sound__exercise__data_set_id', 'date').annotate(count=Count('id')):
+        days[(a['sound__exercise_id'], a['sound__exercise__data_set_id'], a['date'])]['segments'] = a['count']
+    for s in AnnotationSimilarity.objects.annotate(date=TruncDate('created_at')).\
+            values('similar_sound__sound__exercise_id', 'similar_sound__sound__exercise__data_set_id', 'date').\
+            annotate(count=Count('id')):
+        days[(s['similar_sound__sound__exercise_id'], s['similar_sound__sound__exercise__data_set_id'],
+              s['date'])]['similarities'] = s['count']
+    DailyStatistics.objects.bulk_create([
+        DailyStatistics(exercise_id=exercise_id, data_set_id=data_set_id, date=date, **counts)
+        for (exercise_id, data_set_id, date), counts in days.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0028_sound_exercise_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('segments', models.IntegerField(default=0)),
+                ('similarities', models.IntegerField(default=0)),
+                ('data_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_statistics', to='annotation.DataSet')),
+                ('exercise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_statistics', to='annotation.Exercise')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExerciseStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number_of_sounds', models.IntegerField(default=0)),
+                ('number_of_completed_sounds', models.IntegerField(default=0)),
+                ('exercise', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='annotation.Exercise')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailystatistics',
+            unique_together=set([('exercise', 'date')]),
+        ),
+        migrations.RunPython(compute_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0029_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destination', models.CharField(max_length=500, unique=True)),
+                ('source_path', models.CharField(max_length=500)),
+                ('content_hash', models.CharField(max_length=40)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('filename', models.CharField(max_length=200)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('data_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_files', to='annotation.DataSet')),
+            ],
+        ),
+    ]
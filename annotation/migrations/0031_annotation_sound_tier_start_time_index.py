@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0030_mediafile'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='annotation',
+            index_together=set([('sound', 'tier', 'start_time')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('annotation', '0032_mediajob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediajob',
+            name='index',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediajob',
+            name='level',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='kind',
+            field=models.CharField(choices=[('peaks', 'peaks'), ('tile', 'spectrogram tile')], max_length=10),
+        ),
+    ]
@@ -1,15 +1,55 @@
 import os
-from decimal import Decimal
-
-from django.db import models
+import hashlib
+import datetime
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q, F, Case, When, Value, Sum, Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import JSONField
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .tier_graph import RELATIONS, build_tier_graph, find_cycle
 
 
 def exercise_upload_to(instance, filename):
     return os.path.join(instance.name, filename)
 
 
+def to_annotation_time(value):
+    """
+    Round a time sent by the interface to the precision stored in the Annotation model
+    """
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+
+
+class AnnotationConflict(Exception):
+    """
+    Raised when the annotations of a tier were modified after the revision the changes were made on
+    """
+    def __init__(self, revision):
+        super(AnnotationConflict, self).__init__("The annotations were modified, current revision is %s" % revision)
+        self.revision = revision
+
+
+def unique_ids(ids):
+    """
+    Remove the repeated ids of a sequence keeping the order
+    """
+    return list(OrderedDict.fromkeys(ids))
+
+
 class DataSet(models.Model):
     users = models.ManyToManyField(User, related_name="datasets")
     name = models.CharField(max_length=50)
@@ -17,6 +57,49 @@ class DataSet(models.Model):
     def __str__(self):
         return self.name
 
+    def get_content_version(self):
+        """
+        Get a version of the content of the data set that changes every time its annotations, its tiers or its sounds
+        change, computed with aggregate queries
+        Returns: string
+        """
+        revisions = AnnotationRevision.objects.filter(sound__exercise__data_set=self).\
+            aggregate(count=Count('id'), total=Sum('revision'))
+        sounds = Sound.objects.filter(exercise__data_set=self).aggregate(count=Count('id'), last=Max('id'))
+        content = [revisions['count'], revisions['total'], self.get_tiers_version(), sounds['count'], sounds['last']]
+        return hashlib.md5(':'.join(str(i) for i in content).encode()).hexdigest()
+
+    def get_changed_sound_ids(self, since):
+        """
+        Get the sounds of the data set with annotations changed after a date. The revisions of the annotations are
+        updated also when annotations are removed. When the annotations of a reference sound change, all the sounds
+        of its exercise change, as their similarities contain the times of the reference annotations.
+        Args:
+            since: datetime
+
+        Returns:
+            set of sound ids
+        """
+        sound_ids = set(Annotation.objects.filter(sound__exercise__data_set=self, updated_at__gt=since).
+                        values_list('sound_id', flat=True).distinct())
+        sound_ids.update(AnnotationSimilarity.objects.filter(similar_sound__sound__exercise__data_set=self,
+                                                             updated_at__gt=since).
+                         values_list('similar_sound__sound_id', flat=True).distinct())
+        sound_ids.update(AnnotationRevision.objects.filter(sound__exercise__data_set=self, updated_at__gt=since).
+                         values_list('sound_id', flat=True).distinct())
+        changed_exercises = self.exercises.filter(reference_sound__in=sound_ids)
+        sound_ids.update(Sound.objects.filter(exercise__in=changed_exercises).values_list('id', flat=True))
+        return sound_ids
+
+    def get_tiers_version(self):
+        """
+        Get a version of the tiers of the data set that changes every time a tier is created, changed or removed
+        Returns: string
+        """
+        tiers = Tier.objects.filter(exercise__data_set=self).\
+            aggregate(count=Count('id'), last=Max('id'), total=Sum('version'))
+        return '%s:%s:%s' % (tiers['count'], tiers['last'], tiers['total'])
+
 
 class Exercise(models.Model):
     name = models.CharField(max_length=50)
@@ -29,6 +112,19 @@ class Exercise(models.Model):
     def __str__(self):
         return self.name
 
+    def update_tier_graph(self):
+        """
+        Rebuild the related_tiers of all the tiers of the exercise. It should be called every time the parent or
+        special parent of a tier of the exercise changes.
+        Returns: dict of tier id -> related tiers
+        """
+        graph = build_tier_graph(self.tiers.values_list('id', 'parent_tier_id', 'special_parent_tier_id'))
+        # one update for each tier, an exercise has a few tiers
+        with transaction.atomic():
+            for tier_id, related in graph.items():
+                Tier.objects.filter(id=int(tier_id)).update(related_tiers=related)
+        return graph
+
 
 def default_keys():
     return ["value", ]
@@ -46,63 +142,68 @@ class Tier(models.Model):
     point_annotations = models.BooleanField(default=False)
     similarity_keys = JSONField(blank=True, null=True, default=default_keys)
     created_at = models.DateTimeField(auto_now_add=True)
+    # materialized sync, special parent and special child tiers, see Exercise.update_tier_graph
+    related_tiers = JSONField(blank=True, null=True)
+    # incremented when the tier or its tags change, used to invalidate the cached annotations
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        # a tier can't be related to itself through its parents, the annotations would be synchronised forever
+        tiers = [t for t in Tier.objects.filter(exercise=self.exercise_id).
+                 values_list('id', 'parent_tier_id', 'special_parent_tier_id') if t[0] != self.id]
+        tiers.append((self.id, self.parent_tier_id, self.special_parent_tier_id))
+        if find_cycle(tiers):
+            raise ValidationError("The sync and parent tiers of %s can't include the tier itself" % self.name)
+
+    def save(self, *args, **kwargs):
+        self.version += 1
+        super(Tier, self).save(*args, **kwargs)
+        self.related_tiers = self.exercise.update_tier_graph().get(str(self.id))
+
+    def delete(self, *args, **kwargs):
+        exercise = self.exercise
+        ret = super(Tier, self).delete(*args, **kwargs)
+        exercise.update_tier_graph()
+        return ret
+
+    def get_related_tier_ids(self):
+        """
+        Get the ids of the related tiers from the materialized tier graph. They are read from the database as the
+        graph may have changed since this object was loaded.
+        Returns: dict of relation ('sync_childs', 'sync_parent', 'special_parent', 'special_child') -> list of tier ids
+        """
+        related_tiers = Tier.objects.values_list('related_tiers', flat=True).get(id=self.id)
+        if related_tiers is None:
+            related_tiers = self.exercise.update_tier_graph().get(str(self.id))
+        return related_tiers or {relation: [] for relation in RELATIONS}
+
+    def get_related_tiers(self, *relations):
+        related_ids = self.get_related_tier_ids()
+        tier_ids = unique_ids(tier_id for relation in relations for tier_id in related_ids[relation])
+        tiers = Tier.objects.in_bulk(tier_ids)
+        return [tiers[tier_id] for tier_id in tier_ids if tier_id in tiers]
+
     def get_special_child_tiers(self):
-        t = []
-        for special_child in self.special_child_tiers.all():
-            # add also sync tiers
-            for sync_tier in special_child.child_tiers.all():
-                t.append(sync_tier)
-            if special_child.parent_tier:
-                t.append(special_child.parent_tier)
-            t.append(special_child)
-            t.extend(special_child.get_special_child_tiers())
-        return t
+        return self.get_related_tiers('special_child')
 
     def get_special_parent_tiers(self):
-        t = []
-        if self.special_parent_tier:
-            # add also sync tiers
-            for sync_tier in self.special_parent_tier.child_tiers.all():
-                t.append(sync_tier)
-            if self.special_parent_tier.parent_tier:
-                t.append(self.special_parent_tier.parent_tier)
-            t.append(self.special_parent_tier)
-            t.extend(self.special_parent_tier.get_special_parent_tiers())
-        return t
+        return self.get_related_tiers('special_parent')
 
     def get_sync_parent(self):
-        t = []
-        if self.parent_tier:
-            for sync_tier in self.parent_tier.get_special_child_tiers():
-                t.append(sync_tier)
-            for special_parent_tier in self.parent_tier.get_special_parent_tiers():
-                t.append(special_parent_tier)
-            t.append(self.parent_tier)
-            t.extend(self.parent_tier.get_sync_parent())
-        return t
+        return self.get_related_tiers('sync_parent')
 
     def get_sync_childs(self):
-        t = []
-        for child in self.child_tiers.all():
-            for sync_tier in child.get_special_child_tiers():
-                t.append(sync_tier)
-            for special_parent_tier in child.get_special_parent_tiers():
-                t.append(special_parent_tier)
-            t.append(child)
-            t.extend(child.get_sync_childs())
-        return t
+        return self.get_related_tiers('sync_childs')
 
     def get_sync_tiers(self):
         """
         Search for sync tiers (defined in the model as parent tier) and all special child and parents of each sync tier
         Returns: list of tiers
         """
-        t = self.get_sync_childs() + self.get_sync_parent()
-        return t
+        return self.get_related_tiers('sync_childs', 'sync_parent')
 
 
 class Sound(models.Model):
@@ -119,68 +220,26 @@ class Sound(models.Model):
     is_discarded = models.BooleanField(default=False)
     annotation_state = models.CharField(max_length=2, choices=ANNOTATION_CHOICES, default='E')
 
+    class Meta:
+        # the sounds of an exercise are listed ordered by id
+        index_together = [('exercise', 'id')]
+
     def __str__(self):
         return self.filename
 
-    def get_annotations_as_dict(self):
-        ret = {}
-        for tier in self.exercise.tiers.all():
-            annotations = Annotation.objects.filter(sound=self, tier=tier)
-
-            ret[tier.name] = []
-            for i in annotations.all():
-                if i.annotationsimilarity_set.all():
-                    similarities = {}
-                    for s in i.annotationsimilarity_set.all():
-                        similarities[s.user.username] = (float(s.similarity['value']))
-                    ret[tier.name].append({
-                        'ref_start_time': float(s.reference.start_time),
-                        'start_time': float(i.start_time),
-                        'ref_end_time': float(s.reference.end_time),
-                        'end_time': float(i.end_time),
-                        'similarity': similarities
-                        })
-                else:
-                    ret[tier.name].append({
-                        'start_time': float(i.start_time),
-                        'end_time': float(i.end_time),
-                        'name': i.name
-                    })
-        return ret
+    def get_media_path(self):
+        """
+        Path of the file of the sound in media
+        """
+        return os.path.join(settings.MEDIA_ROOT, self.exercise.data_set.name, self.exercise.name, self.filename)
 
-    def get_annotations_for_tier(self, tier, user=False):
-        ret = []
-        for a in Annotation.objects.filter(sound=self, tier=tier).all():
-            annotation = {
-                "start": a.start_time,
-                "end": a.end_time,
-                "annotation": a.name,
-                "id": a.id,
-                }
-
-            if user:
-                annotation['similarity'] = 'no'
-                references = a.annotationsimilarity_set
-                # If user is staff then we return all the AnnotationSimilarity values
-                if not user.is_staff:
-                    references = references.filter(user=user)
-
-                references = references.all()
-                many_values = []
-                for ref in references:
-                    many_values.append(ref.similarity)
-
-                if len(many_values) > 1:
-                    annotation['manyValues'] = many_values
-
-                if len(references):
-                    reference = references[0]
-                    annotation['similarity'] = "yes"
-                    annotation['similValue'] = reference.similarity
-                    annotation['reference'] = reference.reference_id
-            ret.append(annotation)
+    def get_annotations_as_dict(self):
+        from .serializers import annotations_as_dict
+        return annotations_as_dict(self)
 
-        return ret
+    def get_annotations_for_tier(self, tier, user=False, window=None):
+        from .serializers import annotations_for_tier
+        return annotations_for_tier(self, tier, user, window)
 
     @staticmethod
     def check_annotations_correspondence(old_annotations, new_annotations):
@@ -208,154 +267,359 @@ class Sound(models.Model):
 
         return there_is_end_time_correspondence and there_is_start_time_correspondence
 
-    def update_annotations(self, tier, annotations, user):
-        added = {}
-        old_annotations = Annotation.objects.filter(sound=self, tier=tier)
-
-        # check if all annotations in special parent tier have a correspondence in the special child tier. This would
-        # mean parent annotations shouldn't be modified.
-        deny_special_parent_modification = False
-        if tier.special_parent_tier:
-            special_parent_related_annotations = Annotation.objects.filter(sound=self,
-                                                                           tier=tier.special_parent_tier).all()
-            deny_special_parent_modification = self.check_annotations_correspondence(
-                special_parent_related_annotations, annotations)
-
-        for a in annotations:
-            a_obj = None
-            if isinstance(a['id'], int):
-                a_obj = old_annotations.filter(pk=a['id'])
-
-            if a_obj and a_obj.count():
-                new_annotation = a_obj[0]
-
-                # Update the annotations in the sync tiers
-                for sync_tier in tier.get_sync_tiers():
-                    parent_start_time_annotations = Annotation.objects.filter(sound=self,
-                                                                              start_time=new_annotation.start_time,
-                                                                              tier=sync_tier)
-                    parent_end_time_annotations = Annotation.objects.filter(sound=self,
-                                                                            end_time=new_annotation.end_time,
-                                                                            tier=sync_tier)
-                    for rel in parent_end_time_annotations:
-                        a_copy = a.copy()
-                        a_copy['start'] = rel.start_time
-                        self.update_annotation_vals(rel, a_copy, user)
-                    for rel in parent_start_time_annotations:
-                        a_copy = a.copy()
-                        a_copy['end'] = rel.end_time
-                        self.update_annotation_vals(rel, a_copy, user)
-
-                # Update the annotations in the special parent tier and the corresponding special parent tiers
-                for special_parent_tier in tier.get_special_parent_tiers():
-                    special_parent_start_time_annotations = Annotation.objects.filter(sound=self,
-                                                                                      start_time=new_annotation.
-                                                                                      start_time,
-                                                                                      tier=special_parent_tier)
-                    special_parent_end_time_annotations = Annotation.objects.filter(sound=self,
-                                                                                    end_time=new_annotation.end_time,
-                                                                                    tier=special_parent_tier)
-                    if not deny_special_parent_modification:
-                        for rel in special_parent_start_time_annotations:
-                            a_copy = a.copy()
-                            a_copy['end'] = rel.end_time
-                            self.update_annotation_vals(rel, a_copy, user)
-                        for rel in special_parent_end_time_annotations:
-                            a_copy = a.copy()
-                            a_copy['start'] = rel.start_time
-                            self.update_annotation_vals(rel, a_copy, user)
-
-                # Update the annotations in special child tiers
-                if tier.special_child_tiers.all():
-                    start_to_be_changed = end_to_be_changed = None
-                    annotation_to_be_changed = Annotation.objects.get(id=a['id'])
-                    if annotation_to_be_changed.start_time != a['start']:
-                        start_to_be_changed = annotation_to_be_changed.start_time
-                    if annotation_to_be_changed.end_time != a['end']:
-                        end_to_be_changed = annotation_to_be_changed.end_time
-                    for special_child in tier.get_special_child_tiers():
-                        if start_to_be_changed:
-                            if Annotation.objects.filter(sound=self, tier=special_child,
-                                                         start_time=start_to_be_changed).all():
-                                child_annotation = Annotation.objects.filter(sound=self, tier=special_child,
-                                                                             start_time=start_to_be_changed).all()[0]
-                                child_annotation.start_time = a['start']
-                                child_annotation.save()
-                        if end_to_be_changed:
-                            if Annotation.objects.filter(sound=self, tier=special_child,
-                                                         end_time=end_to_be_changed).all():
-                                child_annotation = Annotation.objects.filter(sound=self, tier=special_child,
-                                                                             end_time=end_to_be_changed).all()[0]
-                                child_annotation.end_time = a['end']
-                                child_annotation.save()
-
-                # Update the annotation in the current tier
-                self.update_annotation_vals(new_annotation, a, user, True)
-            else:
-                new_annotation = Annotation.objects.create(sound=self, start_time=a['start'], end_time=a['end'],
-                                                           tier=tier, name=a['annotation'], user=user)
-
-                for sync in tier.get_sync_tiers():
-                    Annotation.objects.create(sound=self, start_time=a['start'], end_time=a['end'], tier=sync,
-                                              user=user)
-
-                for child in tier.get_special_child_tiers():
-                    Annotation.objects.create(sound=self, start_time=a['start'], end_time=a['end'], tier=child,
-                                              user=user)
-
-            # Re-create all AnnotationSimilarity for this user
-            new_annotation.annotationsimilarity_set.filter(user=user).delete()
-            if a['similarity'] == 'yes':
-                ref = Annotation.objects.get(id=int(a['reference']))
-                AnnotationSimilarity.objects.create(reference=ref, similar_sound=new_annotation,
-                                                    similarity=a['similValue'], user=user)
-
-            added[new_annotation.id] = {'start': a['start'], 'end': a['end']}
-
-        # Remove old_annotation that are not in new list
-        for a in old_annotations.all():
-            if a.id not in added:
-                # Delete annotation in the parent tier and child
-                Annotation.objects.filter(sound=self, start_time=a.start_time,
-                                          end_time=a.end_time, name=a.name).delete()
-
-        # update annotation_state of sound
-        num_ref_annotations = Annotation.objects.filter(sound=self.exercise.reference_sound, tier=tier).count()
-        added_annotations = Annotation.objects.filter(sound=self, tier=tier)
-        num_similarity = AnnotationSimilarity.objects.filter(similar_sound__in=added_annotations).count()
+    def get_annotation_revision(self, tier):
+        """
+        Get the revision of the annotations of a tier of the sound, it is incremented on every change
+        """
+        revision = AnnotationRevision.objects.filter(sound=self, tier=tier).values_list('revision', flat=True).first()
+        return revision or 0
+
+    def lock_annotation_revision(self, tier, revision=None):
+        """
+        Lock the revisions of the annotations of a tier and of its related tiers until the end of the transaction, so
+        concurrent changes of the tiers are applied one after the other. The missing revisions are created first and
+        all of them are locked in tier order, so two changes on related tiers can't wait for each other
+        Args:
+            tier: tier object
+            revision: revision the changes were made on. If it is given and it isn't the current one, the changes
+                would overwrite someone else's changes
+
+        Returns:
+            AnnotationRevision object
+        Raises:
+            AnnotationConflict if the revision isn't the current one
+        """
+        tier_ids = unique_ids([tier.id] + [tier_id for tier_ids in tier.get_related_tier_ids().values()
+                                           for tier_id in tier_ids])
+        existing = set(AnnotationRevision.objects.filter(sound=self, tier__in=tier_ids).
+                       values_list('tier_id', flat=True))
+        for tier_id in sorted(set(tier_ids) - existing):
+            AnnotationRevision.objects.get_or_create(sound=self, tier_id=tier_id)
+        revisions = AnnotationRevision.objects.select_for_update().filter(sound=self, tier__in=tier_ids).\
+            order_by('tier_id')
+        annotation_revision = next(r for r in revisions if r.tier_id == tier.id)
+        if revision is not None and int(revision) != annotation_revision.revision:
+            raise AnnotationConflict(annotation_revision.revision)
+        return annotation_revision
+
+    def increment_annotation_revisions(self, tier_ids):
+        """
+        Increment the revisions of the annotations of the given tiers of the sound after changing them
+        """
+        increment_sounds_annotation_revisions([self.id], tier_ids)
+
+    def update_annotations(self, tier, annotations, user, revision=None):
+        """
+        Replace the annotations of the tier with the list of annotations sent by the interface. Annotations with the
+        id of an existing annotation of the tier are updated, the rest are created and the existing annotations that
+        are not in the list are removed. The changes are propagated to the related tiers.
+        Args:
+            tier: tier object
+            annotations: list of annotation dicts as sent by the interface
+            user: user object
+            revision: optional revision of the annotations the list was made on
+
+        Returns:
+            True
+        Raises:
+            AnnotationConflict if the revision is given and the annotations were modified after it
+        """
+        with transaction.atomic():
+            self.lock_annotation_revision(tier, revision)
+            old_annotations = {a.id: a for a in Annotation.objects.filter(sound=self, tier=tier)}
+
+            # check if all annotations in special parent tier have a correspondence in the special child tier. This
+            # would mean parent annotations shouldn't be modified.
+            deny_special_parent_modification = False
+            if tier.special_parent_tier_id:
+                special_parent_related_annotations = Annotation.objects.filter(sound=self,
+                                                                               tier=tier.special_parent_tier_id)
+                deny_special_parent_modification = self.check_annotations_correspondence(
+                    special_parent_related_annotations, annotations)
+
+            updated = OrderedDict()
+            created = []
+            similarities = {}
+            for index, a in enumerate(annotations):
+                start_time = to_annotation_time(a['start'])
+                end_time = to_annotation_time(a['end'])
+                if isinstance(a['id'], int) and a['id'] in old_annotations:
+                    key = a['id']
+                    updated[key] = (start_time, end_time, a['annotation'])
+                else:
+                    # annotations created in the interface don't have an id in the database yet
+                    key = ('new', index)
+                    created.append((key, start_time, end_time, a['annotation']))
+
+                # Re-create all AnnotationSimilarity for this user
+                similarities[key] = None
+                if a['similarity'] == 'yes':
+                    similarities[key] = (int(a['reference']), a['similValue'])
+
+            deleted = [annotation_id for annotation_id in old_annotations if annotation_id not in updated]
+
+            self.apply_annotation_changes(tier, user, updated, created, deleted, similarities,
+                                          deny_special_parent_modification)
+        return True
+
+    def patch_annotations(self, tier, operations, user, revision):
+        """
+        Apply to the annotations of a tier only the operations done in the interface since the given revision. The
+        changes are propagated to the related tiers as in update_annotations.
+        Args:
+            tier: tier object
+            operations: list of dicts with the operation 'op' and the 'id' of the annotation. Operations are:
+                'add' (with 'start', 'end' and optionally 'annotation'; the id is the one given by the interface),
+                'move' (with 'start' and 'end'), 'rename' (with 'annotation'), 'delete',
+                'set_similarity' (with 'reference' and 'similValue') and 'clear_similarity'
+            user: user object
+            revision: revision of the annotations the operations were made on
+
+        Returns:
+            the new revision and a dict of the ids given by the interface to the added annotations -> database ids
+        Raises:
+            AnnotationConflict if the annotations were modified after the revision
+            ValueError if an operation is not valid
+        """
+        with transaction.atomic():
+            annotation_revision = self.lock_annotation_revision(tier, revision)
+
+            existing_annotations = {a.id: a for a in Annotation.objects.filter(
+                sound=self, tier=tier, id__in=[o['id'] for o in operations if isinstance(o['id'], int)])}
+            created = OrderedDict()
+            updated = OrderedDict()
+            deleted = []
+            similarities = {}
+            for operation in operations:
+                key = operation['id']
+                if operation['op'] == 'add':
+                    if isinstance(key, int) or key in created:
+                        raise ValueError("Annotation %s already exists" % key)
+                    created[key] = [to_annotation_time(operation['start']), to_annotation_time(operation['end']),
+                                    operation.get('annotation', '')]
+                    continue
+
+                if key in created:
+                    values = created[key]
+                elif key in existing_annotations and key not in deleted:
+                    a = existing_annotations[key]
+                    values = updated.setdefault(key, [a.start_time, a.end_time, a.name])
+                else:
+                    raise ValueError("Annotation %s doesn't exist in tier %s" % (key, tier.name))
+
+                if operation['op'] == 'move':
+                    values[0] = to_annotation_time(operation['start'])
+                    values[1] = to_annotation_time(operation['end'])
+                elif operation['op'] == 'rename':
+                    values[2] = operation['annotation']
+                elif operation['op'] == 'delete':
+                    similarities.pop(key, None)
+                    if key in created:
+                        del created[key]
+                    else:
+                        del updated[key]
+                        deleted.append(key)
+                elif operation['op'] == 'set_similarity':
+                    similarities[key] = (int(operation['reference']), operation['similValue'])
+                elif operation['op'] == 'clear_similarity':
+                    similarities[key] = None
+                else:
+                    raise ValueError("Unknown operation %s" % operation['op'])
+
+            deny_special_parent_modification = False
+            if tier.special_parent_tier_id and updated:
+                new_annotations = [{'start': start_time, 'end': end_time} for annotation_id, start_time, end_time in
+                                   Annotation.objects.filter(sound=self, tier=tier).exclude(id__in=deleted).
+                                   exclude(id__in=list(updated)).values_list('id', 'start_time', 'end_time')]
+                new_annotations += [{'start': values[0], 'end': values[1]}
+                                    for values in list(updated.values()) + list(created.values())]
+                deny_special_parent_modification = self.check_annotations_correspondence(
+                    Annotation.objects.filter(sound=self, tier=tier.special_parent_tier_id), new_annotations)
+
+            created_ids = self.apply_annotation_changes(
+                tier, user, OrderedDict((k, tuple(v)) for k, v in updated.items()),
+                [(k,) + tuple(v) for k, v in created.items()], deleted, similarities, deny_special_parent_modification)
+        return annotation_revision.revision + 1, created_ids
+
+    def apply_annotation_changes(self, tier, user, updated, created, deleted, similarities,
+                                 deny_special_parent_modification=False):
+        """
+        Apply a set of changes to the annotations of a tier and propagate them to the sync, special parent and special
+        child tiers. The affected annotations are loaded and written in bulk, so the number of queries doesn't depend
+        on the number of changed annotations. The sound annotation_state and the Complete object of the user are
+        updated afterwards.
+        Args:
+            tier: tier object where the changes are made
+            user: user object making the changes
+            updated: dict of annotation id -> (start_time, end_time, name) of the annotations of the tier to modify
+            created: list of (key, start_time, end_time, name) of the annotations to create in the tier
+            deleted: list of ids of the annotations of the tier to remove
+            similarities: dict of annotation id or creation key -> (reference id, similarity value), or None to only
+                remove the AnnotationSimilarity of the user for that annotation
+            deny_special_parent_modification: if True the annotations of the special parent tiers are not modified
+
+        Returns:
+            dict of creation key -> id of the created annotation
+        """
+        related_tier_ids = tier.get_related_tier_ids()
+        sync_tier_ids = unique_ids(related_tier_ids['sync_childs'] + related_tier_ids['sync_parent'])
+        special_parent_tier_ids = related_tier_ids['special_parent']
+        special_child_tier_ids = related_tier_ids['special_child']
+
+        # check the references before writing anything
+        reference_ids = {value[0] for value in similarities.values() if value}
+        if reference_ids:
+            existing_reference_ids = set(Annotation.objects.filter(id__in=reference_ids).values_list('id', flat=True))
+            if reference_ids - existing_reference_ids:
+                raise Annotation.DoesNotExist("Reference annotations %s don't exist" %
+                                              sorted(reference_ids - existing_reference_ids))
+
+        old_annotations = {}
+        if updated or deleted:
+            old_annotations = {a.id: a for a in Annotation.objects.filter(sound=self, tier=tier,
+                                                                          id__in=list(updated) + list(deleted))}
+
+        # Update the annotations in the related tiers that share start/end times with the modified annotations.
+        # In sync tiers (and special parent tiers, unless denied) all of them follow the modified annotation, in special
+        # child tiers only the first one
+        changes = {}
+        shared_tier_ids = set(sync_tier_ids)
+        if not deny_special_parent_modification:
+            shared_tier_ids.update(special_parent_tier_ids)
+        child_tier_ids = set(special_child_tier_ids) - shared_tier_ids
+        moved = [(old_annotations[annotation_id], values) for annotation_id, values in updated.items()
+                 if annotation_id in old_annotations]
+        if moved and (shared_tier_ids or child_tier_ids):
+            old_start_times = {a.start_time for a, _ in moved}
+            old_end_times = {a.end_time for a, _ in moved}
+            related_annotations = Annotation.objects.filter(sound=self, tier__in=shared_tier_ids | child_tier_ids).\
+                filter(Q(start_time__in=old_start_times) | Q(end_time__in=old_end_times)).order_by('id')
+
+            shared_by_start_time = defaultdict(list)
+            shared_by_end_time = defaultdict(list)
+            child_by_start_time = {}
+            child_by_end_time = {}
+            for rel in related_annotations:
+                if rel.tier_id in shared_tier_ids:
+                    shared_by_start_time[rel.start_time].append(rel)
+                    shared_by_end_time[rel.end_time].append(rel)
+                else:
+                    child_by_start_time.setdefault(rel.start_time, {}).setdefault(rel.tier_id, rel)
+                    child_by_end_time.setdefault(rel.end_time, {}).setdefault(rel.tier_id, rel)
+
+            for old_annotation, (start_time, end_time, _) in moved:
+                for rel in shared_by_start_time[old_annotation.start_time]:
+                    if rel.start_time != start_time:
+                        changes.setdefault(rel.id, {})['start_time'] = start_time
+                for rel in shared_by_end_time[old_annotation.end_time]:
+                    if rel.end_time != end_time:
+                        changes.setdefault(rel.id, {})['end_time'] = end_time
+                if old_annotation.start_time != start_time:
+                    for rel in child_by_start_time.get(old_annotation.start_time, {}).values():
+                        changes.setdefault(rel.id, {})['start_time'] = start_time
+                if old_annotation.end_time != end_time:
+                    for rel in child_by_end_time.get(old_annotation.end_time, {}).values():
+                        changes.setdefault(rel.id, {})['end_time'] = end_time
+
+        # Update the annotations in the current tier
+        for old_annotation, (start_time, end_time, name) in moved:
+            changes[old_annotation.id] = {'start_time': start_time, 'end_time': end_time, 'name': name}
+
+        for annotation_id in deleted:
+            changes.pop(annotation_id, None)
+        bulk_update_annotations(changes, user)
+
+        # Create the new annotations in the current tier, the sync tiers and the special child tiers
+        new_annotations = []
+        created_annotations = {}
+        for key, start_time, end_time, name in created:
+            created_annotations[key] = Annotation(sound=self, start_time=start_time, end_time=end_time, tier=tier,
+                                                  name=name, user=user)
+            new_annotations.append(created_annotations[key])
+            for related_tier_id in unique_ids(sync_tier_ids + special_child_tier_ids):
+                new_annotations.append(Annotation(sound=self, start_time=start_time, end_time=end_time,
+                                                  tier_id=related_tier_id, user=user))
+        Annotation.objects.bulk_create(new_annotations)
+        created_ids = {key: a.id for key, a in created_annotations.items()}
+
+        # Remove the deleted annotations, and the annotations in the related tiers with the same times and name. Only
+        # the related tiers are changed, their revisions are incremented below
+        changed_tier_ids = unique_ids([tier.id] + sync_tier_ids + special_parent_tier_ids + special_child_tier_ids)
+        deleted_annotations = [old_annotations[annotation_id] for annotation_id in deleted
+                               if annotation_id in old_annotations]
+        if deleted_annotations:
+            same_annotation = Q()
+            for a in deleted_annotations:
+                same_annotation |= Q(start_time=a.start_time, end_time=a.end_time, name=a.name)
+            with revisions_incremented_by_caller():
+                Annotation.objects.filter(sound=self, tier__in=changed_tier_ids).filter(same_annotation).\
+                    exclude(id__in=[a.id for a, _ in moved] + [a.id for a in new_annotations]).delete()
+
+        # Re-create the AnnotationSimilarity of the user for the annotations
+        num_new_similarities = 0
+        if similarities:
+            similar_ids = {key: created_ids.get(key, key) for key in similarities}
+            with revisions_incremented_by_caller():
+                num_deleted, _ = AnnotationSimilarity.objects.filter(user=user, similar_sound__in=[
+                    similar_ids[key] for key in similarities if key not in created_ids]).delete()
+            new_similarities = AnnotationSimilarity.objects.bulk_create([
+                AnnotationSimilarity(reference_id=value[0], similar_sound_id=similar_ids[key], similarity=value[1],
+                                     user=user)
+                for key, value in similarities.items() if value])
+            # only the similarities of annotations that didn't have one are new
+            num_new_similarities = max(len(new_similarities) - num_deleted, 0)
+        DailyStatistics.add(self.exercise, segments=len(new_annotations), similarities=num_new_similarities)
+
+        self.update_annotation_state(tier, user)
+        self.increment_annotation_revisions(changed_tier_ids)
+        return created_ids
+
+    def update_annotation_state(self, tier, user):
+        """
+        Update the annotation_state of the sound and the Complete object of the user after the annotations of a tier
+        changed
+        Args:
+            tier: tier object
+            user: user object
+        """
+        num_ref_annotations = Annotation.objects.filter(sound=self.exercise.reference_sound_id, tier=tier).count()
+        num_annotations = Annotation.objects.filter(sound=self, tier=tier).count()
+        similarity_users = list(AnnotationSimilarity.objects.filter(similar_sound__sound=self,
+                                                                    similar_sound__tier=tier).
+                                values_list('user_id', flat=True))
+        num_similarity = len(similarity_users)
         state = 'E'
-        if num_ref_annotations <= added_annotations.count():
+        if num_ref_annotations <= num_annotations:
             state = 'I'
             if num_similarity > 0:
                 state = 'C'
-        elif added_annotations.count() > 0:
+        elif num_annotations > 0:
             state = 'I'
 
+        # the state is changed with conditional updates, so the number of completed sounds of the exercise is right
+        # even if the sound object is outdated
+        if state == 'C':
+            completed_sounds = Sound.objects.filter(id=self.id).exclude(annotation_state=state).\
+                update(annotation_state=state)
+        else:
+            completed_sounds = -Sound.objects.filter(id=self.id, annotation_state='C').update(annotation_state=state)
+            if self.annotation_state != state:
+                Sound.objects.filter(id=self.id).update(annotation_state=state)
         self.annotation_state = state
-        self.save()
+        if completed_sounds:
+            ExerciseStatistics.add(self.exercise_id, completed_sounds=completed_sounds)
 
         # update complete objects
-        user_similarities = AnnotationSimilarity.objects.filter(similar_sound__in=added_annotations).filter(user=user)
+        num_user_similarities = similarity_users.count(user.id)
         complete = Complete.objects.filter(sound=self, user=user)
 
         if not complete:
-            if user_similarities.count() == added_annotations.count():
+            if num_user_similarities == num_annotations:
                 Complete.objects.create(sound=self, user=user)
         else:
-            if user_similarities.count() < added_annotations.count():
+            if num_user_similarities < num_annotations:
                 complete[0].delete()
 
-        return True
-
-    @staticmethod
-    def update_annotation_vals(old_annotation, new_annotation, user, modify_name=False):
-        old_annotation.start_time = new_annotation['start']
-        old_annotation.end_time = new_annotation['end']
-        old_annotation.user = user
-        if modify_name:
-            old_annotation.name = new_annotation['annotation']
-        old_annotation.save()
-
     def check_if_user_completed_annotations(self, user):
         """
         Check if a user has completed the annotations for the sound. If this is the case, a Complete object with the
@@ -383,10 +647,33 @@ class Annotation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # the annotations of long sounds are requested by windows of time
+        index_together = [('sound', 'tier', 'start_time')]
+
     def __str__(self):
         return self.name
 
 
+def bulk_update_annotations(changes, user):
+    """
+    Update the times and names of several annotations with a single query
+    Args:
+        changes: dict of annotation id -> dict with the new start_time, end_time and/or name of the annotation
+        user: user object making the changes
+    """
+    if not changes:
+        return
+    whens = defaultdict(list)
+    for annotation_id, values in changes.items():
+        for field_name, value in values.items():
+            whens[field_name].append(When(id=annotation_id, then=Value(value)))
+    new_values = {field_name: Case(*field_whens, default=F(field_name),
+                                   output_field=Annotation._meta.get_field(field_name))
+                  for field_name, field_whens in whens.items()}
+    Annotation.objects.filter(id__in=list(changes)).update(user=user, updated_at=timezone.now(), **new_values)
+
+
 class AnnotationSimilarity(models.Model):
     reference = models.ForeignKey(Annotation, related_name="%(class)s_related")
     similar_sound = models.ForeignKey(Annotation)
@@ -396,10 +683,221 @@ class AnnotationSimilarity(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
+class AnnotationRevision(models.Model):
+    """
+    Revision of the annotations of a tier of a sound. It is incremented every time the annotations change, so the
+    interface can detect that the annotations it is editing were modified by someone else.
+    """
+    sound = models.ForeignKey(Sound, related_name='annotation_revisions')
+    tier = models.ForeignKey(Tier, related_name='annotation_revisions')
+    revision = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('sound', 'tier')
+
+
+class ExerciseStatistics(models.Model):
+    """
+    Number of sounds and of completed sounds of an exercise. They are updated when the sounds change, so the
+    statistics of a data set are read from a few rows.
+    """
+    exercise = models.OneToOneField(Exercise, related_name='statistics')
+    number_of_sounds = models.IntegerField(default=0)
+    number_of_completed_sounds = models.IntegerField(default=0)
+
+    @staticmethod
+    def add(exercise_id, sounds=0, completed_sounds=0):
+        """
+        Add the given number of sounds and completed sounds (negative to subtract) to the statistics of an exercise
+        """
+        values = {'number_of_sounds': F('number_of_sounds') + sounds,
+                  'number_of_completed_sounds': F('number_of_completed_sounds') + completed_sounds}
+        if not ExerciseStatistics.objects.filter(exercise=exercise_id).update(**values):
+            ExerciseStatistics.objects.get_or_create(exercise_id=exercise_id)
+            ExerciseStatistics.objects.filter(exercise=exercise_id).update(**values)
+
+
+class DailyStatistics(models.Model):
+    """
+    Number of segments and similarity annotations created each day in an exercise
+    """
+    data_set = models.ForeignKey(DataSet, related_name='daily_statistics')
+    exercise = models.ForeignKey(Exercise, related_name='daily_statistics')
+    date = models.DateField()
+    segments = models.IntegerField(default=0)
+    similarities = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('exercise', 'date')
+
+    @staticmethod
+    def add(exercise, segments=0, similarities=0):
+        """
+        Add the segments and similarity annotations created now in an exercise
+        """
+        if not segments and not similarities:
+            return
+        date = timezone.localdate()
+        values = {'segments': F('segments') + segments, 'similarities': F('similarities') + similarities}
+        if not DailyStatistics.objects.filter(exercise=exercise, date=date).update(**values):
+            DailyStatistics.objects.get_or_create(exercise=exercise, date=date,
+                                                  defaults={'data_set_id': exercise.data_set_id})
+            DailyStatistics.objects.filter(exercise=exercise, date=date).update(**values)
+
+    @staticmethod
+    def remove(exercise, annotations):
+        """
+        Remove from the days they were created the given annotations of an exercise and their similarity annotations,
+        before deleting them
+        """
+        days = defaultdict(lambda: {'segments': 0, 'similarities': 0})
+        for a in annotations.annotate(date=TruncDate('created_at')).values('date').annotate(count=Count('id')).\
+                order_by():
+            days[a['date']]['segments'] = a['count']
+        similarities = AnnotationSimilarity.objects.filter(Q(similar_sound__in=annotations) |
+                                                           Q(reference__in=annotations))
+        for s in similarities.annotate(date=TruncDate('created_at')).values('date').\
+                annotate(count=Count('id', distinct=True)).order_by():
+            days[s['date']]['similarities'] = s['count']
+        for date, counts in days.items():
+            DailyStatistics.objects.filter(exercise=exercise, date=date).update(
+                segments=F('segments') - counts['segments'], similarities=F('similarities') - counts['similarities'])
+
+
+@receiver(post_save, sender=Exercise)
+def create_exercise_statistics(sender, instance, created, **kwargs):
+    if created:
+        ExerciseStatistics.objects.get_or_create(exercise=instance)
+
+
+@receiver(post_save, sender=Sound)
+def add_sound_to_statistics(sender, instance, created, **kwargs):
+    if created:
+        ExerciseStatistics.add(instance.exercise_id, sounds=1,
+                               completed_sounds=1 if instance.annotation_state == 'C' else 0)
+
+
+@receiver(post_delete, sender=Sound)
+def remove_sound_from_statistics(sender, instance, **kwargs):
+    # the statistics are not created here, the sound could be removed with its exercise
+    ExerciseStatistics.objects.filter(exercise=instance.exercise_id).update(
+        number_of_sounds=F('number_of_sounds') - 1,
+        number_of_completed_sounds=F('number_of_completed_sounds') - (1 if instance.annotation_state == 'C' else 0))
+
+
+class MediaFile(models.Model):
+    """
+    Manifest of the files copied into media by upload_data_set. A file with the same size and modification time, or
+    the same content, is not copied and transcoded again.
+    """
+    data_set = models.ForeignKey(DataSet, related_name='media_files')
+    destination = models.CharField(max_length=500, unique=True)
+    source_path = models.CharField(max_length=500)
+    content_hash = models.CharField(max_length=40)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    filename = models.CharField(max_length=200)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class DataSetExportMark(models.Model):
+    """
+    High-water mark of the last export of the annotations of a data set with the download_annotations command. Only
+    the sounds with annotations changed after it have to be exported again.
+    """
+    data_set = models.OneToOneField(DataSet, related_name='export_mark')
+    exported_at = models.DateTimeField()
+    tiers_version = models.CharField(max_length=100)
+
+
+def increment_sounds_annotation_revisions(sound_ids, tier_ids):
+    """
+    Increment the revisions of the annotations of the given tiers of several sounds, with three queries
+    """
+    revisions = AnnotationRevision.objects.filter(sound__in=sound_ids, tier__in=tier_ids)
+    existing = set(revisions.values_list('sound_id', 'tier_id'))
+    revisions.update(revision=F('revision') + 1, updated_at=timezone.now())
+    AnnotationRevision.objects.bulk_create([AnnotationRevision(sound_id=sound_id, tier_id=tier_id, revision=1)
+                                            for sound_id in sound_ids for tier_id in tier_ids
+                                            if (sound_id, tier_id) not in existing])
+
+
+_revision_signals = threading.local()
+
+
+@contextmanager
+def revisions_incremented_by_caller():
+    """
+    The annotations and similarities saved or deleted in the block don't increment their revisions from the signals,
+    the caller increments them once for all the changes
+    """
+    muted = getattr(_revision_signals, 'muted', False)
+    _revision_signals.muted = True
+    try:
+        yield
+    finally:
+        _revision_signals.muted = muted
+
+
+def increment_annotation_revision(sound_id, tier_id, deleted=False):
+    """
+    Increment the revision of a tier of a sound after a change made through the models (admin, cascades...). When an
+    annotation is deleted the revision is only updated, the sound could be being deleted too.
+    """
+    if getattr(_revision_signals, 'muted', False):
+        return
+    if deleted:
+        AnnotationRevision.objects.filter(sound=sound_id, tier=tier_id).update(revision=F('revision') + 1,
+                                                                               updated_at=timezone.now())
+    else:
+        increment_sounds_annotation_revisions([sound_id], [tier_id])
+
+
+@receiver(post_save, sender=Annotation)
+def increment_revision_on_annotation_save(sender, instance, **kwargs):
+    increment_annotation_revision(instance.sound_id, instance.tier_id)
+
+
+@receiver(post_delete, sender=Annotation)
+def increment_revision_on_annotation_delete(sender, instance, **kwargs):
+    increment_annotation_revision(instance.sound_id, instance.tier_id, deleted=True)
+
+
+@receiver(post_save, sender=AnnotationSimilarity)
+@receiver(post_delete, sender=AnnotationSimilarity)
+def increment_revision_on_similarity_change(sender, instance, created=None, **kwargs):
+    if getattr(_revision_signals, 'muted', False):
+        return
+    annotation = Annotation.objects.filter(id=instance.similar_sound_id).values_list('sound_id', 'tier_id').first()
+    # the annotation can be deleted with its similarities
+    if annotation:
+        increment_annotation_revision(*annotation, deleted=created is None)
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=200)
     tiers = models.ManyToManyField(Tier)
 
+    def save(self, *args, **kwargs):
+        super(Tag, self).save(*args, **kwargs)
+        self.tiers.update(version=F('version') + 1)
+
+
+@receiver(m2m_changed, sender=Tag.tiers.through)
+def update_tiers_version(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    The annotation tags of a tier are cached with the tier version, so it has to change when tags are added or removed
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        Tier.objects.filter(id=instance.id).update(version=F('version') + 1)
+    elif action == 'pre_clear':
+        instance.tiers.update(version=F('version') + 1)
+    else:
+        Tier.objects.filter(id__in=pk_set).update(version=F('version') + 1)
+
 
 class Complete(models.Model):
     """
@@ -408,3 +906,155 @@ class Complete(models.Model):
     """
     user = models.ForeignKey(User, related_name='complete')
     sound = models.ForeignKey(Sound, related_name='complete')
+
+
+class ExportJob(models.Model):
+    """
+    Export of the annotations of a data set to a zip file. The jobs are queued in the database and processed by the
+    run_export_jobs command. The zip file of a finished job is used while the content version of the data set doesn't
+    change.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed')
+    )
+    # a running job whose progress wasn't updated for this long was left by a worker that was stopped
+    RUNNING_TIMEOUT = datetime.timedelta(minutes=10)
+    data_set = models.ForeignKey(DataSet, related_name='export_jobs')
+    user = models.ForeignKey(User, related_name='export_jobs', blank=True, null=True)
+    version = models.CharField(max_length=32)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def request(data_set, user=None):
+        """
+        Get the export job of the current content of a data set, a new job is queued only if there isn't a finished,
+        running or queued job for it. The running jobs that timed out are marked as failed, so they are queued again
+        Args:
+            data_set: data set object
+            user: user object requesting the export
+
+        Returns:
+            export job object
+        """
+        now = timezone.now()
+        ExportJob.objects.filter(data_set=data_set, status=ExportJob.RUNNING,
+                                 updated_at__lt=now - ExportJob.RUNNING_TIMEOUT).\
+            update(status=ExportJob.FAILED, error='The export was interrupted', updated_at=now)
+        version = data_set.get_content_version()
+        jobs = ExportJob.objects.filter(data_set=data_set).\
+            filter(Q(version=version, status__in=[ExportJob.DONE, ExportJob.RUNNING]) | Q(status=ExportJob.QUEUED))
+        for job in jobs.order_by('-id'):
+            if job.status != ExportJob.DONE or os.path.isfile(job.file_path):
+                return job
+        return ExportJob.objects.create(data_set=data_set, user=user, version=version)
+
+    @staticmethod
+    def claim():
+        """
+        Take the oldest queued job and mark it as running. Jobs being claimed by other workers are skipped.
+        Returns: export job object or None if there are no queued jobs
+        """
+        with transaction.atomic():
+            job = ExportJob.objects.select_for_update(skip_locked=True).filter(status=ExportJob.QUEUED).\
+                order_by('id').first()
+            if job:
+                job.status = ExportJob.RUNNING
+                job.version = job.data_set.get_content_version()
+                job.save(update_fields=['status', 'version', 'updated_at'])
+        return job
+
+    def get_status(self):
+        status = {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'error': self.error,
+        }
+        if self.status == ExportJob.DONE:
+            status['url'] = reverse('export_job_download', kwargs={'job_id': self.id})
+        return status
+
+
+class MediaJob(models.Model):
+    """
+    Computation of a file of a sound that takes too long to be done in a request: its peaks when they were not
+    computed at the upload, or a tile of its spectrogram that wasn't rendered at the upload. The jobs are queued in
+    the database and processed by the run_media_jobs command, a job is removed when it is done.
+    """
+    PEAKS = 'peaks'
+    SPECTROGRAM_TILE = 'tile'
+    KIND_CHOICES = (
+        (PEAKS, 'peaks'),
+        (SPECTROGRAM_TILE, 'spectrogram tile')
+    )
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (FAILED, 'failed')
+    )
+    # a job running for this long was left by a worker that was stopped
+    RUNNING_TIMEOUT = datetime.timedelta(minutes=10)
+    sound = models.ForeignKey(Sound, related_name='media_jobs')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # zoom level and index of a spectrogram tile
+    level = models.PositiveIntegerField(default=0)
+    index = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def request(sound, kind, sound_mtime, level=0, index=0):
+        """
+        Get the job computing a file of a sound, a new job is queued only if there isn't a queued or running job for
+        it, or one that failed after the last change of the sound. A running job that timed out is queued again
+        Args:
+            sound: sound object
+            kind: kind of file, MediaJob.PEAKS or MediaJob.SPECTROGRAM_TILE
+            sound_mtime: modification time of the file of the sound, as a timestamp
+            level: zoom level of a spectrogram tile
+            index: index of a spectrogram tile in its level
+
+        Returns:
+            media job object
+        """
+        changed_at = datetime.datetime.fromtimestamp(sound_mtime, datetime.timezone.utc)
+        jobs = MediaJob.objects.filter(sound=sound, kind=kind, level=level, index=index)
+        now = timezone.now()
+        jobs.filter(status=MediaJob.RUNNING, updated_at__lt=now - MediaJob.RUNNING_TIMEOUT).\
+            update(status=MediaJob.QUEUED, updated_at=now)
+        jobs = jobs.filter(Q(status__in=[MediaJob.QUEUED, MediaJob.RUNNING]) |
+                           Q(status=MediaJob.FAILED, updated_at__gte=changed_at))
+        return jobs.order_by('-id').first() or MediaJob.objects.create(sound=sound, kind=kind, level=level, index=index)
+
+    @staticmethod
+    def claim():
+        """
+        Take the oldest queued job and mark it as running. Jobs being claimed by other workers are skipped.
+        Returns: media job object or None if there are no queued jobs
+        """
+        with transaction.atomic():
+            job = MediaJob.objects.select_for_update(skip_locked=True).filter(status=MediaJob.QUEUED).\
+                order_by('id').first()
+            if job:
+                job.status = MediaJob.RUNNING
+                job.save(update_fields=['status', 'updated_at'])
+        return job
@@ -0,0 +1,30 @@
+class KeysetPage(object):
+    """
+    Page of a queryset ordered by id. The pages are selected by the id of the last object of the previous page or the
+    first object of the next page, so only the objects of the page are read whatever the size of the queryset.
+    """
+    def __init__(self, queryset, after=None, before=None, per_page=20):
+        if before is not None:
+            objects = list(queryset.filter(id__lt=before).order_by('-id')[:per_page + 1])
+            self.has_previous = len(objects) > per_page
+            self.has_next = True
+            self.object_list = objects[:per_page][::-1]
+        else:
+            if after is not None:
+                queryset = queryset.filter(id__gt=after)
+            objects = list(queryset.order_by('id')[:per_page + 1])
+            self.has_previous = after is not None
+            self.has_next = len(objects) > per_page
+            self.object_list = objects[:per_page]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def next_cursor(self):
+        return self.object_list[-1].id if self.object_list else None
+
+    def previous_cursor(self):
+        return self.object_list[0].id if self.object_list else None
@@ -0,0 +1,173 @@
+import os
+import struct
+import tempfile
+import subprocess
+
+import numpy
+import pydub
+
+# the sounds are decoded to mono at this sample rate to compute the peaks
+SAMPLE_RATE = 22050
+# number of samples of each peak of the most detailed level, each level has half the peaks of the previous one
+SAMPLES_PER_PEAK = 256
+# the pyramid stops at the first level with fewer peaks
+MIN_PEAKS = 512
+PEAKS_MAGIC = b'PKS1'
+# magic, sample rate, samples per peak of the first level, number of levels
+HEADER = struct.Struct('<4sIII')
+# number of peaks of a level
+LEVEL_HEADER = struct.Struct('<I')
+
+
+def peaks_file_path(sound_path):
+    return sound_path + '.peaks'
+
+
+def decode_samples(sound_path, chunk_samples, start=None, duration=None):
+    """
+    Decode a sound with the encoder used by pydub, reading its output in chunks
+    Args:
+        sound_path: path of the sound
+        chunk_samples: number of samples of each chunk
+        start: optional time in seconds where the decoding starts
+        duration: optional number of seconds decoded
+
+    Yields:
+        int16 arrays of chunk_samples samples, except the last one
+    """
+    command = [pydub.AudioSegment.converter, '-v', 'error']
+    if start is not None:
+        command += ['-ss', '%.6f' % start]
+    if duration is not None:
+        command += ['-t', '%.6f' % duration]
+    command += ['-i', sound_path, '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1']
+    decoder = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        remainder = b''
+        for chunk in iter(lambda: decoder.stdout.read(chunk_samples * 2), b''):
+            data = remainder + chunk
+            # a read can end in the middle of a sample
+            remainder = data[len(data) - len(data) % 2:]
+            yield numpy.frombuffer(data[:len(data) - len(remainder)], dtype='<i2')
+        errors = decoder.stderr.read()
+    finally:
+        decoder.stdout.close()
+        return_code = decoder.wait()
+    if return_code != 0:
+        raise RuntimeError("Decoding %s failed: %s" % (sound_path, errors[-1000:].decode(errors='replace')))
+
+
+def compute_peaks(sound_path, samples_per_peak=SAMPLES_PER_PEAK, min_peaks=MIN_PEAKS):
+    """
+    Compute the minimum and maximum of the samples of a sound in buckets of samples_per_peak samples, and the levels
+    of coarser peaks merging pairs of buckets of the previous level. The sound is decoded in chunks, so only the peaks
+    are kept in memory.
+    Returns:
+        list of int16 arrays of shape (number of peaks, 2) with the minimum and maximum of each bucket, from the most
+        detailed level
+    """
+    chunks = []
+    pending = numpy.zeros(0, dtype='<i2')
+    for samples in decode_samples(sound_path, samples_per_peak * 4096):
+        samples = numpy.concatenate((pending, samples))
+        complete = len(samples) - len(samples) % samples_per_peak
+        buckets = samples[:complete].reshape(-1, samples_per_peak)
+        chunks.append(numpy.stack((buckets.min(axis=1), buckets.max(axis=1)), axis=1))
+        pending = samples[complete:]
+    if len(pending):
+        chunks.append(numpy.array([[pending.min(), pending.max()]], dtype='<i2'))
+    level = numpy.concatenate(chunks) if chunks else numpy.zeros((0, 2), dtype='<i2')
+
+    levels = [level]
+    while len(level) > min_peaks:
+        if len(level) % 2:
+            level = numpy.concatenate((level, level[-1:]))
+        pairs = level.reshape(-1, 2, 2)
+        level = numpy.stack((pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)), axis=1)
+        levels.append(level)
+    return levels
+
+
+def write_peaks(path, levels, samples_per_peak=SAMPLES_PER_PEAK):
+    """
+    Write the levels of peaks in a file: a header, the number of peaks of each level and the peaks of each level as
+    little endian int16 pairs of minimum and maximum. The file is written with another name and renamed, so a
+    partial file is never read.
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.part', delete=False) as f:
+        f.write(HEADER.pack(PEAKS_MAGIC, SAMPLE_RATE, samples_per_peak, len(levels)))
+        for level in levels:
+            f.write(LEVEL_HEADER.pack(len(level)))
+        for level in levels:
+            f.write(level.astype('<i2').tobytes())
+    os.rename(f.name, path)
+
+
+def create_peaks_file(sound_path):
+    """
+    Compute the peaks of a sound and write them in the peaks file next to it
+    """
+    path = peaks_file_path(sound_path)
+    write_peaks(path, compute_peaks(sound_path))
+    return path
+
+
+def read_peaks(path, width):
+    """
+    Read the coarsest level of a peaks file with at least width peaks, or the most detailed one if none has as
+    many. Only that level is read from the file.
+    Returns:
+        (bytes of the peaks of the level, samples per peak of the level, sample rate)
+    """
+    with open(path, 'rb') as f:
+        magic, sample_rate, samples_per_peak, num_levels = HEADER.unpack(f.read(HEADER.size))
+        if magic != PEAKS_MAGIC:
+            raise ValueError("%s is not a peaks file" % path)
+        lengths = [LEVEL_HEADER.unpack(f.read(LEVEL_HEADER.size))[0] for _ in range(num_levels)]
+        index = 0
+        for i, length in enumerate(lengths):
+            if length >= width:
+                index = i
+        # each peak is two int16
+        f.seek(HEADER.size + LEVEL_HEADER.size * num_levels + sum(lengths[:index]) * 4)
+        return f.read(lengths[index] * 4), samples_per_peak * 2 ** index, sample_rate
+
+
+def read_num_samples(path):
+    """
+    Number of samples of the sound of a peaks file at SAMPLE_RATE, rounded up to whole peaks
+    """
+    with open(path, 'rb') as f:
+        magic, sample_rate, samples_per_peak, num_levels = HEADER.unpack(f.read(HEADER.size))
+        if magic != PEAKS_MAGIC:
+            raise ValueError("%s is not a peaks file" % path)
+        if not num_levels:
+            return 0
+        length, = LEVEL_HEADER.unpack(f.read(LEVEL_HEADER.size))
+    return length * samples_per_peak
+
+
+def has_peaks(sound_path):
+    """
+    Check if a sound has a peaks file at least as recent as the sound
+    Raises:
+        FileNotFoundError if the sound doesn't exist
+    """
+    sound_mtime = os.path.getmtime(sound_path)
+    path = peaks_file_path(sound_path)
+    return os.path.exists(path) and os.path.getmtime(path) >= sound_mtime
+
+
+def get_peaks(sound_path, width):
+    """
+    Read the peaks of a sound for a waveform of width pixels. They are computed when the sound is uploaded, or by a
+    media job if the sound doesn't have them, never while a request waits.
+    Returns:
+        (bytes of the peaks, samples per peak, sample rate), or None if the sound doesn't have a peaks file or it is
+        older than the sound
+    Raises:
+        FileNotFoundError if the sound doesn't exist
+    """
+    if not has_peaks(sound_path):
+        return None
+    return read_peaks(peaks_file_path(sound_path), width)
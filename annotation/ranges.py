@@ -0,0 +1,114 @@
+import os
+import re
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Parse the Range header of a request for a single range of bytes
+    Args:
+        header: value of the Range header
+        size: size in bytes of the file
+
+    Returns:
+        (first byte, last byte) of the range, or None if the header has to be ignored (several ranges, other units or
+        a wrong syntax) and the whole file is sent
+
+    Raises:
+        ValueError: if the range is out of the file
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size:
+            raise ValueError("Range out of the file")
+        if end < start:
+            return None
+    else:
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty range")
+        start = max(size - length, 0)
+        end = size - 1
+    return start, end
+
+
+def file_iterator(path, start, length, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def ranged_response(request, size, etag, last_modified, read, content_type, filename=None):
+    """
+    Send content supporting Range requests, so an interrupted download can be resumed and a player can seek, and
+    conditional requests, so content already downloaded isn't sent again. If-Range is checked against the ETag and
+    Last-Modified of the content, so a range of content that changed is never sent.
+    Args:
+        request: request object
+        size: size in bytes of the content
+        etag: ETag of the content
+        last_modified: Last-Modified date of the content
+        read: function that takes the first byte and the number of bytes to send and returns an iterator of bytes
+        content_type: content type of the response
+        filename: if given, the content is sent as an attachment with this name
+
+    Returns:
+        response object with status 200, 206, 304, 412 or 416
+    """
+    # If-None-Match and If-Modified-Since (304), If-Match and If-Unmodified-Since (412)
+    response = get_conditional_response(request, etag=etag, last_modified=parse_http_date_safe(last_modified))
+    if response is not None:
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        return response
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range in (etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(read(start, end - start + 1), content_type=content_type,
+                                     status=206 if byte_range else 200)
+    response['Content-Length'] = end - start + 1
+    if byte_range:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    if filename:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+def ranged_file_response(request, path, content_type, filename=None):
+    """
+    Send a file supporting Range requests (see ranged_response), its ETag and Last-Modified come from its modification
+    time and size
+    """
+    stat = os.stat(path)
+    return ranged_response(request, stat.st_size, '"%x-%x"' % (int(stat.st_mtime), stat.st_size),
+                           http_date(stat.st_mtime), lambda start, length: file_iterator(path, start, length),
+                           content_type, filename)
@@ -0,0 +1,164 @@
+from collections import OrderedDict, defaultdict
+
+from django.db.models import Q
+
+from .models import Annotation, AnnotationSimilarity, Tier
+
+
+def annotations_in_window(annotations, start, end, max_length):
+    """
+    Filter the annotations that overlap the time window [start, end), ordered by start time. An annotation overlaps
+    the window if it starts in it, or if it starts before it and ends after its start. The annotations that start
+    before start - max_length can't end in the window, so the query only reads a range of the index on
+    (sound, tier, start_time).
+    Args:
+        annotations: queryset of the annotations of a tier of a sound
+        start: start of the window in seconds
+        end: end of the window in seconds
+        max_length: length of the longest annotation
+    """
+    return annotations.filter(start_time__lt=end, start_time__gte=start - max_length).\
+        filter(Q(start_time__gte=start) | Q(end_time__gt=start)).order_by('start_time', 'id')
+
+
+def annotations_for_tier(sound, tier, user=False, window=None):
+    """
+    Serialise the annotations of a tier of a sound as they are sent to the annotation interface, with two queries
+    Args:
+        sound: sound object
+        tier: tier object
+        user: if given, the AnnotationSimilarity of the user (of all the users if it is staff) are added
+        window: optional (start, end, max_length), only the annotations that overlap [start, end) are serialised,
+            see annotations_in_window
+
+    Returns:
+        list of annotation dicts
+    """
+    annotations = Annotation.objects.filter(sound=sound, tier=tier)
+    if window is not None:
+        annotations = annotations_in_window(annotations, *window)
+    annotations = list(annotations.values('id', 'start_time', 'end_time', 'name'))
+    similarities = defaultdict(list)
+    if user and annotations:
+        references = AnnotationSimilarity.objects.filter(similar_sound__in=[a['id'] for a in annotations])
+        # If user is staff then we return all the AnnotationSimilarity values
+        if not user.is_staff:
+            references = references.filter(user=user)
+        for similar_sound_id, reference_id, similarity in references.order_by('id').\
+                values_list('similar_sound_id', 'reference_id', 'similarity'):
+            similarities[similar_sound_id].append((reference_id, similarity))
+
+    ret = []
+    for a in annotations:
+        annotation = {
+            "start": a['start_time'],
+            "end": a['end_time'],
+            "annotation": a['name'],
+            "id": a['id'],
+            }
+
+        if user:
+            annotation['similarity'] = 'no'
+            references = similarities[a['id']]
+            if len(references) > 1:
+                annotation['manyValues'] = [similarity for _, similarity in references]
+
+            if len(references):
+                reference_id, similarity = references[0]
+                annotation['similarity'] = "yes"
+                annotation['similValue'] = similarity
+                annotation['reference'] = reference_id
+        ret.append(annotation)
+
+    return ret
+
+
+def sounds_annotations_as_dict(sounds):
+    """
+    Serialise the annotations of a group of sounds in the download format, with three queries whatever the number of
+    sounds, tiers and annotations
+    Args:
+        sounds: list of sound objects
+
+    Returns:
+        dict of sound id -> dict of tier name -> list of annotation dicts
+    """
+    sounds = list(sounds)
+    if not sounds:
+        return {}
+    tiers_by_exercise = defaultdict(list)
+    for tier_id, exercise_id, tier_name in Tier.objects.filter(exercise__in={s.exercise_id for s in sounds}).\
+            values_list('id', 'exercise_id', 'name'):
+        tiers_by_exercise[exercise_id].append((tier_id, tier_name))
+
+    annotations = defaultdict(list)
+    annotation_ids = []
+    for a in Annotation.objects.filter(sound__in=sounds).values('id', 'sound_id', 'tier_id', 'start_time',
+                                                                 'end_time', 'name'):
+        annotations[(a['sound_id'], a['tier_id'])].append(a)
+        annotation_ids.append(a['id'])
+
+    similarities = defaultdict(list)
+    if annotation_ids:
+        for s in AnnotationSimilarity.objects.filter(similar_sound__in=annotation_ids).order_by('id').\
+                values('similar_sound_id', 'user__username', 'similarity', 'reference__start_time',
+                       'reference__end_time'):
+            similarities[s['similar_sound_id']].append(s)
+
+    ret = {}
+    for sound in sounds:
+        sound_annotations = OrderedDict()
+        for tier_id, tier_name in tiers_by_exercise[sound.exercise_id]:
+            sound_annotations[tier_name] = []
+            for i in annotations[(sound.id, tier_id)]:
+                if similarities[i['id']]:
+                    sound_similarities = {}
+                    for s in similarities[i['id']]:
+                        sound_similarities[s['user__username']] = (float(s['similarity']['value']))
+                    # the reference times are the ones of the last similarity
+                    sound_annotations[tier_name].append({
+                        'ref_start_time': float(s['reference__start_time']),
+                        'start_time': float(i['start_time']),
+                        'ref_end_time': float(s['reference__end_time']),
+                        'end_time': float(i['end_time']),
+                        'similarity': sound_similarities
+                        })
+                else:
+                    sound_annotations[tier_name].append({
+                        'start_time': float(i['start_time']),
+                        'end_time': float(i['end_time']),
+                        'name': i['name']
+                    })
+        ret[sound.id] = sound_annotations
+    return ret
+
+
+def annotations_as_dict(sound):
+    """
+    Serialise the annotations of all the tiers of a sound in the download format
+    """
+    return sounds_annotations_as_dict([sound])[sound.id]
+
+
+def iter_sounds_annotations(sounds, batch_size=100):
+    """
+    Serialise the annotations of many sounds in the download format, in batches of sounds so the number of queries
+    doesn't depend on the number of annotations
+    Args:
+        sounds: iterable of sound objects
+        batch_size: number of sounds serialised together
+
+    Yields:
+        (sound, dict of tier name -> list of annotation dicts)
+    """
+    batch = []
+    for sound in sounds:
+        batch.append(sound)
+        if len(batch) == batch_size:
+            annotations = sounds_annotations_as_dict(batch)
+            for s in batch:
+                yield s, annotations[s.id]
+            batch = []
+    annotations = sounds_annotations_as_dict(batch)
+    for s in batch:
+        yield s, annotations[s.id]
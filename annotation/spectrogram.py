@@ -0,0 +1,179 @@
+import os
+import zlib
+import struct
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+from django.conf import settings
+
+from .colormaps import MAGMA
+from .diskcache import DiskLRUCache
+from .peaks import SAMPLE_RATE, decode_samples, peaks_file_path, read_num_samples
+
+FFT_SIZE = 256
+# samples between the columns of the tiles of the most detailed level, it doubles in each level
+MIN_HOP = 64
+NUM_LEVELS = 12
+# number of columns of a tile
+TILE_WIDTH = 256
+# decibels under full scale of the lowest colour
+DYNAMIC_RANGE = 90
+# the levels with at most this number of tiles are rendered when the sound is uploaded, the interface shows them
+# before the sound is zoomed
+PRERENDERED_TILES = 16
+WINDOW = numpy.hanning(FFT_SIZE)
+
+_caches = {}
+
+
+def tiles_cache():
+    key = (settings.SPECTROGRAM_CACHE_ROOT, settings.SPECTROGRAM_CACHE_SIZE)
+    if key not in _caches:
+        _caches[key] = DiskLRUCache(*key)
+    return _caches[key]
+
+
+def spectrogram_parameters():
+    """
+    Parameters of the tiles for the annotation interface, to choose the level and the tiles in view
+    """
+    return {'sampleRate': SAMPLE_RATE, 'minHop': MIN_HOP, 'levels': NUM_LEVELS, 'tileWidth': TILE_WIDTH,
+            'height': FFT_SIZE // 2}
+
+
+def tile_frames(sound_path, level, index):
+    """
+    Decode the samples of a tile, only the part of the sound in the tile is decoded
+    Yields:
+        int16 arrays of shape (number of columns, FFT_SIZE) with the frames of consecutive columns of the tile
+    """
+    hop = MIN_HOP * 2 ** level
+    start = index * TILE_WIDTH * hop / SAMPLE_RATE
+    if hop >= FFT_SIZE:
+        # the frame of a column is the beginning of its hop, the samples are decoded in chunks of whole columns
+        pending = numpy.zeros(0, dtype='<i2')
+        for samples in decode_samples(sound_path, max(1, 2 ** 20 // hop) * hop, start, TILE_WIDTH * hop / SAMPLE_RATE):
+            samples = numpy.concatenate((pending, samples))
+            complete = len(samples) - len(samples) % hop
+            yield samples[:complete].reshape(-1, hop)[:, :FFT_SIZE]
+            pending = samples[complete:]
+        if len(pending):
+            frame = numpy.zeros((1, FFT_SIZE), dtype='<i2')
+            frame[0, :min(len(pending), FFT_SIZE)] = pending[:FFT_SIZE]
+            yield frame
+    else:
+        # the frames overlap, the tile has few samples
+        num_samples = (TILE_WIDTH - 1) * hop + FFT_SIZE
+        chunks = list(decode_samples(sound_path, num_samples, start, num_samples / SAMPLE_RATE))
+        samples = numpy.concatenate(chunks) if chunks else numpy.zeros(0, dtype='<i2')
+        columns = min(TILE_WIDTH, -(-len(samples) // hop))
+        samples = numpy.pad(samples, (0, num_samples - len(samples)), 'constant')
+        yield as_strided(samples, shape=(columns, FFT_SIZE), strides=(hop * samples.itemsize, samples.itemsize))
+
+
+def encode_png(pixels):
+    """
+    Encode an array of shape (height, width, 3) of rgb values as a PNG image
+    """
+    height, width, _ = pixels.shape
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    # each row starts with its filter type, none
+    rows = numpy.hstack((numpy.zeros((height, 1), dtype=numpy.uint8), pixels.reshape(height, width * 3)))
+    return b''.join([b'\x89PNG\r\n\x1a\n', chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+                     chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)), chunk(b'IEND', b'')])
+
+
+def render_tile(sound_path, level, index):
+    """
+    Render a tile of the spectrogram of a sound: TILE_WIDTH columns, FFT_SIZE / 2 rows from the highest frequency,
+    coloured with the magma colour map
+    Returns:
+        PNG image
+    """
+    values = []
+    for frames in tile_frames(sound_path, level, index):
+        spectrum = numpy.abs(numpy.fft.rfft(frames * WINDOW, axis=1))[:, :FFT_SIZE // 2]
+        # relative to the amplitude of a full scale sine
+        amplitude = spectrum / (WINDOW.sum() / 2 * 32768)
+        decibels = 20 * numpy.log10(numpy.maximum(amplitude, 1e-10))
+        values.append(numpy.clip((decibels + DYNAMIC_RANGE) * 255 / DYNAMIC_RANGE, 0, 255).astype(numpy.uint8))
+    # the columns after the end of the sound have the lowest colour
+    tile = numpy.zeros((TILE_WIDTH, FFT_SIZE // 2), dtype=numpy.uint8)
+    if values:
+        columns = numpy.concatenate(values)[:TILE_WIDTH]
+        tile[:len(columns)] = columns
+    return encode_png(MAGMA[tile.T[::-1]])
+
+
+def tile_key(sound_path, level, index):
+    """
+    Key of a tile in the tiles cache. It has the path of the sound in media, known before the sound is created in the
+    database, and it changes with the modification time and size of the sound.
+    """
+    stat = os.stat(sound_path)
+    return os.path.join(os.path.relpath(sound_path, settings.MEDIA_ROOT),
+                        '%s_%s_%x-%x.png' % (level, index, int(stat.st_mtime), stat.st_size))
+
+
+def get_spectrogram_tile(sound_path, level, index):
+    """
+    Path of a tile of the spectrogram of a sound in the tiles cache. The tiles are rendered when the sound is uploaded
+    or by a media job, never while a request waits.
+    Args:
+        sound_path: path of the sound
+        level: zoom level, from 0 (the most detailed) to NUM_LEVELS - 1
+        index: index of the tile in the level, the tile starts at index * TILE_WIDTH columns
+
+    Returns:
+        path of the PNG image of the tile, or None if it isn't rendered
+    Raises:
+        FileNotFoundError if the sound doesn't exist
+    """
+    return tiles_cache().get(tile_key(sound_path, level, index))
+
+
+def create_spectrogram_tile(sound_path, level, index):
+    """
+    Render a tile of the spectrogram of a sound and add it to the tiles cache
+    Returns:
+        path of the PNG image of the tile
+    """
+    return tiles_cache().set(tile_key(sound_path, level, index), render_tile(sound_path, level, index))
+
+
+def level_num_tiles(num_samples, level):
+    """
+    Number of tiles of a level of the spectrogram of a sound of num_samples samples at SAMPLE_RATE
+    """
+    return -(-num_samples // (TILE_WIDTH * MIN_HOP * 2 ** level))
+
+
+def prerendered_tiles(num_samples):
+    """
+    Tiles rendered when a sound is uploaded, the ones of the levels with at most PRERENDERED_TILES tiles
+    Yields:
+        (level, index) of the tiles
+    """
+    for level in range(NUM_LEVELS):
+        num_tiles = level_num_tiles(num_samples, level)
+        if num_tiles <= PRERENDERED_TILES:
+            for index in range(num_tiles):
+                yield level, index
+
+
+def prerender_spectrogram(sound_path):
+    """
+    Render the tiles of the coarse levels of the spectrogram of a sound that are not in the tiles cache. The length
+    of the sound is read from its peaks file.
+    Returns:
+        number of tiles rendered
+    """
+    rendered = 0
+    for level, index in prerendered_tiles(read_num_samples(peaks_file_path(sound_path))):
+        if get_spectrogram_tile(sound_path, level, index) is None:
+            create_spectrogram_tile(sound_path, level, index)
+            rendered += 1
+    return rendered
@@ -1,8 +1,14 @@
 
+from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from django.contrib.auth.models import User
-from annotation.models import DataSet, Exercise, Tier, Sound, Annotation
+from annotation.models import DataSet, Exercise, Tier, Sound, Annotation, AnnotationSimilarity, Complete, \
+    AnnotationRevision
 
 
 class TierModelTests(TestCase):
@@ -66,6 +72,44 @@ class TierModelTests(TestCase):
         self.assertTrue(self.tier_1 in list_of_special_parent_tiers)
 
 
+    def test_related_tiers_number_of_queries(self):
+        child_tier = Tier.objects.create(name='tier_2', exercise=self.exercise, parent_tier=self.tier_1)
+        grandchild_tier = Tier.objects.create(name='tier_3', exercise=self.exercise, parent_tier=child_tier)
+        special_child_tier = Tier.objects.create(name='tier_4', exercise=self.exercise,
+                                                 special_parent_tier=grandchild_tier)
+
+        # the related tiers are read from the materialized graph, whatever the depth of the relations
+        with self.assertNumQueries(1):
+            related_tier_ids = self.tier_1.get_related_tier_ids()
+        self.assertEqual(set(related_tier_ids['sync_childs']), {child_tier.id, grandchild_tier.id,
+                                                                special_child_tier.id})
+        self.assertEqual(special_child_tier.get_special_parent_tiers(), [child_tier, grandchild_tier])
+
+        # the graph is updated when a tier is deleted
+        grandchild_tier.delete()
+        self.assertEqual(self.tier_1.get_sync_tiers(), [child_tier])
+
+    def test_related_tiers_saved(self):
+        child_tier = Tier.objects.create(name='tier_2', exercise=self.exercise, parent_tier=self.tier_1)
+        child_tier.name = 'tier_2_renamed'
+        child_tier.save()
+
+        # the graph is stored as jsonb in every tier of the exercise
+        related_tiers = dict(Tier.objects.filter(exercise=self.exercise).values_list('id', 'related_tiers'))
+        self.assertEqual(related_tiers[self.tier_1.id]['sync_childs'], [child_tier.id])
+        self.assertEqual(related_tiers[child_tier.id]['sync_parent'], [self.tier_1.id])
+        self.assertEqual(child_tier.related_tiers, related_tiers[child_tier.id])
+
+    def test_tier_cycle(self):
+        child_tier = Tier.objects.create(name='tier_2', exercise=self.exercise, parent_tier=self.tier_1)
+        self.tier_1.parent_tier = child_tier
+        self.assertRaises(ValidationError, self.tier_1.clean)
+
+        # a cycle saved anyway doesn't make the related tiers computation endless
+        self.tier_1.save()
+        self.assertEqual(self.tier_1.get_sync_tiers(), [child_tier])
+
+
 class SoundModelTests(TestCase):
 
     def setUp(self):
@@ -126,6 +170,28 @@ class SoundModelTests(TestCase):
         self.assertEqual(annotations[0]['end'], annotation_1.end_time)
         self.assertEqual(annotations[0]['annotation'], annotation_1.name)
 
+    def test_get_annotations_number_of_queries(self):
+        tier = Tier.objects.create(name='test tier', exercise=self.exercise)
+        Tier.objects.create(name='other tier', exercise=self.exercise)
+        for i in range(10):
+            reference = Annotation.objects.create(start_time=i, end_time=i + 1, sound=self.reference_sound_2,
+                                                  tier=tier, user=self.user)
+            annotation = Annotation.objects.create(start_time=i, end_time=i + 1, sound=self.sound, tier=tier,
+                                                   user=self.user)
+            AnnotationSimilarity.objects.create(reference=reference, similar_sound=annotation,
+                                                similarity={'value': i}, user=self.user)
+
+        with self.assertNumQueries(2):
+            annotations = self.sound.get_annotations_for_tier(tier, self.user)
+        self.assertEqual(len(annotations), 10)
+        self.assertTrue(all(a['similarity'] == 'yes' for a in annotations))
+
+        with self.assertNumQueries(3):
+            annotations = self.sound.get_annotations_as_dict()
+        self.assertEqual(len(annotations['test tier']), 10)
+        self.assertEqual(annotations['other tier'], [])
+        self.assertEqual(annotations['test tier'][0]['similarity'], {self.user.username: 0.0})
+
     def test_update_annotations(self):
         # create annotation data as it is done in the interface
         new_annotations = [{
@@ -350,3 +416,159 @@ class SoundModelTests(TestCase):
         self.assertEqual(son_tier_annotations[1]['start'], shared_start_time)
         self.assertEqual(son_tier_annotations[0]['end'], shared_end_time)
 
+
+    def test_update_annotations_delete_only_related_tiers(self):
+        tier = Tier.objects.create(name='test tier', exercise=self.exercise)
+        sync_tier = Tier.objects.create(name='sync tier', exercise=self.exercise, parent_tier=tier)
+        other_tier = Tier.objects.create(name='other tier', exercise=self.exercise)
+        new_annotations = [{'id': '', 'start': 10, 'end': 20, 'annotation': 'note', 'similarity': ''}]
+        self.sound.update_annotations(tier, new_annotations, self.user)
+        Annotation.objects.filter(tier=sync_tier).update(name='note')
+        Annotation.objects.create(sound=self.sound, tier=other_tier, start_time=10, end_time=20, name='note',
+                                  user=self.user)
+        other_revision = self.sound.get_annotation_revision(other_tier)
+
+        self.sound.update_annotations(tier, [], self.user)
+        # the annotation is removed from the tier and its sync tier, the unrelated tier and its revision don't change
+        self.assertFalse(Annotation.objects.filter(tier__in=[tier, sync_tier]).exists())
+        self.assertEqual(Annotation.objects.filter(tier=other_tier).count(), 1)
+        self.assertEqual(self.sound.get_annotation_revision(other_tier), other_revision)
+
+    def test_update_annotations_number_of_queries(self):
+        tier = Tier.objects.create(name='parent', exercise=self.exercise)
+        Tier.objects.create(name='son', exercise=self.exercise, parent_tier=tier)
+        Tier.objects.create(name='special son', exercise=self.exercise, special_parent_tier=tier)
+        other_sound = Sound.objects.create(filename='other sound', exercise=self.exercise, original_filename='')
+
+        def save_segments(sound, number_of_segments):
+            new_annotations = [{"annotation": "", "start": i, "end": i + 1, "id": "", "similarity": ""}
+                               for i in range(number_of_segments)]
+            sound.update_annotations(tier, new_annotations, self.user)
+            modified_annotations = [{"annotation": "modified", "start": a.start_time, "end": a.end_time + 1,
+                                     "id": a.id, "similarity": ""}
+                                    for a in sound.annotations.filter(tier=tier).order_by('start_time')[1:]]
+            with CaptureQueriesContext(connection) as queries:
+                sound.update_annotations(tier, modified_annotations, self.user)
+            return len(queries)
+
+        # the number of queries of a save shouldn't depend on the number of segments
+        self.assertEqual(save_segments(self.sound, 2), save_segments(other_sound, 50))
+        self.assertEqual(other_sound.annotations.filter(tier=tier).count(), 49)
+        self.assertEqual(other_sound.annotations.filter(tier__name='son').count(), 49)
+        self.assertEqual(other_sound.annotations.filter(tier__name='special son').count(), 49)
+        self.assertFalse(other_sound.annotations.filter(tier__name='son', end_time=1).exists())
+
+    def test_lock_annotation_revision_of_related_tiers(self):
+        tier = Tier.objects.create(name='parent', exercise=self.exercise)
+        sync_tier = Tier.objects.create(name='son', exercise=self.exercise, parent_tier=tier)
+        special_tier = Tier.objects.create(name='special son', exercise=self.exercise, special_parent_tier=tier)
+        other_tier = Tier.objects.create(name='other', exercise=self.exercise)
+        with transaction.atomic():
+            annotation_revision = self.sound.lock_annotation_revision(tier)
+        self.assertEqual(annotation_revision.tier_id, tier.id)
+        # the revisions of the related tiers are created to be locked with the one of the tier
+        self.assertEqual(set(AnnotationRevision.objects.filter(sound=self.sound).values_list('tier_id', flat=True)),
+                         {tier.id, sync_tier.id, special_tier.id})
+        self.assertEqual(self.sound.get_annotation_revision(other_tier), 0)
+
+    def test_get_changed_sound_ids(self):
+        tier = Tier.objects.create(name='test tier', exercise=self.exercise)
+        self.exercise.reference_sound = self.reference_sound_2
+        self.exercise.save()
+        self.sound.update_annotations(tier, [{"annotation": "", "start": 1, "end": 2, "id": "", "similarity": ""}],
+                                      self.user)
+        since = timezone.now()
+        self.assertEqual(self.data_set.get_changed_sound_ids(since), set())
+
+        # removing annotations changes the sound
+        self.sound.update_annotations(tier, [], self.user)
+        self.assertEqual(self.data_set.get_changed_sound_ids(since), {self.sound.id})
+
+        # changing the reference sound changes all the sounds of the exercise
+        self.reference_sound_2.update_annotations(tier, [{"annotation": "", "start": 1, "end": 2, "id": "",
+                                                          "similarity": ""}], self.user)
+        self.assertEqual(self.data_set.get_changed_sound_ids(since), {self.sound.id, self.reference_sound_2.id})
+
+
+class UpdateCompleteTests(TestCase):
+
+    def setUp(self):
+        self.data_set = DataSet.objects.create(name='test_data_set_complete')
+        self.users = [User.objects.create(username='user %s' % i) for i in range(2)]
+        self.data_set.users.add(*self.users)
+        self.exercise = Exercise.objects.create(data_set=self.data_set, name='test_exercise')
+        self.tiers = [Tier.objects.create(name='tier %s' % i, exercise=self.exercise) for i in range(2)]
+        self.reference_sound = Sound.objects.create(filename='reference', exercise=self.exercise,
+                                                    original_filename='')
+        self.exercise.reference_sound = self.reference_sound
+        self.exercise.save()
+        # numbers of annotations of each tier, the reference has 2 and 1
+        counts = [(2, 1), (2, 1), (3, 1), (2, 0), (1, 1), (0, 0)]
+        # numbers of similarities of each user in each tier
+        similarities = [((2, 1), (2, 1)), ((1, 1), (2, 0)), ((3, 1), (0, 0)), ((2, 0), (2, 0)), ((1, 1), (0, 1)),
+                        ((0, 0), (0, 0))]
+        self.create_annotations(self.reference_sound, (2, 1))
+        self.sounds = []
+        for i, (sound_counts, sound_similarities) in enumerate(zip(counts, similarities)):
+            sound = Sound.objects.create(filename='sound %s' % i, exercise=self.exercise, original_filename='')
+            self.create_annotations(sound, sound_counts, sound_similarities)
+            self.sounds.append(sound)
+        # sounds already complete for the first user
+        for sound in self.sounds[2:5]:
+            Complete.objects.create(sound=sound, user=self.users[0])
+
+        # the sounds of an exercise without a reference sound are left as they are
+        other_exercise = Exercise.objects.create(data_set=self.data_set, name='other_exercise')
+        self.other_sound = Sound.objects.create(filename='other sound', exercise=other_exercise,
+                                                original_filename='')
+        Complete.objects.create(sound=self.other_sound, user=self.users[1])
+
+    def create_annotations(self, sound, counts, similarities=()):
+        for tier, count in zip(self.tiers, counts):
+            for i in range(count):
+                Annotation.objects.create(start_time=i, end_time=i + 1, sound=sound, tier=tier, user=self.users[0])
+        for user, user_similarities in zip(self.users, similarities):
+            for tier, count in zip(self.tiers, user_similarities):
+                for annotation in sound.annotations.filter(tier=tier)[:count]:
+                    AnnotationSimilarity.objects.create(reference=annotation, similar_sound=annotation,
+                                                        similarity={}, user=user)
+
+    def update_complete_loop(self):
+        # the loop the command used to run, over each sound, tier and user
+        for exercise in Exercise.objects.filter(data_set=self.data_set, reference_sound__isnull=False):
+            for sound in exercise.sounds.exclude(id=exercise.reference_sound_id):
+                for tier in exercise.tiers.order_by('id'):
+                    for user in self.data_set.users.all():
+                        annotations = tier.annotations.filter(sound=sound, tier=tier).all()
+                        reference_annotations = exercise.reference_sound.annotations.filter(tier=tier)
+                        similarities = AnnotationSimilarity.objects.filter(similar_sound__in=annotations, user=user)
+                        try:
+                            complete = Complete.objects.get(user=user, sound=sound)
+                            if not annotations.count() == reference_annotations.count() and similarities.count() == \
+                                    annotations.count():
+                                complete.delete()
+                        except ObjectDoesNotExist:
+                            if annotations.count() == reference_annotations.count() and similarities.count() == \
+                                    annotations.count():
+                                Complete.objects.create(user=user, sound=sound)
+
+    def test_update_complete_as_loop(self):
+        def completed():
+            return set(Complete.objects.values_list('sound_id', 'user_id'))
+
+        initial = completed()
+        self.update_complete_loop()
+        expected = completed()
+        Complete.objects.all().delete()
+        Complete.objects.bulk_create([Complete(sound_id=sound_id, user_id=user_id) for sound_id, user_id in initial])
+
+        call_command('update_complete', self.data_set.name)
+        self.assertEqual(completed(), expected)
+        self.assertIn((self.sounds[0].id, self.users[0].id), expected)
+        self.assertIn((self.other_sound.id, self.users[1].id), expected)
+        self.assertNotIn((self.sounds[3].id, self.users[0].id), expected)
+        self.assertFalse(Complete.objects.filter(sound=self.reference_sound).exists())
+
+        # nothing changes the second time
+        call_command('update_complete', self.data_set.name)
+        self.assertEqual(completed(), expected)
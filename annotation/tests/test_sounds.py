@@ -1,10 +1,23 @@
+import io
+import os
 import json
+import wave
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-from django.test import TestCase
+import pydub
+from django.conf import settings
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 
-from annotation.models import DataSet, Exercise, Tier, Sound, Annotation, AnnotationSimilarity
+from annotation.models import DataSet, Exercise, Tier, Sound, Annotation, AnnotationSimilarity, MediaFile, \
+    AnnotationRevision, DataSetExportMark
+from annotation.management.commands.upload_data_set import Command as UploadDataSetCommand
 import annotation.utils
+import annotation.ingest
+import annotation.jsonstream
+import annotation.watch
 
 
 class CreateSoundTest(TestCase):
@@ -114,5 +127,213 @@ class CreateSoundTest(TestCase):
         self.assertEqual(exercise_annotations_json[self.sound.filename][self.tier.name][0]['similarity']
                          ['reference_annotation_end_time'], end_time)
 
+    def test_download_annotations_command_write_error(self):
+        export_path = tempfile.TemporaryDirectory()
+        self.addCleanup(export_path.cleanup)
+        file_path = os.path.join(export_path.name, self.data_set.name, 'test_sound.json')
+        # a directory where the annotations file of the sound goes makes its write fail
+        os.makedirs(file_path)
 
+        with override_settings(EXPORT_PATH=export_path.name):
+            call_command('download_annotations', self.data_set.name)
+            # the failed file is written again by the next incremental download
+            self.assertFalse(DataSetExportMark.objects.filter(data_set=self.data_set).exists())
+            self.assertEqual(os.listdir(os.path.dirname(file_path)), ['test_sound.json'])
 
+            os.rmdir(file_path)
+            call_command('download_annotations', self.data_set.name, incremental=True)
+            with open(file_path) as f:
+                self.assertEqual(json.load(f), {self.tier.name: []})
+            self.assertTrue(DataSetExportMark.objects.filter(data_set=self.data_set).exists())
+
+    def test_ingest_exercise(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        dataset_path = directory.name
+        with open(os.path.join(dataset_path, 'ref.trans_json'), 'w') as f:
+            json.dump({'tier_1': [{'label': 'a', 'start_time': 1, 'end_time': 2},
+                                  {'label': 'a', 'start_time': 1, 'end_time': 2}]}, f)
+        with open(os.path.join(dataset_path, 'rec.json'), 'w') as f:
+            json.dump({'tier_1': [{'label': 'a', 'start_time': 1, 'end_time': 2}]}, f)
+        rubric_data = {'tier_1': {'rubric': {'ratings': ['good', 'bad']}},
+                       'tier_2': {'parent_tier': 'tier_1'}}
+        description = {'name': 'ingested exercise', 'ref_media': 'ref.wav',
+                       'recs': [{'path': 'rec.wav', '_id': 'rec'}, {'path': 'missing.wav'}]}
+        media_filenames = {'ref.wav': 'ref.mp3', 'rec.wav': 'rec.mp3'}
+
+        exercise = annotation.ingest.ingest_exercise(self.data_set, 'ex_1', description, dataset_path,
+                                                     media_filenames, self.user, rubric_data)
+
+        self.assertEqual(exercise.tiers.get(name='tier_2').parent_tier.name, 'tier_1')
+        self.assertEqual(sorted(exercise.tiers.get(name='tier_1').tag_set.values_list('name', flat=True)),
+                         ['bad', 'good'])
+        self.assertEqual(exercise.reference_sound.filename, 'ref.mp3')
+        self.assertEqual(exercise.sounds.count(), 2)
+        # the repeated reference annotation is created once, and the labels are kept only in the reference sound
+        self.assertEqual(list(exercise.reference_sound.annotations.values_list('name', flat=True)), ['a'])
+        self.assertEqual(list(exercise.sounds.get(name='rec').annotations.values_list('name', flat=True)), [''])
+        # the statistics are updated with F expressions
+        exercise.statistics.refresh_from_db()
+        self.assertEqual(exercise.statistics.number_of_sounds, 2)
+
+        # importing the exercise again doesn't create anything
+        annotation.ingest.ingest_exercise(self.data_set, 'ex_1', description, dataset_path, media_filenames,
+                                          self.user, rubric_data)
+        self.assertEqual(exercise.sounds.count(), 2)
+        self.assertEqual(exercise.tiers.count(), 2)
+        self.assertEqual(Annotation.objects.filter(sound__exercise=exercise).count(), 2)
+
+        # the annotations removed to import them again change the revisions of the sound
+        rec = exercise.sounds.get(name='rec')
+        revision = AnnotationRevision.objects.get(sound=rec, tier__name='tier_1').revision
+        with open(os.path.join(dataset_path, 'rec.json'), 'w') as f:
+            json.dump({}, f)
+        annotation.ingest.ingest_exercise(self.data_set, 'ex_1', description, dataset_path, media_filenames,
+                                          self.user, rubric_data, force_annotations=True)
+        self.assertFalse(rec.annotations.exists())
+        self.assertEqual(AnnotationRevision.objects.get(sound=rec, tier__name='tier_1').revision, revision + 1)
+        # the removed annotations are not counted in the statistics of the day
+        self.assertEqual(exercise.daily_statistics.get().segments, 1)
+
+    def test_read_annotations_invalid_segments(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        annotations_file_path = os.path.join(directory.name, 'sound.json')
+        with open(annotations_file_path, 'w') as f:
+            f.write('{"%s": [\n{"label": "a", "start_time": 1, "end_time": 2},\n{"label": "b", "start_time": 3},\n'
+                    '{"label": "c", "start_time": 4, "end_time": 3},\n{"label": "d", "start_time": 5, "end_time": 6},\n'
+                    '{"label": "e", "start_time": 7, ' % self.tier.name)
+
+        annotations = list(annotation.ingest.read_annotations(annotations_file_path, self.sound,
+                                                              {self.tier.name: self.tier}, self.user, True))
+        # the invalid segments and the truncated end of the file are skipped
+        self.assertEqual([a.name for a in annotations], ['a', 'd'])
+
+    def test_iter_tier_segments_malformed_segment(self):
+        segment = '{"label": "a", "start_time": 1, "end_time": 2}'
+        content = '{"%s": [\n%s,\n{"label": "b" "start_time": 3},\n%s]}' % (self.tier.name, segment,
+                                                                            ',\n'.join([segment] * 100000))
+        f = io.StringIO(content)
+        segments = annotation.jsonstream.iter_tier_segments(f, chunk_size=1024)
+        self.assertEqual(next(segments)[1]['label'], 'a')
+        with self.assertRaises(annotation.jsonstream.JSONStreamError) as error:
+            next(segments)
+        self.assertEqual(error.exception.line, 3)
+        # the error is found without reading the rest of the file
+        self.assertLess(f.tell(), 10 * 1024)
+
+    def test_process_sound_file_unchanged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        source_path = os.path.join(directory.name, 'sound.mp3')
+        with open(source_path, 'wb') as f:
+            f.write(b'sound')
+        media_file = {'content_hash': annotation.utils.file_hash(source_path), 'filename': 'sound.mp3'}
+
+        result = annotation.utils.process_sound_file(source_path, 'data_set', 'exercise', 'sound.mp3', media_file)
+        self.assertFalse(result['copied'])
+        self.assertEqual(result['filename'], 'sound.mp3')
+        self.assertEqual(result['size'], 5)
+
+
+class UploadDataSetTests(TransactionTestCase):
+    """
+    The connections are closed before the sounds are submitted to the pool, so these tests are not in a transaction
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dataset_path = os.path.join(self.directory.name, 'data_set')
+        os.mkdir(self.dataset_path)
+        self.settings_override = override_settings(MEDIA_ROOT=os.path.join(self.directory.name, 'media'))
+        self.settings_override.enable()
+        # the encoder fails like ffmpeg without mp3 support
+        self.converter = pydub.AudioSegment.converter
+        pydub.AudioSegment.converter = os.path.join(self.directory.name, 'converter')
+        with open(pydub.AudioSegment.converter, 'w') as f:
+            f.write('#!/bin/sh\necho "Unknown encoder" >&2\nexit 1\n')
+        os.chmod(pydub.AudioSegment.converter, 0o755)
+
+        self.data_set = DataSet.objects.create(name='test_data_set')
+        with wave.open(os.path.join(self.dataset_path, 'rec.wav'), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(8000)
+            f.writeframes(b'\0\0' * 8000)
+        with open(os.path.join(self.dataset_path, 'ref.mp3'), 'wb') as f:
+            f.write(b'sound')
+        self.descriptions = {'ex_1': {'name': 'exercise', 'ref_media': 'ref.mp3', 'recs': [{'path': 'rec.wav'}]}}
+
+    def tearDown(self):
+        pydub.AudioSegment.converter = self.converter
+        self.settings_override.disable()
+        self.directory.cleanup()
+
+    def submit_media_files(self):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return UploadDataSetCommand.submit_media_files(pool, self.dataset_path, self.data_set, self.descriptions)
+
+    def media_file_result(self, media_files, relative_path):
+        destination, future = media_files[('ex_1', relative_path)]
+        return UploadDataSetCommand.media_file_result(self.data_set, self.dataset_path, relative_path, destination,
+                                                      future)
+
+    def test_media_file_result(self):
+        media_files = self.submit_media_files()
+        self.assertEqual(self.media_file_result(media_files, 'ref.mp3'), 'ref.mp3')
+        self.assertEqual(MediaFile.objects.get(filename='ref.mp3').size, 5)
+        # the file is not processed again while it doesn't change
+        media_files = self.submit_media_files()
+        self.assertTrue(media_files[('ex_1', 'ref.mp3')][1].result()['unchanged'])
+        self.assertEqual(self.media_file_result(media_files, 'ref.mp3'), 'ref.mp3')
+
+    def test_media_file_result_transcoding_error(self):
+        media_files = self.submit_media_files()
+        # the error of the encoder is raised, so the sound is not created without its mp3
+        with self.assertRaises(Exception):
+            self.media_file_result(media_files, 'rec.wav')
+        self.assertFalse(MediaFile.objects.filter(filename='rec.mp3').exists())
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'test_data_set', 'exercise', 'rec.mp3')))
+
+    @override_settings(STREAMING_TRANSCODE_MIN_SIZE=0, TRANSCODE_MEMORY_LIMIT=256 * 1024 * 1024)
+    def test_stream_mp3_copy_error(self):
+        with open(pydub.AudioSegment.converter, 'w') as f:
+            f.write('#!/bin/sh\necho "Unknown encoder, memory limit $(ulimit -v)" >&2\nexit 1\n')
+        media_files = self.submit_media_files()
+        # the output of the encoder is in the error, which isn't lost in the pool
+        with self.assertRaisesRegex(RuntimeError, 'Unknown encoder, memory limit 262144'):
+            self.media_file_result(media_files, 'rec.wav')
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'test_data_set', 'exercise', 'rec.mp3')))
+
+
+class PollingWatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        os.makedirs(os.path.join(self.root.name, 'data_set_1', 'recordings'))
+        os.mkdir(os.path.join(self.root.name, 'data_set_2'))
+        self.watcher = annotation.watch.PollingWatcher(self.root.name, interval=0)
+
+    def write(self, path, content):
+        with open(os.path.join(self.root.name, path), 'w') as f:
+            f.write(content)
+
+    def test_changes(self):
+        # the directories are new the first time
+        self.assertEqual(self.watcher.changes(timeout=0), {'data_set_1', 'data_set_2'})
+        self.assertEqual(self.watcher.changes(timeout=0), set())
+
+        # the files of the subdirectories are watched
+        self.write(os.path.join('data_set_1', 'recordings', 'rec.wav'), 'sound')
+        self.assertEqual(self.watcher.changes(timeout=0), {'data_set_1'})
+        self.write(os.path.join('data_set_1', 'recordings', 'rec.wav'), 'longer sound')
+        self.write(os.path.join('data_set_2', 'description.json'), '{}')
+        self.assertEqual(self.watcher.changes(timeout=0), {'data_set_1', 'data_set_2'})
+
+        # removed directories and files outside of a directory are not changes
+        os.remove(os.path.join(self.root.name, 'data_set_2', 'description.json'))
+        self.assertEqual(self.watcher.changes(timeout=0), {'data_set_2'})
+        os.rmdir(os.path.join(self.root.name, 'data_set_2'))
+        self.write('notes.txt', 'notes')
+        self.assertEqual(self.watcher.changes(timeout=0), set())
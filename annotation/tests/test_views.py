@@ -1,10 +1,26 @@
 import os
+import io
+import time
+import json
+import zipfile
+import tempfile
 
+import numpy
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.conf import settings
-from annotation.models import DataSet, Exercise, Sound, Tier, Annotation, AnnotationSimilarity
+from django.test import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from annotation.models import DataSet, Exercise, Sound, Tier, Annotation, AnnotationSimilarity, ExportJob, \
+    Complete, MediaJob
+from annotation.export import run_export_job
+from annotation.media_jobs import run_media_job
+import annotation.clips
+import annotation.peaks
+import annotation.spectrogram
 
 
 class ExerciseListViewTests(TestCase):
@@ -44,6 +60,31 @@ class ExerciseListViewTests(TestCase):
         self.assertEqual(response.context['exercises_list'][0], exercise_2)
         self.assertEqual(response.context['exercises_list'][1], self.exercise)
 
+    def test_exercise_list_statistics(self):
+        tier = Tier.objects.create(name='test_tier', exercise=self.exercise)
+        reference_sound = Sound.objects.create(filename='reference_sound', original_filename='', exercise=self.exercise)
+        sound = Sound.objects.create(filename='test_sound', original_filename='', exercise=self.exercise)
+        self.exercise.reference_sound = reference_sound
+        self.exercise.save()
+        reference_sound.update_annotations(tier, [{'id': '', 'start': 1, 'end': 2, 'annotation': 'reference',
+                                                   'similarity': 'no'}], self.user)
+        reference_annotation = reference_sound.annotations.get()
+        sound.update_annotations(tier, [{'id': '', 'start': 1, 'end': 2, 'annotation': '', 'similarity': 'yes',
+                                         'reference': reference_annotation.id, 'similValue': 5}], self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.test_client.get(reverse('exercise_list', kwargs={'dataset_id': self.data_set.id}))
+        self.assertFalse([q for q in queries if 'annotation_annotation' in q['sql']])
+        self.assertEqual(response.context['number_of_sounds'], 2)
+        self.assertEqual(response.context['number_of_completed_sounds'], 1)
+        self.assertEqual(response.context['last_week_segments'], 2)
+        self.assertEqual(response.context['last_week_similarity_annotations'], 1)
+
+        sound.delete()
+        response = self.test_client.get(reverse('exercise_list', kwargs={'dataset_id': self.data_set.id}))
+        self.assertEqual(response.context['number_of_sounds'], 1)
+        self.assertEqual(response.context['number_of_completed_sounds'], 0)
+
     def test_exercises_list_data_set_id(self):
         response = self.test_client.get(reverse('exercise_list', kwargs={'dataset_id': self.data_set.id}))
         self.assertEqual(response.context['data_set'], self.data_set)
@@ -185,6 +226,33 @@ class SoundListViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(reference_sound == response.context['reference_sound'])
 
+    def test_sound_list_pagination(self):
+        reference_sound = Sound.objects.create(filename='reference_sound', original_filename='', exercise=self.exercise)
+        self.exercise.reference_sound = reference_sound
+        self.exercise.save()
+        sounds = [self.sound] + [Sound.objects.create(filename='sound_%s' % i, original_filename='',
+                                                      exercise=self.exercise) for i in range(25)]
+        Complete.objects.create(sound=sounds[21], user=self.user)
+        url = reverse('sound_list', kwargs={'exercise_id': self.exercise.id})
+
+        response = self.test_client.get(url)
+        page = response.context['sounds_list']
+        self.assertEqual(list(page), sounds[:20])
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+
+        response = self.test_client.get(url, {'after': page.next_cursor()})
+        page = response.context['sounds_list']
+        self.assertEqual(list(page), sounds[20:])
+        self.assertEqual([s.is_completed for s in page], [False, True, False, False, False, False])
+        self.assertFalse(page.has_next)
+
+        response = self.test_client.get(url, {'before': page.previous_cursor()})
+        self.assertEqual(list(response.context['sounds_list']), sounds[:20])
+
+        response = self.test_client.get(url, {'completed': 'yes'})
+        self.assertEqual(list(response.context['sounds_list']), [sounds[21]])
+
     def test_sound_list_post(self):
         reference_sound = Sound.objects.create(filename='reference_sound', original_filename='', exercise=self.exercise)
         post_data = {'reference sound': reference_sound.id}
@@ -264,6 +332,7 @@ class AnnotationActionViewTests(TestCase):
 
         self.test_client = Client()
         self.test_client.login(username=username, password=password)
+        self.data_set.users.add(self.user)
 
         sound_filename = 'test_sound'
         self.sound = Sound.objects.create(filename=sound_filename, original_filename=sound_filename,
@@ -273,6 +342,16 @@ class AnnotationActionViewTests(TestCase):
         self.exercise.reference_sound = self.reference_sound
         self.exercise.save()
 
+    def other_user_client(self):
+        # a user of another data set
+        user = User.objects.create(username='other')
+        user.set_password('1234567')
+        user.save()
+        DataSet.objects.create(name='other_data_set').users.add(user)
+        client = Client()
+        client.login(username='other', password='1234567')
+        return client
+
     def test_annotation_action_get_empty(self):
         response = self.test_client.get(reverse('annotation-action', kwargs={'sound_id': self.sound.id,
                                                                              'tier_id': self.tier.id}))
@@ -293,6 +372,264 @@ class AnnotationActionViewTests(TestCase):
                                                                       self.exercise.name, self.sound.filename))
 
 
+    def test_sound_peaks(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        sound_path = os.path.join(media_root.name, self.data_set.name, self.exercise.name, self.sound.filename)
+        os.makedirs(os.path.dirname(sound_path))
+        with open(sound_path, 'wb') as f:
+            f.write(b'sound')
+        levels = [numpy.array([[-i, i] for i in range(8)], dtype='<i2'),
+                  numpy.array([[-i, i] for i in range(1, 8, 2)], dtype='<i2')]
+        peaks_path = annotation.peaks.peaks_file_path(sound_path)
+        annotation.peaks.write_peaks(peaks_path, levels)
+        url = reverse('sound_peaks', args=[self.sound.id])
+
+        with override_settings(MEDIA_ROOT=media_root.name):
+            response = self.test_client.get(url, {'width': 3})
+            self.assertEqual(response.status_code, 200)
+            # the coarsest level with enough peaks
+            self.assertEqual(list(numpy.frombuffer(response.content, dtype='<i2')), [-1, 1, -3, 3, -5, 5, -7, 7])
+            self.assertEqual(response['X-Peaks-Samples-Per-Peak'], str(annotation.peaks.SAMPLES_PER_PEAK * 2))
+
+            response = self.test_client.get(url, {'width': 100})
+            self.assertEqual(len(response.content), 8 * 4)
+
+            response = self.test_client.get(reverse('sound_peaks', args=[self.reference_sound.id]))
+            self.assertEqual(response.status_code, 404)
+
+            # the users of other data sets can't get the peaks or queue a media job
+            os.utime(peaks_path, (0, 0))
+            self.assertEqual(self.other_user_client().get(url, {'width': 3}).status_code, 404)
+            self.assertFalse(MediaJob.objects.exists())
+
+            # peaks older than the sound are computed by a media job, the request doesn't wait for them
+            self.assertEqual(self.test_client.get(url, {'width': 3}).status_code, 202)
+            self.assertEqual(self.test_client.get(url, {'width': 3}).status_code, 202)
+            self.assertEqual(MediaJob.objects.filter(sound=self.sound, kind=MediaJob.PEAKS).count(), 1)
+            job = MediaJob.claim()
+
+            # a job left running by a stopped worker is queued again
+            self.assertEqual(self.test_client.get(url, {'width': 3}).status_code, 202)
+            self.assertEqual(MediaJob.objects.get(id=job.id).status, MediaJob.RUNNING)
+            MediaJob.objects.filter(id=job.id).update(updated_at=timezone.now() - MediaJob.RUNNING_TIMEOUT * 2)
+            self.assertEqual(self.test_client.get(url, {'width': 3}).status_code, 202)
+            self.assertEqual(MediaJob.objects.get().status, MediaJob.QUEUED)
+            job = MediaJob.claim()
+            with self.assertRaises(Exception):
+                # the sound can't be decoded
+                run_media_job(job)
+            self.assertEqual(MediaJob.objects.get(id=job.id).status, MediaJob.FAILED)
+            self.assertEqual(self.test_client.get(url, {'width': 3}).status_code, 404)
+
+            # the job of peaks computed after it was queued is removed
+            os.utime(sound_path, (time.time() + 10, time.time() + 10))
+            self.assertEqual(self.test_client.get(url, {'width': 3}).status_code, 202)
+            annotation.peaks.write_peaks(peaks_path, levels)
+            os.utime(peaks_path, (time.time() + 20, time.time() + 20))
+            run_media_job(MediaJob.claim())
+            self.assertFalse(MediaJob.objects.filter(status=MediaJob.QUEUED).exists())
+            self.assertEqual(self.test_client.get(url, {'width': 3}).status_code, 200)
+
+    def test_sound_spectrogram(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        tiles_root = tempfile.TemporaryDirectory()
+        self.addCleanup(tiles_root.cleanup)
+        sound_path = os.path.join(media_root.name, self.data_set.name, self.exercise.name, self.sound.filename)
+        os.makedirs(os.path.dirname(sound_path))
+        with open(sound_path, 'wb') as f:
+            f.write(b'sound')
+        url = reverse('sound_spectrogram', args=[self.sound.id])
+
+        with override_settings(MEDIA_ROOT=media_root.name, SPECTROGRAM_CACHE_ROOT=tiles_root.name):
+            self.assertEqual(self.test_client.get(url, {'level': 'a', 'index': 0}).status_code, 400)
+            self.assertEqual(self.test_client.get(url, {'level': annotation.spectrogram.NUM_LEVELS,
+                                                        'index': 0}).status_code, 400)
+            # the number of tiles is known from the peaks, they are computed first
+            self.assertEqual(self.test_client.get(url, {'level': 2, 'index': 3}).status_code, 202)
+            MediaJob.objects.get(sound=self.sound, kind=MediaJob.PEAKS).delete()
+            # peaks of 5 tiles of level 2
+            num_peaks = 5 * annotation.spectrogram.TILE_WIDTH * annotation.spectrogram.MIN_HOP * 4 // \
+                annotation.peaks.SAMPLES_PER_PEAK
+            annotation.peaks.write_peaks(annotation.peaks.peaks_file_path(sound_path),
+                                         [numpy.zeros((num_peaks, 2), dtype='<i2')])
+            self.assertEqual(self.test_client.get(url, {'level': 2, 'index': 5}).status_code, 400)
+            self.assertFalse(MediaJob.objects.exists())
+            # the tiles in the cache are not rendered again
+            annotation.spectrogram.tiles_cache().set(annotation.spectrogram.tile_key(sound_path, 2, 3), b'tile')
+            response = self.test_client.get(url, {'level': 2, 'index': 3})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(b''.join(response.streaming_content), b'tile')
+
+            # the users of other data sets can't get the tiles or queue a media job
+            other_client = self.other_user_client()
+            self.assertEqual(other_client.get(url, {'level': 2, 'index': 3}).status_code, 404)
+            self.assertEqual(other_client.get(url, {'level': 2, 'index': 4}).status_code, 404)
+            self.assertFalse(MediaJob.objects.exists())
+
+            # the other tiles are rendered by a media job, the request doesn't wait for them
+            self.assertEqual(self.test_client.get(url, {'level': 2, 'index': 4}).status_code, 202)
+            self.assertEqual(self.test_client.get(url, {'level': 2, 'index': 4}).status_code, 202)
+            job = MediaJob.objects.get(sound=self.sound, kind=MediaJob.SPECTROGRAM_TILE)
+            self.assertEqual((job.level, job.index), (2, 4))
+            with self.assertRaises(Exception):
+                # the sound can't be decoded
+                run_media_job(MediaJob.claim())
+            self.assertEqual(self.test_client.get(url, {'level': 2, 'index': 4}).status_code, 404)
+
+    def test_prerendered_spectrogram_tiles(self):
+        tile_samples = annotation.spectrogram.TILE_WIDTH * annotation.spectrogram.MIN_HOP
+        tiles = list(annotation.spectrogram.prerendered_tiles(tile_samples * 2 ** 5 * 16))
+        # the levels with at most 16 tiles, the last one has a tile for the whole sound
+        self.assertEqual(sorted(set(level for level, _ in tiles)), list(range(5, annotation.spectrogram.NUM_LEVELS)))
+        self.assertEqual(len(tiles), 16 + 8 + 4 + 2 + 1 + 1 + 1)
+        self.assertEqual(list(annotation.spectrogram.prerendered_tiles(0)), [])
+
+    def test_sound_clip(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        clips_root = tempfile.TemporaryDirectory()
+        self.addCleanup(clips_root.cleanup)
+        # an ID3 tag and 100 frames of MPEG-1 layer III at 128 kbit/s and 44100 Hz, of 417 bytes and 1152 samples
+        frames = b''.join(b'\xff\xfb\x90\x00' + bytes([i]) * 413 for i in range(100))
+        content = b'ID3\x03\x00\x00\x00\x00\x00\x02ab' + frames
+        for sound in (self.sound, self.reference_sound):
+            sound_path = os.path.join(media_root.name, self.data_set.name, self.exercise.name, sound.filename)
+            os.makedirs(os.path.dirname(sound_path), exist_ok=True)
+            with open(sound_path, 'wb') as f:
+                f.write(content)
+        url = reverse('sound_clip', args=[self.sound.id])
+
+        with override_settings(MEDIA_ROOT=media_root.name, CLIPS_CACHE_ROOT=clips_root.name):
+            self.assertEqual(self.test_client.get(url, {'start': 'a', 'end': 1}).status_code, 400)
+            self.assertEqual(self.test_client.get(url, {'start': 1, 'end': 0.5}).status_code, 400)
+            response = self.test_client.get(url, {'start': 0.5, 'end': 1})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'audio/mpeg')
+            # frames 19 to 38 and the 2 frames before them, which can have the bit reservoir of frame 19
+            clip = b''.join(response.streaming_content)
+            self.assertEqual(clip, frames[17 * 417:39 * 417])
+            self.assertAlmostEqual(float(response['X-Clip-Start']), 17 * 1152 / 44100, places=5)
+
+            response = self.test_client.get(url, {'start': 0.5, 'end': 1}, HTTP_RANGE='bytes=10-19')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), clip[10:20])
+
+            # the clips of the reference sound are cached
+            response = self.test_client.get(reverse('sound_clip', args=[self.reference_sound.id]),
+                                             {'start': 0.5, 'end': 1})
+            self.assertEqual(b''.join(response.streaming_content), clip)
+            cache_root = os.path.join(settings.CLIPS_CACHE_ROOT, str(self.reference_sound.id))
+            self.assertEqual(len(os.listdir(cache_root)), 1)
+
+            # the users of other data sets can't get the clips, and the clips cache isn't used for them
+            response = self.other_user_client().get(reverse('sound_clip', args=[self.reference_sound.id]),
+                                                    {'start': 0, 'end': 0.5})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(len(os.listdir(cache_root)), 1)
+
+    def test_annotation_action_patch(self):
+        url = reverse('annotation-action', kwargs={'sound_id': self.sound.id, 'tier_id': self.tier.id})
+        revision = self.test_client.get(url).json()['task']['revision']
+
+        content = {'revision': revision, 'operations': [
+            {'op': 'add', 'id': 'wavesurfer_1', 'start': 1, 'end': 2, 'annotation': 'first'},
+            {'op': 'add', 'id': 'wavesurfer_2', 'start': 2, 'end': 3, 'annotation': 'second'}]}
+        response = self.test_client.post(url, json.dumps(content), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response_data = response.json()
+        self.assertEqual(response_data['revision'], revision + 1)
+        first_id = response_data['ids']['wavesurfer_1']
+        second_id = response_data['ids']['wavesurfer_2']
+        self.assertEqual(Annotation.objects.get(id=first_id).name, 'first')
+
+        # only the changed annotations are sent
+        content = {'revision': revision + 1, 'operations': [
+            {'op': 'move', 'id': first_id, 'start': 0.5, 'end': 2},
+            {'op': 'delete', 'id': second_id}]}
+        response = self.test_client.post(url, json.dumps(content), content_type='application/json')
+        self.assertEqual(response.json()['revision'], revision + 2)
+        self.assertEqual(float(Annotation.objects.get(id=first_id).start_time), 0.5)
+        self.assertFalse(Annotation.objects.filter(id=second_id).exists())
+
+        # changes made on an old revision are rejected
+        content = {'revision': revision + 1, 'operations': [{'op': 'rename', 'id': first_id, 'annotation': 'old'}]}
+        response = self.test_client.post(url, json.dumps(content), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['revision'], revision + 2)
+        self.assertEqual(Annotation.objects.get(id=first_id).name, 'first')
+
+
+    def test_annotation_action_get_cached(self):
+        url = reverse('annotation-action', kwargs={'sound_id': self.sound.id, 'tier_id': self.tier.id})
+        self.test_client.get(url)
+        # the second time the annotations are not queried
+        with CaptureQueriesContext(connection) as queries:
+            response = self.test_client.get(url)
+        self.assertEqual(response.json()['task']['segments'], [])
+        self.assertFalse([q for q in queries if '"annotation_annotation"' in q['sql']])
+
+        # after saving, the new annotations are sent
+        self.sound.update_annotations(self.tier, [{'id': '', 'start': 1, 'end': 2, 'annotation': 'new',
+                                                   'similarity': 'no'}], self.user)
+        response = self.test_client.get(url)
+        self.assertEqual(response.json()['task']['segments'][0]['annotation'], 'new')
+
+        # the annotations changed without the interface, like in the admin, are not sent from the cache either
+        Annotation.objects.filter(sound=self.sound).update(name='renamed')
+        Annotation.objects.get(sound=self.sound).save()
+        response = self.test_client.get(url)
+        self.assertEqual(response.json()['task']['segments'][0]['annotation'], 'renamed')
+        Annotation.objects.filter(sound=self.sound).delete()
+        response = self.test_client.get(url)
+        self.assertEqual(response.json()['task']['segments'], [])
+
+
+    def test_annotation_action_get_shared_reference_segments(self):
+        Annotation.objects.create(name='reference_annotation', start_time=1.000, end_time=2.000,
+                                  sound=self.reference_sound, tier=self.tier, user=self.user)
+        self.test_client.get(reverse('annotation-action', kwargs={'sound_id': self.sound.id,
+                                                                  'tier_id': self.tier.id}))
+        # the reference segments cached for the first sound are used for the other sounds of the exercise
+        other_sound = Sound.objects.create(filename='other_sound', original_filename='', exercise=self.exercise)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.test_client.get(reverse('annotation-action', kwargs={'sound_id': other_sound.id,
+                                                                                 'tier_id': self.tier.id}))
+        self.assertEqual(response.json()['task']['segments_ref'][0]['annotation'], 'reference_annotation')
+        self.assertEqual(len([q for q in queries if '"annotation_annotation"' in q['sql']]), 1)
+
+    @override_settings(SEGMENTS_WINDOW_THRESHOLD=2, SEGMENTS_WINDOW=10)
+    def test_annotation_action_get_window(self):
+        for start, end in [(1, 2), (5, 15), (12, 13), (30, None)]:
+            Annotation.objects.create(name='%s' % start, start_time=start, end_time=end, sound=self.sound,
+                                      tier=self.tier, user=self.user)
+        Annotation.objects.create(name='reference', start_time=1, end_time=2, sound=self.reference_sound,
+                                  tier=self.tier, user=self.user)
+        url = reverse('annotation-action', kwargs={'sound_id': self.sound.id, 'tier_id': self.tier.id})
+
+        # the segments of a sound with many segments aren't sent with the task if the interface asks for windows
+        task = self.test_client.get(url, {'windows': 1}).json()['task']
+        self.assertEqual(task['segments'], [])
+        self.assertEqual(task['segments_window'], 10)
+        self.assertEqual(task['segments_ref'][0]['annotation'], 'reference')
+        self.assertIsNone(task['segments_window_ref'])
+        self.assertEqual(len(self.test_client.get(url).json()['task']['segments']), 4)
+
+        # the segments that overlap the window, even if they start before it
+        response = self.test_client.get(url, {'start': 10, 'end': 20})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['annotation'] for s in response.json()['segments']], ['5', '12'])
+        response = self.test_client.get(url, {'start': 20, 'end': 40})
+        self.assertEqual([s['annotation'] for s in response.json()['segments']], ['30'])
+        response = self.test_client.get(url, {'start': 0, 'end': 10, 'reference': 1})
+        self.assertEqual([s['annotation'] for s in response.json()['segments']], ['reference'])
+
+        response = self.test_client.get(url, {'start': 'a', 'end': 10})
+        self.assertEqual(response.status_code, 400)
+
+
 class DownloadAnnotationsViewTests(TestCase):
     def setUp(self):
         data_set_name = 'test_data_set'
@@ -343,3 +680,154 @@ class DownloadAnnotationsViewTests(TestCase):
 
 
 
+    def test_download_data_set_annotations(self):
+        response = self.test_client.get(reverse('download_annotations', kwargs={'data_set_id': self.data_set.id}))
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        zip_file = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(zip_file.namelist()), ['reference_sound.json', 'test_sound.json'])
+        annotations = json.loads(zip_file.read('test_sound.json').decode())
+        self.assertEqual(annotations[self.tier.name][0]['start_time'], self.annotation.start_time)
+        self.assertEqual(annotations[self.tier.name][0]['name'], self.annotation.name)
+
+
+class ExportJobViewTests(TestCase):
+    def setUp(self):
+        self.export_jobs_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(EXPORT_JOBS_ROOT=self.export_jobs_root.name)
+        self.settings_override.enable()
+
+        self.data_set = DataSet.objects.create(name='test_data_set')
+        self.exercise = Exercise.objects.create(data_set=self.data_set, name='test_exercise')
+        self.tier = Tier.objects.create(name='test_tier', exercise=self.exercise)
+
+        self.user = User.objects.create(username='test')
+        self.user.set_password('1234567')
+        self.user.save()
+        self.test_client = Client()
+        self.test_client.login(username='test', password='1234567')
+
+        self.sound = Sound.objects.create(filename='test_sound', original_filename='test_sound',
+                                          exercise=self.exercise)
+        self.sound.update_annotations(self.tier, [{'id': '', 'start': 1, 'end': 2, 'annotation': 'test_annotation',
+                                                   'similarity': 'no'}], self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.export_jobs_root.cleanup()
+
+    def test_export_job(self):
+        response = self.test_client.post(reverse('data_set_export', kwargs={'data_set_id': self.data_set.id}))
+        self.assertEqual(response.json()['status'], ExportJob.QUEUED)
+        job = ExportJob.claim()
+        self.assertEqual(job.id, response.json()['id'])
+        run_export_job(job)
+
+        response = self.test_client.get(reverse('export_job_status', kwargs={'job_id': job.id}))
+        self.assertEqual(response.json()['status'], ExportJob.DONE)
+        self.assertEqual(response.json()['progress'], 1)
+        content = b''.join(self.test_client.get(response.json()['url']).streaming_content)
+        zip_file = zipfile.ZipFile(io.BytesIO(content))
+        self.assertEqual(zip_file.namelist(), ['test_sound.json'])
+
+        # the same job is used while the data set doesn't change
+        response = self.test_client.post(reverse('data_set_export', kwargs={'data_set_id': self.data_set.id}))
+        self.assertEqual(response.json()['id'], job.id)
+        self.sound.update_annotations(self.tier, [], self.user)
+        response = self.test_client.post(reverse('data_set_export', kwargs={'data_set_id': self.data_set.id}))
+        self.assertNotEqual(response.json()['id'], job.id)
+
+    def test_export_job_interrupted(self):
+        job = ExportJob.request(self.data_set, self.user)
+        self.assertEqual(ExportJob.claim().id, job.id)
+        self.assertEqual(ExportJob.request(self.data_set, self.user).id, job.id)
+
+        # a running job without progress updates was left by a stopped worker, a new job is queued
+        ExportJob.objects.filter(id=job.id).update(updated_at=timezone.now() - ExportJob.RUNNING_TIMEOUT * 2)
+        new_job = ExportJob.request(self.data_set, self.user)
+        self.assertNotEqual(new_job.id, job.id)
+        self.assertEqual(new_job.status, ExportJob.QUEUED)
+        self.assertEqual(ExportJob.objects.get(id=job.id).status, ExportJob.FAILED)
+
+    def test_export_job_download_range(self):
+        job = ExportJob.request(self.data_set, self.user)
+        run_export_job(ExportJob.claim())
+        url = reverse('export_job_download', kwargs={'job_id': job.id})
+        content = b''.join(self.test_client.get(url).streaming_content)
+
+        response = self.test_client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-%d/%d' % (len(content) - 1, len(content)))
+        self.assertEqual(b''.join(response.streaming_content), content[10:])
+
+        response = self.test_client.get(url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.test_client.get(url, HTTP_RANGE='bytes=%d-' % len(content))
+        self.assertEqual(response.status_code, 416)
+
+
+class MediaViewTests(TestCase):
+
+    def setUp(self):
+        self.data_set = DataSet.objects.create(name='test_data_set')
+        self.other_data_set = DataSet.objects.create(name='other_data_set')
+        self.user = User.objects.create(username='test')
+        self.user.set_password('1234567')
+        self.user.save()
+        self.data_set.users.add(self.user)
+        self.test_client = Client()
+        self.test_client.login(username='test', password='1234567')
+
+        self.media_directory = tempfile.TemporaryDirectory()
+        self.media_root = self.media_directory.name
+        for data_set in (self.data_set, self.other_data_set):
+            os.makedirs(os.path.join(self.media_root, data_set.name, 'test_exercise'))
+            with open(os.path.join(self.media_root, data_set.name, 'test_exercise', 'sound.mp3'), 'wb') as f:
+                f.write(b'0123456789')
+        self.url = settings.MEDIA_URL + 'test_data_set/test_exercise/sound.mp3'
+
+    def tearDown(self):
+        self.media_directory.cleanup()
+
+    def test_media_permissions(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = self.test_client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'audio/mpeg')
+            self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+            # only the files of the data sets of the user, there is no index of the directories
+            self.assertEqual(self.test_client.get(
+                settings.MEDIA_URL + 'other_data_set/test_exercise/sound.mp3').status_code, 404)
+            self.assertEqual(self.test_client.get(
+                settings.MEDIA_URL + 'test_data_set/../other_data_set/test_exercise/sound.mp3').status_code, 404)
+            self.assertEqual(self.test_client.get(settings.MEDIA_URL + 'test_data_set/').status_code, 404)
+
+            self.test_client.logout()
+            self.assertEqual(self.test_client.get(self.url).status_code, 302)
+
+    def test_media_range_and_conditional_get(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            response = self.test_client.get(self.url, HTTP_RANGE='bytes=2-4')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), b'234')
+
+            etag = response['ETag']
+            self.assertEqual(self.test_client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            response = self.test_client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(self.test_client.get(self.url, HTTP_IF_NONE_MATCH='"outdated"').status_code, 200)
+
+    def test_media_offload(self):
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_OFFLOAD='x-accel-redirect',
+                               MEDIA_ACCEL_REDIRECT_PREFIX='/protected_media/'):
+            response = self.test_client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected_media/test_data_set/test_exercise/sound.mp3')
+            self.assertEqual(response.content, b'')
+
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_OFFLOAD='x-sendfile'):
+            response = self.test_client.get(self.url)
+            self.assertEqual(response['X-Sendfile'],
+                             os.path.join(self.media_root, 'test_data_set', 'test_exercise', 'sound.mp3'))
@@ -0,0 +1,114 @@
+from collections import OrderedDict, defaultdict
+
+RELATIONS = ('sync_childs', 'sync_parent', 'special_parent', 'special_child')
+
+
+def find_cycle(tiers):
+    """
+    Search for a cycle in the parent_tier or in the special_parent_tier relations of a list of tiers
+    Args:
+        tiers: iterable of (tier id, parent tier id, special parent tier id)
+
+    Returns:
+        list with the ids of the tiers in the cycle, or None if there isn't any cycle
+    """
+    tiers = list(tiers)
+    for link in (1, 2):
+        parents = {t[0]: t[link] for t in tiers}
+        checked = set()
+        for tier_id in parents:
+            path = OrderedDict()
+            current = tier_id
+            while current is not None and current not in checked:
+                if current in path:
+                    path_ids = list(path)
+                    return path_ids[path_ids.index(current):]
+                path[current] = True
+                current = parents.get(current)
+            checked.update(path)
+    return None
+
+
+def build_tier_graph(tiers):
+    """
+    Compute the sync, special parent and special child tiers of every tier of an exercise. This is the same
+    traversal done by the recursive methods of the Tier model, computed once for all the tiers so it can be stored.
+    A tier found again in the path being followed is not followed again, so cycles in the relations don't make
+    the traversal endless.
+    Args:
+        tiers: iterable of (tier id, parent tier id, special parent tier id)
+
+    Returns:
+        dict of tier id (as a string, to be stored as json) -> dict of relation name -> list of tier ids
+    """
+    tiers = list(tiers)
+    parent = {t[0]: t[1] for t in tiers}
+    special_parent = {t[0]: t[2] for t in tiers}
+    children = defaultdict(list)
+    special_children = defaultdict(list)
+    for tier_id, parent_id, special_parent_id in tiers:
+        if parent_id is not None:
+            children[parent_id].append(tier_id)
+        if special_parent_id is not None:
+            special_children[special_parent_id].append(tier_id)
+
+    def special_child_tiers(tier_id, path=frozenset()):
+        t = []
+        if tier_id in path:
+            return t
+        for special_child in special_children[tier_id]:
+            # add also sync tiers
+            t.extend(children[special_child])
+            if parent.get(special_child) is not None:
+                t.append(parent[special_child])
+            t.append(special_child)
+            t.extend(special_child_tiers(special_child, path | {tier_id}))
+        return t
+
+    def special_parent_tiers(tier_id, path=frozenset()):
+        t = []
+        special_parent_id = special_parent.get(tier_id)
+        if special_parent_id is None or tier_id in path:
+            return t
+        # add also sync tiers
+        t.extend(children[special_parent_id])
+        if parent.get(special_parent_id) is not None:
+            t.append(parent[special_parent_id])
+        t.append(special_parent_id)
+        t.extend(special_parent_tiers(special_parent_id, path | {tier_id}))
+        return t
+
+    def sync_parent(tier_id, path=frozenset()):
+        t = []
+        parent_id = parent.get(tier_id)
+        if parent_id is None or tier_id in path:
+            return t
+        t.extend(special_child_tiers(parent_id))
+        t.extend(special_parent_tiers(parent_id))
+        t.append(parent_id)
+        t.extend(sync_parent(parent_id, path | {tier_id}))
+        return t
+
+    def sync_childs(tier_id, path=frozenset()):
+        t = []
+        if tier_id in path:
+            return t
+        for child in children[tier_id]:
+            t.extend(special_child_tiers(child))
+            t.extend(special_parent_tiers(child))
+            t.append(child)
+            t.extend(sync_childs(child, path | {tier_id}))
+        return t
+
+    def related(tier_id, related_ids):
+        return [i for i in OrderedDict.fromkeys(related_ids) if i != tier_id and i in parent]
+
+    graph = {}
+    for tier_id in parent:
+        graph[str(tier_id)] = {
+            'sync_childs': related(tier_id, sync_childs(tier_id)),
+            'sync_parent': related(tier_id, sync_parent(tier_id)),
+            'special_parent': related(tier_id, special_parent_tiers(tier_id)),
+            'special_child': related(tier_id, special_child_tiers(tier_id)),
+        }
+    return graph
@@ -17,8 +17,14 @@ urlpatterns = [
         views.ref_sound_detail, name='ref_sound_detail'),
     url(r'^annotation_action/(?P<sound_id>[0-9]+)/(?P<tier_id>[0-9]+)$',
         views.annotation_action, name='annotation-action'),
+    url(r'^peaks/(?P<sound_id>[0-9]+)/$', views.sound_peaks, name='sound_peaks'),
+    url(r'^spectrogram/(?P<sound_id>[0-9]+)/$', views.sound_spectrogram, name='sound_spectrogram'),
+    url(r'^clip/(?P<sound_id>[0-9]+)/$', views.sound_clip, name='sound_clip'),
     url(r'^download_annotations/(?P<sound_id>[0-9]+)$', views.download_annotations, name='download-annotations'),
     url(r'^(?P<exercise_id>[0-9]+)/(?P<sound_id>[0-9]+)/tier_creation/$', views.tier_creation, name='tier_creation'),
     url(r'^(?P<data_set_id>[0-9]+)/download_annotations/$', views.download_data_set_annotations,
-        name='download_annotations')
+        name='download_annotations'),
+    url(r'^(?P<data_set_id>[0-9]+)/export/$', views.data_set_export, name='data_set_export'),
+    url(r'^export_jobs/(?P<job_id>[0-9]+)/$', views.export_job_status, name='export_job_status'),
+    url(r'^export_jobs/(?P<job_id>[0-9]+)/download/$', views.export_job_download, name='export_job_download'),
 ]
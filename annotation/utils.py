@@ -1,13 +1,29 @@
 import os
 import json
+import time
 import shutil
+import tempfile
+import subprocess
+import hashlib
 import decimal
 import sndhdr
 import pydub
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from .models import Sound, Exercise, Annotation, AnnotationSimilarity, Tier, User
+from .peaks import peaks_file_path, create_peaks_file
+from .spectrogram import prerender_spectrogram
+from .clips import seek_table_path, create_seek_table
+from .ingest import read_annotations, unique_annotations, create_annotations as create_annotations_in_bulk
+
+# ioctl to create a reflink of a file in Linux
+FICLONE = 0x40049409
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -89,59 +105,169 @@ def check_if_sound_is_wav(original_file):
     return response
 
 
+def memory_limited_command(command):
+    """
+    Wrap a command so its memory is limited to TRANSCODE_MEMORY_LIMIT. The limit is set by a shell that then runs the
+    command, a preexec_fn isn't safe in the threads of the import watcher.
+    """
+    return ['/bin/sh', '-c', 'ulimit -v %d && exec "$@"' % (settings.TRANSCODE_MEMORY_LIMIT // 1024), 'sh'] + command
+
+
+def stream_mp3_copy(file_to_compress, sound_file_destination, chunk_size=1024 * 1024):
+    """
+    Transcode a wav file to mp3 with the encoder used by pydub, writing the wav file to its input in chunks. The
+    memory used doesn't depend on the length of the file, the encoder is killed if it uses more than
+    TRANSCODE_MEMORY_LIMIT. A RuntimeError with the end of the output of the encoder is raised if it fails.
+    """
+    command = [pydub.AudioSegment.converter, '-y', '-f', 'wav', '-i', 'pipe:0', '-f', 'mp3', sound_file_destination]
+    with tempfile.TemporaryFile() as errors, open(file_to_compress, 'rb') as source:
+        encoder = subprocess.Popen(memory_limited_command(command), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   stderr=errors)
+        try:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                encoder.stdin.write(chunk)
+        except BrokenPipeError:
+            # the encoder failed, the error is in its output
+            pass
+        finally:
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                pass
+            return_code = encoder.wait()
+        if return_code != 0:
+            if os.path.exists(sound_file_destination):
+                os.remove(sound_file_destination)
+            errors.seek(0)
+            message = errors.read()[-1000:].decode(errors='replace')
+            raise RuntimeError("Encoding %s failed: %s" % (file_to_compress, message))
+
+
 def create_mp3_copy(file_to_compress):
+    """
+    Transcode a wav file to an mp3 next to it. The errors are raised so the sound isn't created without its mp3, a
+    partial mp3 is removed.
+    """
     sound_file_destination = os.path.splitext(file_to_compress)[0] + '.mp3'
-    try:
-        sound = pydub.AudioSegment.from_wav(file_to_compress)
-        sound.export(sound_file_destination, format="mp3")
-    except Exception as e:
-        print(e)
+    # big files are not loaded in memory
+    if os.path.getsize(file_to_compress) > settings.STREAMING_TRANSCODE_MIN_SIZE:
+        stream_mp3_copy(file_to_compress, sound_file_destination)
+    else:
+        try:
+            sound = pydub.AudioSegment.from_wav(file_to_compress)
+            sound.export(sound_file_destination, format="mp3")
+        except Exception:
+            if os.path.exists(sound_file_destination):
+                os.remove(sound_file_destination)
+            raise
     return os.path.basename(sound_file_destination)
 
 
+def file_hash(path, chunk_size=1024 * 1024):
+    """
+    SHA-1 of the content of a file, read in chunks
+    """
+    content_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Create dst with the content of src without copying it if they are in the same file system: with a reflink
+    (copy on write clone) if the file system supports it or with a hard link. Otherwise the file is copied.
+    """
+    # dst is removed first, it could be a hard link of a previous version of the source
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev:
+        if fcntl is not None:
+            try:
+                with open(src, 'rb') as source, open(dst, 'wb') as destination:
+                    fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+                return
+            except OSError:
+                os.remove(dst)
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
 def copy_sound_into_media(src, data_set_name, exercise_name, sound_filename):
     """
     Copy files from source to destination
     """
     dst = os.path.join(settings.MEDIA_ROOT, data_set_name, exercise_name, sound_filename)
-    shutil.copyfile(src, dst)
+    link_or_copy(src, dst)
     if check_if_sound_is_wav(src):
         sound_filename = create_mp3_copy(dst)
 
     return sound_filename
 
 
+def process_sound_file(src, data_set_name, exercise_name, sound_filename, media_file=None):
+    """
+    Copy a sound into media, transcode it and compute its peaks, the coarse levels of its spectrogram and its seek
+    table, it is run in the processes of the pool of upload_data_set. If the content of the sound is the one in the
+    manifest, it isn't copied again.
+    Args:
+        src: path of the sound
+        data_set_name: name of the data set
+        exercise_name: name of the exercise
+        sound_filename: filename of the sound in media
+        media_file: optional dict with the 'content_hash' and 'filename' of the sound in the manifest
+
+    Returns:
+        dict with the 'filename' of the sound in media, the 'seconds' it took, the 'content_hash', 'size' and
+        'mtime' of the sound and if it was 'copied'
+    """
+    start = time.time()
+    stat = os.stat(src)
+    content_hash = file_hash(src)
+    copied = False
+    if media_file and media_file['content_hash'] == content_hash:
+        sound_filename = media_file['filename']
+    else:
+        sound_filename = copy_sound_into_media(src, data_set_name, exercise_name, sound_filename)
+        copied = True
+    # the waveform of the sound is drawn with its peaks
+    sound_path = os.path.join(settings.MEDIA_ROOT, data_set_name, exercise_name, sound_filename)
+    if copied or not os.path.exists(peaks_file_path(sound_path)):
+        try:
+            create_peaks_file(sound_path)
+        except Exception as e:
+            print("The peaks of %s could not be computed: %s" % (sound_filename, e))
+    # the tiles in the cache are kept, only the missing ones are rendered
+    try:
+        prerender_spectrogram(sound_path)
+    except Exception as e:
+        print("The spectrogram of %s could not be rendered: %s" % (sound_filename, e))
+    # the clips of the segments are cut with the seek table of the sound
+    if copied or not os.path.exists(seek_table_path(sound_path)):
+        try:
+            create_seek_table(sound_path)
+        except Exception as e:
+            print("The seek table of %s could not be built: %s" % (sound_filename, e))
+    return {'filename': sound_filename, 'seconds': time.time() - start, 'content_hash': content_hash,
+            'size': stat.st_size, 'mtime': stat.st_mtime, 'copied': copied}
+
+
 def create_annotations(annotations_file_path, sound, username, reference=False):
     try:
-        annotations = json.load(open(annotations_file_path))
         user = User.objects.get(username=username)
-        print("SOUND: %s" % sound.original_filename)
-        for tier_name, tier_annotations in annotations.items():
-            tier = Tier.objects.get(name=tier_name, exercise=sound.exercise)
-            print("TIER: %s" % tier_name)
-            print("num tier annotations: %s" % len(tier_annotations))
-            for annotation_data in tier_annotations:
-                if reference:
-                    try:
-                        Annotation.objects.get(name=annotation_data["label"], start_time=annotation_data["start_time"],
-                                               end_time=annotation_data["end_time"], sound=sound, tier=tier, user=user)
-                    except ObjectDoesNotExist:
-                        Annotation.objects.create(name=annotation_data["label"],
-                                                  start_time=annotation_data["start_time"],
-                                                  end_time=annotation_data["end_time"], sound=sound, tier=tier,
-                                                  user=user)
-                        print("Created annotation %s on reference sound %s" % (annotation_data["label"],
-                                                                               sound.filename))
-                else:
-                    try:
-                        # create annotation on similar sound with same reference annotation label
-                        Annotation.objects.create(name='', start_time=annotation_data["start_time"],
-                                                  end_time=annotation_data["end_time"], sound=sound,
-                                                  tier=tier, user=user)
-                        print("Created annotation on sound %s" % sound.filename)
-                    except ObjectDoesNotExist:
-                        print("There is no reference sound annotation in tier %s for file %s" %
-                              (tier_name, annotations_file_path))
-                        return 0
+        tiers = {tier.name: tier for tier in sound.exercise.tiers.all()}
+        annotations = read_annotations(annotations_file_path, sound, tiers, user, reference)
+        if reference:
+            # the annotations that already exist in the reference sound are not created again
+            annotations = unique_annotations(annotations, Annotation.objects.filter(sound=sound, user=user).
+                                             values_list('tier_id', 'start_time', 'end_time', 'name'))
+        with transaction.atomic():
+            num_created = create_annotations_in_bulk(annotations, sound.exercise)
+        print("Created %s annotations on sound %s" % (num_created, sound.filename))
     except FileNotFoundError:
         print("The file %s doesn't exist" % annotations_file_path)
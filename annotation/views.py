@@ -1,20 +1,30 @@
 import os
 import json
 import datetime
-import zipfile
-import shutil
+from decimal import Decimal, InvalidOperation
 
 from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import Http404, JsonResponse, HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import IntegrityError, OperationalError
+from django.db.models import Exists, OuterRef, Sum
+from django.utils import timezone
+from django.utils.http import http_date
 from django.core.urlresolvers import reverse
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 
-from .models import AnnotationSimilarity, Annotation, Exercise, Sound, Tier, DataSet, Tag, Complete
+from .models import Exercise, Sound, Tier, DataSet, Complete, AnnotationConflict, ExportJob, MediaJob
 from .forms import TierForm
+from .cache import get_annotations_payload, get_annotations_window, cache_reference_segments
+from .export import annotations_zip_stream
+from .ranges import ranged_file_response, ranged_response
+from .clips import MAX_CACHED_CLIP_SIZE, get_clip, get_cached_clip
+from .media import media_file_path, can_access_media, media_response, user_sounds
+from .pagination import KeysetPage
+from .peaks import get_peaks, has_peaks, peaks_file_path, read_num_samples
+from .spectrogram import NUM_LEVELS, get_spectrogram_tile, level_num_tiles, spectrogram_parameters
 
 
 @login_required
@@ -27,22 +37,18 @@ def data_set_list(request):
 @login_required
 def exercise_list(request, dataset_id):
     data_set = DataSet.objects.get(id=dataset_id)
-    exercises_list = data_set.exercises.all().order_by('-created_at')
-    # get data set statistics
-    number_of_sounds = Sound.objects.filter(exercise__in=Exercise.objects.filter(data_set=data_set)).count()
-    number_of_completed_sounds = Sound.objects.filter(exercise__in=Exercise.objects.filter(data_set=data_set)).\
-        filter(annotation_state='C').count()
-    current_date = datetime.datetime.today()
-    last_week_segments = Annotation.objects.filter(
-        created_at__range=[current_date - datetime.timedelta(days=7),
-                           current_date]).filter(sound__exercise__data_set=data_set).count()
-    last_week_similarity_annotations = AnnotationSimilarity.objects.filter(
-        created_at__range=[current_date - datetime.timedelta(days=7), current_date]).count()
+    exercises_list = list(data_set.exercises.select_related('statistics').order_by('-created_at'))
+    # get data set statistics, they are kept up to date in ExerciseStatistics and DailyStatistics
+    exercises_statistics = [e.statistics for e in exercises_list if hasattr(e, 'statistics')]
+    number_of_sounds = sum(s.number_of_sounds for s in exercises_statistics)
+    number_of_completed_sounds = sum(s.number_of_completed_sounds for s in exercises_statistics)
+    last_week = data_set.daily_statistics.filter(date__gt=timezone.localdate() - datetime.timedelta(days=7)).\
+        aggregate(segments=Sum('segments'), similarities=Sum('similarities'))
     context = {'exercises_list': exercises_list, 'data_set': data_set,
                'number_of_completed_sounds': number_of_completed_sounds,
                'number_of_sounds': number_of_sounds,
-               'last_week_segments': last_week_segments,
-               'last_week_similarity_annotations': last_week_similarity_annotations}
+               'last_week_segments': last_week['segments'] or 0,
+               'last_week_similarity_annotations': last_week['similarities'] or 0}
     return render(request, 'annotationapp/exercises_list.html', context)
 
 
@@ -113,15 +119,20 @@ def tier_edit(request, exercise_id, tier_id, sound_id):
             tier.exercise = exercise
             tier.similarity_keys = tier_form.cleaned_data['dimensions']
 
-            # if point_annotations attribute is changed, delete previous annotations
-            if ('point_annotations' in request.POST) != tier.point_annotations:
-                tier.annotations.all().delete()
-            tier.point_annotations = 'point_annotations' in request.POST
-            tier.save()
-            return redirect(reverse('tier_list', kwargs={
-                'exercise_id': exercise_id,
-                'sound_id': sound_id
-                }))
+            try:
+                tier.clean()
+            except ValidationError as e:
+                tier_form._errors['invalid_tiers'] = e.message
+            else:
+                # if point_annotations attribute is changed, delete previous annotations
+                if ('point_annotations' in request.POST) != tier.point_annotations:
+                    tier.annotations.all().delete()
+                tier.point_annotations = 'point_annotations' in request.POST
+                tier.save()
+                return redirect(reverse('tier_list', kwargs={
+                    'exercise_id': exercise_id,
+                    'sound_id': sound_id
+                    }))
     else:
         tiers_list_ids = tiers_list.values_list('id')
         tier_form = TierForm(instance=tier, parent_tier_ids=tiers_list_ids)
@@ -172,40 +183,43 @@ def sound_list(request, exercise_id):
     else:
         sounds_list = sounds_list.filter(is_discarded=False)
     context = {'display_filter': display_filter, 'exercise': exercise}
-    if exercise is Http404:
-        return render(request, exercise)
     if request.method == 'POST':
         reference_sound_id = request.POST['reference sound']
         sound = Sound.objects.get(id=reference_sound_id)
         exercise.reference_sound = sound
         exercise.save()
-    else:
-        if not exercise.reference_sound:
-            return render(request, 'annotationapp/select_reference.html', context)
-        else:
-            reference_sound = exercise.reference_sound
-            sounds_list = sounds_list.exclude(id=reference_sound.id)
-
-            completes = Complete.objects.filter(sound__in=sounds_list, user=request.user)
+    if not exercise.reference_sound:
+        context['sounds_list'] = sounds_list.order_by('id')
+        return render(request, 'annotationapp/select_reference.html', context)
+
+    reference_sound = exercise.reference_sound
+    sounds_list = sounds_list.exclude(id=reference_sound.id).annotate(
+        is_completed=Exists(Complete.objects.filter(sound=OuterRef('pk'), user=request.user)))
+    state = request.GET.get('state')
+    if state in dict(Sound.ANNOTATION_CHOICES):
+        sounds_list = sounds_list.filter(annotation_state=state)
+    completed = request.GET.get('completed')
+    if completed in ('yes', 'no'):
+        sounds_list = sounds_list.filter(is_completed=completed == 'yes')
 
-            completed_sounds = {complete.sound_id: True for complete in completes}
-            sounds_list_plus_data = [{"sound": sound, "is_completed": completed_sounds.get(sound.id, False)} for sound
-                                     in sounds_list]
-            paginator = Paginator(sounds_list_plus_data, 20)
-            page = request.GET.get('page')
-            try:
-                sounds = paginator.page(page)
-            except PageNotAnInteger:
-                # If page is not an integer, deliver first page.
-                sounds = paginator.page(1)
-            except EmptyPage:
-                # If page is out of range (e.g. 9999), deliver last page of results.
-                sounds = paginator.page(paginator.num_pages)
-            context['sounds_list'] = sounds
-            context['tier'] = exercise.tiers.all()[0]
-            context['user'] = request.user
-            if display_filter != 'discarded':
-                context['reference_sound'] = reference_sound
+    try:
+        after = int(request.GET['after']) if 'after' in request.GET else None
+        before = int(request.GET['before']) if 'before' in request.GET else None
+    except ValueError:
+        after = before = None
+    context['sounds_list'] = KeysetPage(sounds_list, after, before, per_page=20)
+    # the links to other pages keep the filters
+    query = request.GET.copy()
+    query.pop('after', None)
+    query.pop('before', None)
+    context['query'] = query.urlencode()
+    context['state'] = state
+    context['completed'] = completed
+    context['state_choices'] = Sound.ANNOTATION_CHOICES
+    context['tier'] = exercise.tiers.all()[0]
+    context['user'] = request.user
+    if display_filter != 'discarded':
+        context['reference_sound'] = reference_sound
     return render(request, 'annotationapp/sounds_list.html', context)
 
 
@@ -253,34 +267,190 @@ def annotation_action(request, sound_id, tier_id):
         body_unicode = request.body.decode('utf-8')
         post_body = json.loads(body_unicode)
 
-        sound.update_annotations(tier, post_body['annotations'], request.user)
-
-        return JsonResponse({'status': 'success'})
+        response = {'status': 'success'}
+        try:
+            if 'operations' in post_body:
+                # only the changes made since the revision loaded in the interface
+                response['revision'], response['ids'] = sound.patch_annotations(
+                    tier, post_body['operations'], request.user, post_body['revision'])
+            else:
+                sound.update_annotations(tier, post_body['annotations'], request.user, post_body.get('revision'))
+                response['revision'] = sound.get_annotation_revision(tier)
+        except AnnotationConflict as e:
+            return JsonResponse({'status': 'conflict', 'revision': e.revision}, status=409)
+        except (OperationalError, IntegrityError):
+            # a concurrent change of the related tiers, the interface reloads the annotations as on a conflict
+            return JsonResponse({'status': 'conflict', 'revision': sound.get_annotation_revision(tier)}, status=409)
+        except (KeyError, ValueError, ObjectDoesNotExist) as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+        # the reference segments are shared by all the sounds of the exercise, have them ready for the annotators
+        if sound.id == sound.exercise.reference_sound_id:
+            cache_reference_segments(sound.exercise)
+
+        return JsonResponse(response)
+    elif 'start' in request.GET or 'end' in request.GET:
+        # the segments of the sound, or of the reference sound with ?reference=1, that overlap [start, end)
+        try:
+            start = Decimal(request.GET['start'])
+            end = Decimal(request.GET['end'])
+        except (KeyError, InvalidOperation):
+            return JsonResponse({'status': 'error', 'message': 'start and end must be numbers'}, status=400)
+        if not start.is_finite() or not end.is_finite():
+            return JsonResponse({'status': 'error', 'message': 'start and end must be numbers'}, status=400)
+        if request.GET.get('reference'):
+            window = get_annotations_window(sound.exercise.reference_sound, tier, False, start, end)
+        else:
+            window = get_annotations_window(sound, tier, request.user, start, end)
+        return JsonResponse(window)
     else:
-        tags = Tag.objects.filter(tiers=tier).values_list('name', flat=True).all()
         ref_sound = sound.exercise.reference_sound
+        # with ?windows=1 the interface gets the segments of the sounds with many segments by windows of time
+        annotations = get_annotations_payload(sound, tier, request.user, bool(request.GET.get('windows')))
         out = {
             "task": {
                 "feedback": "none",
                 "visualization": "waveform",
                 "similaritySegment": ["yes", "no"],
                 "similarityKeys": tier.similarity_keys,
-                "annotationTags": list(tags),
+                "annotationTags": annotations['annotationTags'],
                 "alwaysShowTags": False
             }
         }
         if request.GET.get('enable_spec', None):
             out['task']['visualization'] = "spectrogram"
-
-        out['task']['segments_ref'] = ref_sound.get_annotations_for_tier(tier)
-        out['task']['segments'] = sound.get_annotations_for_tier(tier, request.user)
+            out['task']['spectrogram'] = dict(spectrogram_parameters(),
+                                              url=reverse('sound_spectrogram', args=[sound.id]))
+            out['task']['spectrogram_ref'] = dict(spectrogram_parameters(),
+                                                  url=reverse('sound_spectrogram', args=[ref_sound.id]))
+
+        out['task']['segments_ref'] = annotations['segments_ref']
+        out['task']['segments'] = annotations['segments']
+        out['task']['segments_window'] = annotations['segments_window']
+        out['task']['segments_window_ref'] = annotations['segments_window_ref']
+        out['task']['revision'] = annotations['revision']
         out['task']['url'] = os.path.join(settings.MEDIA_URL, sound.exercise.data_set.name, sound.exercise.name,
                                           sound.filename)
         out['task']['url_ref'] = os.path.join(settings.MEDIA_URL, sound.exercise.data_set.name, sound.exercise.name,
                                               ref_sound.filename)
+        out['task']['peaks_url'] = reverse('sound_peaks', args=[sound.id])
+        out['task']['peaks_url_ref'] = reverse('sound_peaks', args=[ref_sound.id])
+        out['task']['clip_url'] = reverse('sound_clip', args=[sound.id])
+        out['task']['clip_url_ref'] = reverse('sound_clip', args=[ref_sound.id])
         return JsonResponse(out)
 
 
+@login_required
+def sound_peaks(request, sound_id):
+    """
+    Peaks of the waveform of a sound with at least ?width= values, as little endian int16 pairs of minimum and maximum.
+    If the sound doesn't have them yet a media job computes them, and the response is 202. Only for the users of the
+    data set of the sound.
+    """
+    sound = get_object_or_404(user_sounds(request.user).select_related('exercise__data_set'), id=sound_id)
+    try:
+        width = int(request.GET.get('width', 0))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'width must be an integer'}, status=400)
+    sound_path = sound.get_media_path()
+    try:
+        result = get_peaks(sound_path, width)
+        if result is None:
+            job = MediaJob.request(sound, MediaJob.PEAKS, os.path.getmtime(sound_path))
+    except FileNotFoundError:
+        raise Http404("The sound file doesn't exist")
+    if result is None:
+        if job.status == MediaJob.FAILED:
+            raise Http404("The peaks of the sound could not be computed")
+        # the interface draws the waveform decoding the sound until run_media_jobs computes the peaks
+        return JsonResponse({'status': job.status}, status=202)
+    peaks, samples_per_peak, sample_rate = result
+    response = HttpResponse(peaks, content_type='application/octet-stream')
+    response['X-Peaks-Samples-Per-Peak'] = samples_per_peak
+    response['X-Peaks-Sample-Rate'] = sample_rate
+    return response
+
+
+@login_required
+def sound_spectrogram(request, sound_id):
+    """
+    PNG image of the tile ?index= of the zoom ?level= of the spectrogram of a sound. If the tile isn't rendered yet a
+    media job renders it, and the response is 202. Only for the users of the data set of the sound.
+    """
+    sound = get_object_or_404(user_sounds(request.user).select_related('exercise__data_set'), id=sound_id)
+    try:
+        level = int(request.GET['level'])
+        index = int(request.GET['index'])
+    except (KeyError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'level and index must be integers'}, status=400)
+    if not 0 <= level < NUM_LEVELS or index < 0:
+        return JsonResponse({'status': 'error', 'message': 'the tile does not exist'}, status=400)
+    sound_path = sound.get_media_path()
+    path = None
+    try:
+        if not has_peaks(sound_path):
+            # the tiles of the sound are known once it has its peaks, which have its length
+            job = MediaJob.request(sound, MediaJob.PEAKS, os.path.getmtime(sound_path))
+        elif index >= level_num_tiles(read_num_samples(peaks_file_path(sound_path)), level):
+            # the jobs and the tiles cache are only used for the tiles of the sound
+            return JsonResponse({'status': 'error', 'message': 'the tile does not exist'}, status=400)
+        else:
+            path = get_spectrogram_tile(sound_path, level, index)
+            if path is None:
+                job = MediaJob.request(sound, MediaJob.SPECTROGRAM_TILE, os.path.getmtime(sound_path), level, index)
+    except FileNotFoundError:
+        raise Http404("The sound file doesn't exist")
+    if path is None:
+        if job.status == MediaJob.FAILED:
+            raise Http404("The tile could not be rendered")
+        # the interface requests the tile again once run_media_jobs has had time to render it
+        return JsonResponse({'status': job.status}, status=202)
+    return ranged_file_response(request, path, 'image/png')
+
+
+@login_required
+def sound_clip(request, sound_id):
+    """
+    Audio of a sound between ?start= and ?end= seconds, cut from the sound without decoding it. The clip can start
+    before ?start=, at the time in the X-Clip-Start header. The clips of the reference sounds are kept in the clips
+    cache, they are compared with the segments of all the sounds of their exercise. Only for the users of the data set
+    of the sound.
+    """
+    sound = get_object_or_404(user_sounds(request.user).select_related('exercise__data_set'), id=sound_id)
+    try:
+        start = Decimal(request.GET['start'])
+        end = Decimal(request.GET['end'])
+    except (KeyError, InvalidOperation):
+        return JsonResponse({'status': 'error', 'message': 'start and end must be numbers'}, status=400)
+    if not start.is_finite() or not end.is_finite() or start < 0 or end <= start:
+        return JsonResponse({'status': 'error', 'message': 'the clip does not exist'}, status=400)
+    sound_path = sound.get_media_path()
+    try:
+        clip = get_clip(sound_path, float(start), float(end))
+        if sound.id == sound.exercise.reference_sound_id and clip.size <= MAX_CACHED_CLIP_SIZE:
+            response = ranged_file_response(request, get_cached_clip(clip, sound.id), clip.content_type)
+        else:
+            stat = os.stat(sound_path)
+            etag = '"%x-%x-%x-%x"' % (int(stat.st_mtime), stat.st_size, clip.offset, clip.length)
+            response = ranged_response(request, clip.size, etag, http_date(stat.st_mtime), clip.read,
+                                       clip.content_type)
+    except FileNotFoundError:
+        raise Http404("The sound file doesn't exist")
+    response['X-Clip-Start'] = '%.6f' % clip.start_time
+    return response
+
+
+@login_required
+def serve_media(request, path):
+    """
+    File of media, only for the users of its data set
+    """
+    paths = media_file_path(path)
+    if paths is None or not os.path.isfile(paths[1]) or not can_access_media(request.user, paths[0]):
+        raise Http404("The file doesn't exist")
+    return media_response(request, *paths)
+
+
 @login_required
 def download_annotations(request, sound_id):
     sound = get_object_or_404(Sound, id=sound_id)
@@ -327,38 +497,51 @@ def download_data_set_annotations(request, data_set_id):
         data_set_id: id of the dataset
 
     Returns:
-        zip file containing a .json file for each sound in the data set containing the annotations
+        zip file containing a .json file for each sound in the data set containing the annotations. It is streamed
+        while the annotations are serialised, without creating any file
     """
 
-    data_set = DataSet.objects.get(id=data_set_id)
+    data_set = get_object_or_404(DataSet, id=data_set_id)
 
-    try:
-        sounds = Sound.objects.filter(exercise__data_set=data_set)
-    except ObjectDoesNotExist:
-        return None
-
-    # make directory for intermediate json files
-    tmp_directory = os.path.join(settings.TEMP_ROOT, data_set.name + '_annotations')
-    os.mkdir(tmp_directory)
-
-    # create json files
-    for sound in sounds:
-        annotations = sound.get_annotations_as_dict()
-        annotations_file_path = os.path.join(tmp_directory, os.path.splitext(sound.filename)[0] + '.json')
-        with open(annotations_file_path, 'w') as fp:
-            json.dump(annotations, fp)
-
-    # create
-    zip_file_path = tmp_directory + '.zip'
-    zip_file = zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED)
-    for annotation_file in os.listdir(tmp_directory):
-        annotation_file_path = os.path.join(tmp_directory, annotation_file)
-        zip_file.write(annotation_file_path, os.path.basename(annotation_file_path))
-    zip_file.close()
-
-    # remove json files
-    shutil.rmtree(tmp_directory)
-
-    response = HttpResponse(open(zip_file_path, 'rb'), content_type='application/zip')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % os.path.basename(zip_file_path)
+    # iterator() uses a server side cursor, so the sounds are not loaded in memory all together
+    sounds = Sound.objects.filter(exercise__data_set=data_set).iterator()
+
+    response = StreamingHttpResponse(annotations_zip_stream(sounds), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (data_set.name + '_annotations.zip')
     return response
+
+
+@login_required
+def data_set_export(request, data_set_id):
+    """
+    Request an export of the annotations of a data set. It is done in the background by the run_export_jobs command,
+    if the data set didn't change since the last export its zip file is used.
+    Args:
+        data_set_id: id of the data set
+
+    Returns:
+        json with the status of the export job
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=405)
+    data_set = get_object_or_404(DataSet, id=data_set_id)
+    job = ExportJob.request(data_set, request.user)
+    return JsonResponse(job.get_status())
+
+
+@login_required
+def export_job_status(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id)
+    return JsonResponse(job.get_status())
+
+
+@login_required
+def export_job_download(request, job_id):
+    """
+    Download the zip file of a finished export job, Range requests are supported so the download can be resumed
+    """
+    job = get_object_or_404(ExportJob, id=job_id, status=ExportJob.DONE)
+    if not os.path.isfile(job.file_path):
+        raise Http404("The export of this job was replaced by a newer one")
+    return ranged_file_response(request, job.file_path, 'application/zip',
+                                job.data_set.name + '_annotations.zip')
@@ -0,0 +1,139 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify events
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def top_directory(root, path):
+    """
+    Name of the directory of root that contains path, or None if path is root
+    """
+    relative_path = os.path.relpath(path, root)
+    if relative_path == os.curdir:
+        return None
+    return relative_path.split(os.sep)[0]
+
+
+class PollingWatcher(object):
+    """
+    Detect the changes in the directories of a root directory comparing the size and modification time of their files
+    every interval seconds
+    """
+    def __init__(self, root, interval=5):
+        self.root = root
+        self.interval = interval
+        self.state = {}
+
+    def snapshot(self):
+        state = {}
+        for directory in os.listdir(self.root):
+            directory_path = os.path.join(self.root, directory)
+            if not os.path.isdir(directory_path):
+                continue
+            files = {}
+            for path, _, filenames in os.walk(directory_path):
+                for filename in filenames:
+                    try:
+                        stat = os.stat(os.path.join(path, filename))
+                    except OSError:
+                        continue
+                    files[os.path.join(path, filename)] = (stat.st_size, stat.st_mtime)
+            state[directory] = files
+        return state
+
+    def changes(self, timeout):
+        """
+        Wait up to timeout seconds for changes
+        Returns:
+            set of names of the directories of root that changed
+        """
+        time.sleep(min(self.interval, timeout))
+        state = self.snapshot()
+        changed = {d for d in set(state) | set(self.state) if state.get(d) != self.state.get(d) and d in state}
+        self.state = state
+        return changed
+
+
+class InotifyWatcher(object):
+    """
+    Detect the changes in the directories of a root directory with inotify, watching all their subdirectories
+    Raises:
+        OSError if inotify is not available
+    """
+    def __init__(self, root):
+        self.root = root
+        library = ctypes.util.find_library('c')
+        if library is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.watches = {}
+        self.add_watches(root)
+
+    def add_watches(self, directory):
+        for path, _, _ in os.walk(directory):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = path
+
+    def changes(self, timeout):
+        """
+        Wait up to timeout seconds for changes
+        Returns:
+            set of names of the directories of root that changed
+        """
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # some events were lost, everything could have changed
+                return {d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d))}
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_watches(path)
+            directory = top_directory(self.root, path)
+            if directory is not None:
+                changed.add(directory)
+        return changed
+
+
+def get_watcher(root, interval=5):
+    """
+    Get an inotify watcher for root, or a polling watcher if inotify is not available
+    """
+    try:
+        return InotifyWatcher(root)
+    except OSError as e:
+        print("Using polling to watch %s: %s" % (root, e))
+        return PollingWatcher(root, interval)
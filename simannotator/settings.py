@@ -146,6 +146,52 @@ STATIC_ROOT = "/static"
 EXPORT_PATH = "/export"
 IMPORT_PATH = "/import"
 
+# wav files bigger than this are transcoded to mp3 without loading them in memory, the encoder can't use more memory
+# than TRANSCODE_MEMORY_LIMIT
+STREAMING_TRANSCODE_MIN_SIZE = 100 * 1024 * 1024
+TRANSCODE_MEMORY_LIMIT = 512 * 1024 * 1024
+
+# the annotations sent to the annotation interface are cached in ANNOTATIONS_CACHE, it should be shared by all the
+# processes that change annotations (web workers and management commands)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'annotations': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(TEMP_ROOT, 'annotations_cache'),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+ANNOTATIONS_CACHE = 'annotations'
+
+# the annotation interface gets the segments of the sounds with more than SEGMENTS_WINDOW_THRESHOLD segments in a tier
+# by windows of SEGMENTS_WINDOW seconds around the view and the playhead, instead of all of them with the task
+SEGMENTS_WINDOW_THRESHOLD = 2000
+SEGMENTS_WINDOW = 120
+
+# zip files created by the export jobs (run_export_jobs command)
+EXPORT_JOBS_ROOT = os.path.join(TEMP_ROOT, 'export_jobs')
+
+# tiles of the spectrograms of the sounds, the least recently used are removed when they take more than
+# SPECTROGRAM_CACHE_SIZE bytes
+SPECTROGRAM_CACHE_ROOT = os.path.join(TEMP_ROOT, 'spectrograms')
+SPECTROGRAM_CACHE_SIZE = 1024 * 1024 * 1024
+
+# clips of the reference sounds played to compare them with the segments, the least recently used are removed when
+# they take more than CLIPS_CACHE_SIZE bytes
+CLIPS_CACHE_ROOT = os.path.join(TEMP_ROOT, 'clips')
+CLIPS_CACHE_SIZE = 256 * 1024 * 1024
+
+# the files of media are sent by the front server after the permissions are checked: 'x-accel-redirect' for nginx,
+# with an internal location at MEDIA_ACCEL_REDIRECT_PREFIX that has MEDIA_ROOT as its alias, 'x-sendfile' for Apache's
+# mod_xsendfile or 'uwsgi' for the offload threads of uwsgi (uwsgi.ini). Without it they are sent by Django.
+MEDIA_OFFLOAD = os.environ.get('SIM_MEDIA_OFFLOAD')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected_media/'
+
 # in case some development settings are used
 if os.path.isfile(os.path.join(os.getcwd(), 'simannotator/development_settings.py')):
     from .development_settings import *
@@ -104,11 +104,21 @@ StageThreeView.prototype = {
 
         time.show();
 
+        // Play the segment and then its reference segment, shown when the segment has one
+        var compare = $('<button>', {
+            class: 'btn compare_btn',
+            text: 'Compare with reference',
+        });
+        compare.click(function () {
+            $(my).trigger('compare');
+        });
+        compare.hide();
+
         var tagContainer = $('<div>', {
             class: 'tag_container',
         });
         
-        this.dom = container.append([message, time, tagContainer]);
+        this.dom = container.append([message, time, compare, tagContainer]);
     },
 
     // Replace the annotation elements with the new elements that contain the
@@ -234,6 +244,12 @@ StageThreeView.prototype = {
     update: function(region) {
         this.updateTime(region);
         this.updateSelectedTags(region);
+        this.updateCompare(region);
+    },
+
+    // Show the button to compare the region with its reference region if it has one
+    updateCompare: function(region) {
+        $('.compare_btn', this.dom).toggle(region.regionRef != null);
     },
 
     // Update the start, end and duration elements to match the start, end and duration
@@ -289,7 +305,7 @@ StageThreeView.prototype = {
  * Purpose:
  *   Control the workflow of annotating regions.
  * Dependencies:
- *   jQuey, urban-ears.css, Wavesurfer (lib/wavesurfer.js), Message (src/message.js)
+ *   jQuey, urban-ears.css, Wavesurfer (lib/wavesurfer.js), Message (src/message.js), ClipPlayer (src/clip_player.js)
  */
 function AnnotationStages(wavesurfer, wavesurferRef, editEnable) {
     this.currentStage = 0;
@@ -305,6 +321,10 @@ function AnnotationStages(wavesurfer, wavesurferRef, editEnable) {
     this.events = [];
     this.alwaysShowTags = false;
     this.editEnable = editEnable;
+    // The clips of the regions and their reference regions are played to compare them
+    this.clipPlayer = new ClipPlayer();
+    this.clipUrl = null;
+    this.clipUrlRef = null;
 
     // These are not reset, since they should only be shown for the first clip
     this.shownTagHint = false;
@@ -339,6 +359,10 @@ AnnotationStages.prototype = {
         if (region.regionRef != null) {
             regionData.reference = region.regionRef.id;
             regionData.similValue = region.similValue;
+        } else if (region.referenceId != null) {
+            // the reference segment is in a window that isn't loaded yet (SegmentWindows)
+            regionData.reference = region.referenceId;
+            regionData.similValue = region.similValue;
         }
         return regionData;
     },
@@ -370,7 +394,7 @@ AnnotationStages.prototype = {
         if (this.wavesurfer.regions) {
             for (var region_id in this.wavesurfer.regions.list) {
                 var region = this.wavesurfer.regions.list[region_id];
-                if (region.similarity == 'yes' && (region.regionRef == null)) {
+                if (region.similarity == 'yes' && region.regionRef == null && region.referenceId == null) {
                   Message.notifyAlert('Make shure to select a similarity section'); 
                   return false;
                 }else if (region.similarity == 'yes'){
@@ -384,6 +408,21 @@ AnnotationStages.prototype = {
         return true;
     },
 
+    // Remove the highlight of the reference regions and their labels, in view or not
+    removeReferenceHighlight: function() {
+        [this.wavesurfer, this.wavesurferRef].forEach(function(wavesurfer) {
+            if (wavesurfer && wavesurfer.regions) {
+                for (var region_id in wavesurfer.regions.list) {
+                    var region = wavesurfer.regions.list[region_id];
+                    region.removeClass('current_region_ref');
+                    if (region.annotationLabel) {
+                        region.annotationLabel.removeClass('current_label_ref');
+                    }
+                }
+            }
+        });
+    },
+
     // Switch the currently selected region
     swapRegion: function(newStage, region) {
         // Disable drag and resize editing for the old current region. 
@@ -391,16 +430,16 @@ AnnotationStages.prototype = {
         if (this.currentRegion) {
             this.currentRegion.update({drag: false, resize: false});
             if (this.wavesurferRef) {
-              $(this.currentRegion.element).removeClass('current_region');
-              $(this.currentRegion.annotationLabel.element).removeClass('current_label');
+              this.currentRegion.removeClass('current_region');
+              this.currentRegion.annotationLabel.removeClass('current_label');
             }else{
-              $(this.currentRegion.element).removeClass('current_region_ref');
-              $(this.currentRegion.annotationLabel.element).removeClass('current_label_ref');
+              this.currentRegion.removeClass('current_region_ref');
+              this.currentRegion.annotationLabel.removeClass('current_label_ref');
             }
         }
         if (this.currentRegion && this.currentRegion.regionRef != null) {
-            $(this.currentRegion.regionRef.element).removeClass('current_region_ref');
-            $(this.currentRegion.regionRef.annotationLabel.element).removeClass('current_label_ref');
+            this.currentRegion.regionRef.removeClass('current_region_ref');
+            this.currentRegion.regionRef.annotationLabel.removeClass('current_label_ref');
         } 
         
         // If the user is switch to stage 3, enable drag and resize editing for the new current region. 
@@ -410,14 +449,13 @@ AnnotationStages.prototype = {
                 region.update({drag: false, resize: false});
             } else if (newStage === 3) {
                 region.update({drag: true, resize: true});
-                $('.current_region_ref').removeClass('current_region_ref');
-                $('.current_label_ref').removeClass('current_label_ref');
+                this.removeReferenceHighlight();
                 if (this.wavesurferRef) {
-                  $(region.element).addClass('current_region');
-                  $(region.annotationLabel.element).addClass('current_label');
+                  region.addClass('current_region');
+                  region.annotationLabel.addClass('current_label');
                 }else{
-                  $(region.element).addClass('current_region_ref');
-                  $(region.annotationLabel.element).addClass('current_label_ref');
+                  region.addClass('current_region_ref');
+                  region.annotationLabel.addClass('current_label_ref');
                 }
             }
            
@@ -492,6 +530,7 @@ AnnotationStages.prototype = {
 
     // Reset the field values (except for hint related fields)
     clear: function() {
+        this.clipPlayer.stop();
         this.currentStage = 0;
         this.currentRegion = null;
         this.wavesurfer.clearRegions();
@@ -543,11 +582,11 @@ AnnotationStages.prototype = {
             this.trackEvent('select-for-edit', region.id);
             this.updateStage(3, region);
             if (region.regionRef != null) {
-              $('.current_region_ref').removeClass('current_region_ref');
-              $('.current_label_ref').removeClass('current_label_ref');
-              
-              $(region.regionRef.element).addClass('current_region_ref');
-              $(region.regionRef.annotationLabel.element).addClass('current_label_ref');
+              this.removeReferenceHighlight();
+
+              region.regionRef.addClass('current_region_ref');
+              region.regionRef.annotationLabel.addClass('current_label_ref');
+              this.prefetchComparison(region);
             }
         } else {
             this.trackEvent('deselect', region.id);
@@ -559,6 +598,46 @@ AnnotationStages.prototype = {
         if (this.currentRegion != null && this.currentRegion.similarity == 'yes') {
           region.update({color: this.currentRegion.color});
           this.currentRegion.regionRef = region;
+          this.stageThreeView.updateCompare(this.currentRegion);
+          this.prefetchComparison(this.currentRegion);
+        }
+    },
+
+    // Set the urls of the clips of the sound and of the reference sound (sound_clip view)
+    setClipUrls: function(clipUrl, clipUrlRef) {
+        this.clipUrl = clipUrl;
+        this.clipUrlRef = clipUrlRef;
+    },
+
+    // The segment of a region and of its reference region, or null if it doesn't have one
+    comparedSegments: function(region) {
+        if (!region || region.regionRef == null || !this.clipUrl || !this.clipUrlRef) {
+            return null;
+        }
+        return [
+            {url: this.clipUrl, start: region.start, end: region.end},
+            {url: this.clipUrlRef, start: region.regionRef.start, end: region.regionRef.end}
+        ];
+    },
+
+    // Download the clips of a region and its reference region, so the comparison starts right away
+    prefetchComparison: function(region) {
+        var segments = this.comparedSegments(region);
+        if (segments) {
+            this.clipPlayer.prefetch(segments);
+        }
+    },
+
+    // Event handler: play the current region and then its reference region
+    compareWithReference: function() {
+        var segments = this.comparedSegments(this.currentRegion);
+        if (segments) {
+            this.trackEvent('compare-region', this.currentRegion.id);
+            this.wavesurfer.pause();
+            if (this.wavesurferRef) {
+                this.wavesurferRef.pause();
+            }
+            this.clipPlayer.play(segments);
         }
     },
 
@@ -771,5 +850,6 @@ AnnotationStages.prototype = {
     // Attach event handlers for stage three events
     addStageThreeEvents: function() {
         $(this.stageThreeView).on('change-tag', this.updateRegion.bind(this));
+        $(this.stageThreeView).on('compare', this.compareWithReference.bind(this));
     },   
 };
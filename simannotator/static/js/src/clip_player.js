@@ -0,0 +1,157 @@
+'use strict';
+
+/*
+ * Purpose:
+ *   Play parts of sounds cut in the backend (the sound_clip view) one after the other, to compare a segment with
+ *   its reference segment without the whole sounds. The clips are downloaded when they are prefetched, so the
+ *   comparison starts right away. A clip can start before the requested time, at the time of its X-Clip-Start
+ *   header.
+ * Dependencies:
+ *   None
+ */
+function ClipPlayer() {
+    this.audio = new Audio();
+    // downloaded clips by url, with the object url of their audio and their start time
+    this.clips = {};
+    // urls of the clips from the oldest
+    this.urls = [];
+    this.playId = 0;
+    this.timer = null;
+    this.pendingStart = null;
+}
+
+ClipPlayer.prototype = {
+    // The oldest clips are released when there are more
+    MAX_CLIPS: 20,
+
+    clipUrl: function(url, start, end) {
+        return url + '?start=' + start.toFixed(3) + '&end=' + end.toFixed(3);
+    },
+
+    // Download a clip, callback is called with the clip, or null if it couldn't be downloaded
+    fetch: function(url, callback) {
+        var my = this;
+        var clip = this.clips[url];
+        if (clip) {
+            if (clip.callbacks) {
+                clip.callbacks.push(callback);
+            } else {
+                callback(clip);
+            }
+            return;
+        }
+        clip = this.clips[url] = {src: null, start: 0, callbacks: [callback]};
+        this.urls.push(url);
+        if (this.urls.length > this.MAX_CLIPS) {
+            this.release(this.urls.shift());
+        }
+
+        var request = new XMLHttpRequest();
+        request.open('GET', url);
+        request.responseType = 'blob';
+        var done = function(success) {
+            var callbacks = clip.callbacks;
+            clip.callbacks = null;
+            if (success) {
+                clip.src = URL.createObjectURL(request.response);
+                clip.start = Number(request.getResponseHeader('X-Clip-Start')) || 0;
+            }
+            if (!success || my.clips[url] !== clip) {
+                // requested again the next time
+                my.release(url, clip);
+            }
+            callbacks.forEach(function(callback) {
+                callback(success ? clip : null);
+            });
+        };
+        request.onload = function() {
+            done(request.status == 200);
+        };
+        request.onerror = function() {
+            done(false);
+        };
+        request.send();
+    },
+
+    release: function(url, clip) {
+        clip = clip || this.clips[url];
+        if (this.clips[url] === clip) {
+            delete this.clips[url];
+            var index = this.urls.indexOf(url);
+            if (index >= 0) {
+                this.urls.splice(index, 1);
+            }
+        }
+        // a clip still downloading is released when it is done
+        if (clip && clip.src && !clip.callbacks) {
+            URL.revokeObjectURL(clip.src);
+            clip.src = null;
+        }
+    },
+
+    // Download the clips of the segments, a list of {url, start, end}
+    prefetch: function(segments) {
+        var my = this;
+        segments.forEach(function(segment) {
+            my.fetch(my.clipUrl(segment.url, segment.start, segment.end), function() {});
+        });
+    },
+
+    // Play the segments, a list of {url, start, end}, one after the other
+    play: function(segments) {
+        var my = this;
+        this.stop();
+        var id = this.playId;
+        var next = function(index) {
+            if (index >= segments.length || id !== my.playId) {
+                return;
+            }
+            var segment = segments[index];
+            my.fetch(my.clipUrl(segment.url, segment.start, segment.end), function(clip) {
+                if (clip && clip.src && id === my.playId) {
+                    my.playClip(clip, segment.start - clip.start, segment.end - segment.start, function() {
+                        next(index + 1);
+                    });
+                }
+            });
+        };
+        next(0);
+    },
+
+    // Play duration seconds of a clip from offset
+    playClip: function(clip, offset, duration, callback) {
+        var my = this;
+        var audio = this.audio;
+        var start = function() {
+            audio.removeEventListener('loadedmetadata', start);
+            my.pendingStart = null;
+            audio.currentTime = Math.max(offset, 0);
+            audio.play();
+            my.timer = setTimeout(function() {
+                my.timer = null;
+                audio.pause();
+                callback();
+            }, duration * 1000);
+        };
+        if (audio.src === clip.src && audio.readyState >= 1) {
+            start();
+        } else {
+            this.pendingStart = start;
+            audio.addEventListener('loadedmetadata', start);
+            audio.src = clip.src;
+        }
+    },
+
+    stop: function() {
+        this.playId++;
+        if (this.pendingStart) {
+            this.audio.removeEventListener('loadedmetadata', this.pendingStart);
+            this.pendingStart = null;
+        }
+        if (this.timer) {
+            clearTimeout(this.timer);
+            this.timer = null;
+        }
+        this.audio.pause();
+    }
+};
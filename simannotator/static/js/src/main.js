@@ -6,8 +6,9 @@
  *   data, updates components. When the user submits their work this class gets the workers
  *   annotations and other data and submits to the backend
  * Dependencies:
- *   AnnotationStages (src/annotation_stages.js), PlayBar & WorkflowBtns (src/components.js), 
- *   HiddenImg (src/hidden_image.js), colormap (colormap/colormap.min.js) , Wavesurfer (lib/wavesurfer.min.js)
+ *   AnnotationStages (src/annotation_stages.js), Peaks (src/peaks.js), PlayBar & WorkflowBtns (src/components.js), 
+ *   SegmentWindows (src/segment_windows.js), HiddenImg (src/hidden_image.js), colormap (colormap/colormap.min.js) ,
+ *   Wavesurfer (lib/wavesurfer.min.js)
  * Globals variable from other files:
  *   colormap.min.js:
  *       magma // color scheme array that maps 0 - 255 to rgb values
@@ -32,6 +33,13 @@ function UrbanEars() {
     this.currentMoveSection = null;
     // Boolean, true if currently sending http post request 
     this.sendingResponse = false;
+    // Revision of the annotations loaded from the backend and the annotations as they were saved,
+    // only the changes made since then are sent when submitting
+    this.revision = 0;
+    this.savedSegments = {};
+    // Segments loaded before the segment of the reference sound they are similar to, by id of the reference segment
+    this.pendingReferences = {};
+    this.notifiedRevision = false;
 
     // Create color map for spectrogram
     var spectrogramColorMap = colormap({
@@ -51,7 +59,9 @@ function UrbanEars() {
         // For the spectrogram the height is half the number of fftSamples
         fftSamples: height * 2,
         height: height,
-        colorMap: spectrogramColorMap
+        colorMap: spectrogramColorMap,
+        // The audio is streamed by a media element, the waveform is drawn with the peaks of the backend
+        backend: 'MediaElement'
     });
 
     this.wavesurferRef = Object.create(WaveSurfer);
@@ -62,7 +72,9 @@ function UrbanEars() {
         // For the spectrogram the height is half the number of fftSamples
         fftSamples: height * 2,
         height: height,
-        colorMap: spectrogramColorMap
+        colorMap: spectrogramColorMap,
+        // The audio is streamed by a media element, the waveform is drawn with the peaks of the backend
+        backend: 'MediaElement'
     });
     var labelsRef = Object.create(WaveSurfer.Labels);
     labelsRef.init({
@@ -71,8 +83,8 @@ function UrbanEars() {
     });
     
     // Create labels (labels that appear above each region)
-    var labels = Object.create(WaveSurfer.Labels);
-    labels.init({
+    this.labels = Object.create(WaveSurfer.Labels);
+    this.labels.init({
         wavesurfer: this.wavesurfer,
         container: '.labels'
     });
@@ -290,22 +302,54 @@ UrbanEars.prototype = {
           my.stagesRef.updateStage(1);
           
           my.currentTask.segments_ref.forEach(function(section){
-          
-            var region = my.wavesurferRef.addRegion({
-              start: section.start,
-              end: section.end,
-              id: section.id,
-              drag: false,
-              resize: false,
-              canDelete: false,
-              annotation: section.annotation,
-            });
+            var region = my.addReferenceSegment(section);
             my.stagesRef.createRegionSwitchToStageThree(region);
-          
           });
           my.playBar.update();
           my.currentTask.segments.forEach(function(section){
-          var values = {
+            var region = my.addSegment(section);
+            my.stages.createRegionSwitchToStageThree(region);
+          });
+        my.stages.updateStage(1);
+        my.revision = my.currentTask.revision;
+        my.updateSavedSegments();
+        my.updateTaskTime();
+        my.workflowBtns.update();
+
+        // The segments of the sounds with many segments are loaded by windows around the view and the playhead
+        if (my.currentTask.segments_window_ref) {
+            new SegmentWindows(my.wavesurferRef, dataUrl, my.currentTask.segments_window_ref, true,
+                               my.addReferenceSegment.bind(my)).bind();
+        }
+        if (my.currentTask.segments_window) {
+            new SegmentWindows(my.wavesurfer, dataUrl, my.currentTask.segments_window, false,
+                               my.addWindowSegment.bind(my)).bind();
+        }
+      }
+    },
+
+    addReferenceSegment: function(section) {
+        var region = this.wavesurferRef.addRegion({
+            start: section.start,
+            end: section.end,
+            id: section.id,
+            drag: false,
+            resize: false,
+            canDelete: false,
+            annotation: section.annotation,
+        });
+        // the segments loaded before their reference segment
+        (this.pendingReferences[section.id] || []).forEach(function(other) {
+            if (other.regionRef == null) {
+                other.regionRef = region;
+            }
+        });
+        delete this.pendingReferences[section.id];
+        return region;
+    },
+
+    addSegment: function(section) {
+        var region = this.wavesurfer.addRegion({
             start: section.start,
             end: section.end,
             id: section.id,
@@ -314,17 +358,110 @@ UrbanEars.prototype = {
             similValue: section.similValue,
             similarity: section.similarity,
             manyValues: section.manyValues
-          }; 
-          var region = my.wavesurfer.addRegion(values);
-          if (section.reference != null){
-            region.regionRef = my.wavesurferRef.regions.list[section.reference];
-          }
-          my.stages.createRegionSwitchToStageThree(region);
         });
-        my.stages.updateStage(1);
-        my.updateTaskTime();
-        my.workflowBtns.update();
-      }
+        if (section.reference != null) {
+            region.referenceId = section.reference;
+            var regions = this.wavesurferRef.regions;
+            region.regionRef = regions ? regions.list[section.reference] : null;
+            if (region.regionRef == null) {
+                // the window of the reference segment isn't loaded yet
+                this.pendingReferences[section.reference] = this.pendingReferences[section.reference] || [];
+                this.pendingReferences[section.reference].push(region);
+            }
+        }
+        return region;
+    },
+
+    // Add a segment loaded by SegmentWindows, it isn't edited until it is selected like the segments of the task
+    addWindowSegment: function(section, revision) {
+        if (this.wavesurfer.regions && this.wavesurfer.regions.list[section.id] != null) {
+            return;
+        }
+        if (revision != this.revision && !this.notifiedRevision) {
+            this.notifiedRevision = true;
+            Message.notifyAlert('These annotations were modified by someone else, reload the page to get them.');
+        }
+        var region = this.addSegment(section);
+        region.drag = false;
+        region.resize = false;
+        this.savedSegments[region.id] = this.stages.getAnnotationData(region);
+    },
+
+    // Keep a copy of the annotations as they are saved in the backend
+    updateSavedSegments: function() {
+        var my = this;
+        this.savedSegments = {};
+        this.stages.getAnnotations().forEach(function(segment) {
+            my.savedSegments[segment.id] = segment;
+        });
+    },
+
+    // Compare the annotations with the saved ones and return the operations to send to the backend
+    getOperations: function() {
+        var my = this;
+        var operations = [];
+        var current = {};
+        this.stages.getAnnotations().forEach(function(segment) {
+            current[segment.id] = segment;
+            var saved = my.savedSegments[segment.id];
+            if (saved == null) {
+                operations.push({
+                    op: 'add',
+                    id: segment.id,
+                    start: segment.start,
+                    end: segment.end,
+                    annotation: segment.annotation
+                });
+            } else {
+                if (saved.start != segment.start || saved.end != segment.end) {
+                    operations.push({op: 'move', id: segment.id, start: segment.start, end: segment.end});
+                }
+                if (saved.annotation != segment.annotation) {
+                    operations.push({op: 'rename', id: segment.id, annotation: segment.annotation});
+                }
+            }
+            if (saved == null || saved.similarity != segment.similarity || saved.reference != segment.reference ||
+                    JSON.stringify(saved.similValue) != JSON.stringify(segment.similValue)) {
+                if (segment.similarity == 'yes') {
+                    operations.push({
+                        op: 'set_similarity',
+                        id: segment.id,
+                        reference: segment.reference,
+                        similValue: segment.similValue
+                    });
+                } else if (saved != null) {
+                    operations.push({op: 'clear_similarity', id: segment.id});
+                }
+            }
+        });
+        for (var id in this.savedSegments) {
+            if (!(id in current)) {
+                operations.push({op: 'delete', id: this.savedSegments[id].id});
+            }
+        }
+        return operations;
+    },
+
+    // Give the regions created in the interface the ids of the annotations created in the backend
+    renameRegions: function(ids) {
+        for (var oldId in ids) {
+            var newId = ids[oldId];
+            var region = this.wavesurfer.regions.list[oldId];
+            if (region == null) {
+                continue;
+            }
+            delete this.wavesurfer.regions.list[oldId];
+            region.id = newId;
+            // only the regions in view have an element, the other ones get the id when they are drawn
+            if (region.element) {
+                region.element.setAttribute('data-id', newId);
+            }
+            this.wavesurfer.regions.list[newId] = region;
+            if (this.labels.labels[oldId] != null) {
+                this.labels.labels[newId] = this.labels.labels[oldId];
+                delete this.labels.labels[oldId];
+            }
+        }
     },
 
     updateTaskTime: function() {
@@ -360,6 +497,7 @@ UrbanEars.prototype = {
                 annotationTags,
                 alwaysShowTags
             );
+            my.stages.setClipUrls(my.currentTask.clip_url, my.currentTask.clip_url_ref);
 
             // Update clip & time tracker of Header
             $('#recording-index').html(recordingIndex);
@@ -368,10 +506,12 @@ UrbanEars.prototype = {
             // Update the visualization type and the feedback type and load in the new audio clip
             my.wavesurfer.params.visualization = my.currentTask.visualization; // invisible, spectrogram, waveform
             my.wavesurfer.params.feedback = my.currentTask.feedback; // hiddenImage, silent, notify, none 
-            my.wavesurfer.load(my.currentTask.url);
+            my.wavesurfer.params.spectrogramTiles = my.currentTask.spectrogram;
+            Peaks.load(my.wavesurfer, my.currentTask.url, my.currentTask.peaks_url);
             my.wavesurferRef.params.visualization = my.currentTask.visualization; // invisible, spectrogram, waveform
             my.wavesurferRef.params.feedback = my.currentTask.feedback; // hiddenImage, silent, notify, none 
-            my.wavesurferRef.load(my.currentTask.url_ref);
+            my.wavesurferRef.params.spectrogramTiles = my.currentTask.spectrogram_ref;
+            Peaks.load(my.wavesurferRef, my.currentTask.url_ref, my.currentTask.peaks_url_ref);
         };
 
         // Just update task specific data right away
@@ -381,7 +521,8 @@ UrbanEars.prototype = {
     // Update the interface with the next task's data
     loadNextTask: function() {
         var my = this;
-        $.getJSON(dataUrl)
+        // the segments of the sounds with many segments are loaded by windows (SegmentWindows)
+        $.getJSON(dataUrl, {windows: 1})
         .done(function(data) {
             my.currentTask = data.task;
             my.update();
@@ -397,9 +538,10 @@ UrbanEars.prototype = {
                 return;
             }
             this.sendingResponse = true;
-            // Get data about the annotations the user has created
+            // Get the changes the user has made since the last save
             var content = {
-                annotations: this.stages.getAnnotations(),
+                operations: this.getOperations(),
+                revision: this.revision
             };
 
             this.post(content);
@@ -419,14 +561,23 @@ UrbanEars.prototype = {
             contentType: "application/json; charset=utf-8",
         })
         .done(function(data) {
+            if (data.status == "success") {
+                my.revision = data.revision;
+                my.renameRegions(data.ids);
+                my.updateSavedSegments();
+            }
             if (data.status == "success" && nextUrl != 'None') {
               window.location = nextUrl;
             }else if(data.status == "success"){
                 Message.notifyAlert('Successfully saved all the changes, that was the last Tier.'); 
             }
         })
-        .fail(function() {
-            alert('Error: Unable to Submit Annotations');
+        .fail(function(xhr) {
+            if (xhr.status == 409) {
+                Message.notifyAlert('These annotations were modified by someone else, reload the page to get them.');
+            } else {
+                alert('Error: Unable to Submit Annotations');
+            }
         })
         .always(function() {
             // No longer sending response
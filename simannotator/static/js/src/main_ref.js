@@ -6,7 +6,7 @@
  *   data, updates components. When the user submits their work this class gets the workers
  *   annotations and other data and submits to the backend
  * Dependencies:
- *   AnnotationStages (src/annotation_stages.js), PlayBar & WorkflowBtns (src/components.js), 
+ *   AnnotationStages (src/annotation_stages.js), Peaks (src/peaks.js), PlayBar & WorkflowBtns (src/components.js), 
  *   HiddenImg (src/hidden_image.js), colormap (colormap/colormap.min.js) , Wavesurfer (lib/wavesurfer.min.js)
  * Globals variable from other files:
  *   colormap.min.js:
@@ -44,7 +44,9 @@ function UrbanEars() {
         // For the spectrogram the height is half the number of fftSamples
         fftSamples: height * 2,
         height: height,
-        colorMap: spectrogramColorMap
+        colorMap: spectrogramColorMap,
+        // The audio is streamed by a media element, the waveform is drawn with the peaks of the backend
+        backend: 'MediaElement'
     });
 
     // Create labels (labels that appear above each region)
@@ -220,7 +222,8 @@ UrbanEars.prototype = {
 
             // Update the visualization type and the feedback type and load in the new audio clip
             my.wavesurfer.params.visualization = my.currentTask.visualization; // invisible, spectrogram, waveform
-            my.wavesurfer.load(my.currentTask.url);
+            my.wavesurfer.params.spectrogramTiles = my.currentTask.spectrogram;
+            Peaks.load(my.wavesurfer, my.currentTask.url, my.currentTask.peaks_url);
         };
 
         // Just update task specific data right away
@@ -0,0 +1,72 @@
+'use strict';
+
+/*
+ * Purpose:
+ *   Draw the waveform of a sound with the peaks computed in the backend, so the sound doesn't have to be
+ *   downloaded and decoded before the waveform appears. The audio is played by a media element while it is
+ *   downloaded. When the waveform is zoomed, peaks with more detail are requested.
+ * Dependencies:
+ *   Wavesurfer (lib/wavesurfer.min.js) created with the MediaElement backend
+ */
+var Peaks = {
+    // Get the peaks of a sound with at least width values. The backend sends pairs of minimum and maximum,
+    // wavesurfer draws pairs of maximum and minimum between -1 and 1
+    fetch: function(peaksUrl, width, callback) {
+        var request = new XMLHttpRequest();
+        request.open('GET', peaksUrl + '?width=' + Math.ceil(width));
+        request.responseType = 'arraybuffer';
+        request.onload = function() {
+            if (request.status != 200) {
+                callback(null);
+                return;
+            }
+            var values = new Int16Array(request.response);
+            var peaks = new Float32Array(values.length);
+            for (var i = 0; i < values.length; i += 2) {
+                peaks[i] = values[i + 1] / 32768;
+                peaks[i + 1] = values[i] / 32768;
+            }
+            callback(peaks);
+        };
+        request.onerror = function() {
+            callback(null);
+        };
+        request.send();
+    },
+
+    // Load a sound in a wavesurfer with its peaks. If they are not available, or the spectrogram is drawn
+    // without the tiles of the backend, the sound is decoded in the browser.
+    load: function(wavesurfer, url, peaksUrl) {
+        if (!peaksUrl || (wavesurfer.params.visualization === 'spectrogram' && !wavesurfer.params.spectrogramTiles)) {
+            wavesurfer.load(url);
+            return;
+        }
+        var state = {width: 0, complete: false};
+        Peaks.fetch(peaksUrl, wavesurfer.drawer.getWidth(), function(peaks) {
+            if (peaks == null) {
+                wavesurfer.load(url);
+                return;
+            }
+            state.width = peaks.length / 2;
+            wavesurfer.load(url, peaks);
+        });
+
+        wavesurfer.on('zoom', function(pxPerSec) {
+            var width = wavesurfer.getDuration() * pxPerSec * wavesurfer.params.pixelRatio;
+            if (!pxPerSec || state.complete || wavesurfer.backend.buffer || width <= state.width) {
+                return;
+            }
+            Peaks.fetch(peaksUrl, width, function(peaks) {
+                if (peaks == null) {
+                    return;
+                }
+                // when there are fewer peaks than requested they are the most detailed ones
+                state.complete = peaks.length / 2 < width;
+                state.width = peaks.length / 2;
+                wavesurfer.backend.peaks = peaks;
+                wavesurfer.drawBuffer();
+                wavesurfer.seekAndCenter(wavesurfer.getCurrentTime() / wavesurfer.getDuration());
+            });
+        });
+    }
+};
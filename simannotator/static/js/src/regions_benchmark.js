@@ -0,0 +1,208 @@
+'use strict';
+
+/*
+ * Purpose:
+ *   Benchmark of the regions and their labels with thousands of segments (static/benchmark/regions.html). The
+ *   regions are added over a silent sound and the page reports the time to add and draw them, and the frame times
+ *   while scrolling, zooming and dragging a region.
+ * Dependencies:
+ *   Wavesurfer (lib/wavesurfer.min.js), WaveSurfer.Regions (src/wavesurfer.regions.js),
+ *   WaveSurfer.Labels (src/wavesurfer.labels.js)
+ */
+var RegionsBenchmark = {
+    SAMPLE_RATE: 8000,
+    TAGS: ['do', 're', 'mi', 'fa', 'sol', 'la', 'si', 'rest'],
+    FRAMES: 300,
+
+    init: function() {
+        var my = this;
+        this.numRegions = this.getParameter('regions', 10000);
+        this.duration = this.getParameter('duration', 1800);
+        this.results = document.getElementById('results');
+        this.renderTimes = [];
+
+        this.wavesurfer = Object.create(WaveSurfer);
+        this.wavesurfer.init({
+            container: '.audio_visual',
+            waveColor: '#FF00FF',
+            progressColor: '#FF00FF',
+            height: 128,
+            backend: 'MediaElement'
+        });
+        this.labels = Object.create(WaveSurfer.Labels);
+        this.labels.init({
+            wavesurfer: this.wavesurfer,
+            container: '.labels'
+        });
+
+        this.wavesurfer.once('ready', function() {
+            my.wavesurfer.initRegions();
+            my.timeRender();
+            my.addRegions();
+        });
+        this.wavesurfer.load(this.silentSound(), this.syntheticPeaks(this.wavesurfer.drawer.getWidth()));
+
+        document.getElementById('scroll').addEventListener('click', this.scroll.bind(this));
+        document.getElementById('zoom').addEventListener('click', this.zoom.bind(this));
+        document.getElementById('drag').addEventListener('click', this.drag.bind(this));
+    },
+
+    getParameter: function(name, defaultValue) {
+        var match = new RegExp('[?&]' + name + '=([0-9.]+)').exec(window.location.search);
+        return match ? Number(match[1]) : defaultValue;
+    },
+
+    log: function(line) {
+        this.results.textContent += line + '\n';
+    },
+
+    // Silent 8 bit wav, so the media element has the duration of the regions
+    silentSound: function() {
+        var numSamples = Math.round(this.duration * this.SAMPLE_RATE);
+        var buffer = new ArrayBuffer(44 + numSamples);
+        var view = new DataView(buffer);
+        var writeString = function(offset, string) {
+            for (var i = 0; i < string.length; i++) {
+                view.setUint8(offset + i, string.charCodeAt(i));
+            }
+        };
+        writeString(0, 'RIFF');
+        view.setUint32(4, 36 + numSamples, true);
+        writeString(8, 'WAVE');
+        writeString(12, 'fmt ');
+        view.setUint32(16, 16, true);
+        // pcm, mono, sample rate, byte rate, block align, bits per sample
+        view.setUint16(20, 1, true);
+        view.setUint16(22, 1, true);
+        view.setUint32(24, this.SAMPLE_RATE, true);
+        view.setUint32(28, this.SAMPLE_RATE, true);
+        view.setUint16(32, 1, true);
+        view.setUint16(34, 8, true);
+        writeString(36, 'data');
+        view.setUint32(40, numSamples, true);
+        new Uint8Array(buffer, 44).fill(128);
+        return URL.createObjectURL(new Blob([buffer], {type: 'audio/wav'}));
+    },
+
+    // Pairs of maximum and minimum, so the waveform isn't flat
+    syntheticPeaks: function(width) {
+        var peaks = new Float32Array(width * 2);
+        for (var i = 0; i < width; i++) {
+            var value = 0.2 + 0.6 * Math.random();
+            peaks[2 * i] = value;
+            peaks[2 * i + 1] = -value;
+        }
+        return peaks;
+    },
+
+    // Keep the time of each update of the regions in view, including the labels
+    timeRender: function() {
+        var my = this;
+        var regions = this.wavesurfer.regions;
+        var render = regions.render;
+        regions.render = function() {
+            var start = performance.now();
+            render.apply(this, arguments);
+            my.renderTimes.push(performance.now() - start);
+        };
+    },
+
+    // Consecutive note-like segments of random lengths covering the sound
+    addRegions: function() {
+        var my = this;
+        var lengths = [];
+        var total = 0;
+        for (var i = 0; i < this.numRegions; i++) {
+            lengths.push(0.5 + Math.random());
+            total += lengths[i];
+        }
+        var start = performance.now();
+        var time = 0;
+        lengths.forEach(function(length, i) {
+            var end = time + length * my.duration / total;
+            my.wavesurfer.addRegion({
+                start: time,
+                end: end,
+                annotation: my.TAGS[i % my.TAGS.length]
+            });
+            time = end;
+        });
+        var added = performance.now();
+        this.log(this.numRegions + ' regions over ' + this.duration + ' s added in ' +
+                 (added - start).toFixed(1) + ' ms');
+        // the regions are drawn in the next frame
+        window.requestAnimationFrame(function() {
+            my.log('first draw in ' + (performance.now() - added).toFixed(1) + ' ms, ' + my.elementCounts());
+            my.renderTimes = [];
+        });
+    },
+
+    elementCounts: function() {
+        return document.querySelectorAll('region').length + ' region elements (' +
+            this.wavesurfer.regions.rendered.length + ' in view), ' +
+            document.querySelectorAll('tag').length + ' label elements';
+    },
+
+    // Call step with the frame number in FRAMES consecutive animation frames, then log the frame times
+    runFrames: function(name, step) {
+        var my = this;
+        var frameTimes = [];
+        var frame = 0;
+        var last = null;
+        this.renderTimes = [];
+        var next = function(now) {
+            if (last != null) {
+                frameTimes.push(now - last);
+            }
+            last = now;
+            if (frame < my.FRAMES) {
+                step(frame++);
+                window.requestAnimationFrame(next);
+            } else {
+                my.log(name + ': ' + my.summary(frameTimes, 'frame') + ', ' + my.summary(my.renderTimes, 'update') +
+                       ', ' + my.elementCounts());
+            }
+        };
+        window.requestAnimationFrame(next);
+    },
+
+    summary: function(times, name) {
+        if (!times.length) {
+            return 'no ' + name;
+        }
+        var sum = times.reduce(function(a, b) { return a + b; }, 0);
+        return 'mean ' + name + ' ' + (sum / times.length).toFixed(2) + ' ms, max ' +
+            Math.max.apply(null, times).toFixed(2) + ' ms';
+    },
+
+    // Scroll from the beginning to the end of the sound, zoomed in
+    scroll: function() {
+        var wrapper = this.wavesurfer.drawer.wrapper;
+        this.wavesurfer.zoom(100);
+        this.runFrames('scroll', function(frame) {
+            wrapper.scrollLeft = frame / RegionsBenchmark.FRAMES * (wrapper.scrollWidth - wrapper.clientWidth);
+        });
+    },
+
+    // Zoom from the whole sound to 200 pixels per second
+    zoom: function() {
+        var wavesurfer = this.wavesurfer;
+        var minPxPerSec = wavesurfer.drawer.getWidth() / wavesurfer.getDuration();
+        this.runFrames('zoom', function(frame) {
+            wavesurfer.zoom(minPxPerSec * Math.pow(200 / minPxPerSec, frame / RegionsBenchmark.FRAMES));
+        });
+    },
+
+    // Drag the first region in view forward and back
+    drag: function() {
+        var region = this.wavesurfer.regions.rendered[0];
+        if (!region) {
+            return;
+        }
+        this.runFrames('drag', function(frame) {
+            region.onDrag(frame < RegionsBenchmark.FRAMES / 2 ? 0.05 : -0.05);
+        });
+    }
+};
+
+RegionsBenchmark.init();
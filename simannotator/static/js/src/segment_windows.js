@@ -0,0 +1,88 @@
+'use strict';
+
+/*
+ * Purpose:
+ *   Load the segments of a sound with many segments by windows of time, around the part of the sound in view and
+ *   around the playhead, instead of all of them with the task. Each window is requested once, the segments that
+ *   overlap several windows are added once.
+ * Dependencies:
+ *   jQuery, Wavesurfer (lib/wavesurfer.min.js)
+ */
+function SegmentWindows(wavesurfer, url, windowDuration, reference, addSegment) {
+    this.wavesurfer = wavesurfer;
+    this.url = url;
+    this.windowDuration = windowDuration;
+    // request the segments of the reference sound of the task
+    this.reference = reference;
+    // called with each segment the first time it is loaded, and the revision of the annotations
+    this.addSegment = addSegment;
+    // windows requested, by index
+    this.requested = {};
+    // ids of the segments added
+    this.added = {};
+}
+
+SegmentWindows.prototype = {
+    // When the view is wider than this number of windows, only the windows around the playhead are loaded
+    MAX_WINDOWS_IN_VIEW: 4,
+
+    // Load the windows in view and the one after them, and the window of the playhead and the one after it
+    update: function() {
+        var duration = this.wavesurfer.getDuration();
+        var width = this.wavesurfer.drawer.width / this.wavesurfer.params.pixelRatio;
+        if (!duration || !width) {
+            return;
+        }
+        var wrapper = this.wavesurfer.drawer.wrapper;
+        var viewStart = wrapper.scrollLeft / width * duration;
+        var viewEnd = (wrapper.scrollLeft + wrapper.clientWidth) / width * duration;
+        if (viewEnd - viewStart <= this.MAX_WINDOWS_IN_VIEW * this.windowDuration) {
+            this.loadBetween(viewStart, viewEnd + this.windowDuration, duration);
+        }
+        var current = this.wavesurfer.getCurrentTime();
+        this.loadBetween(current, current + this.windowDuration, duration);
+    },
+
+    loadBetween: function(start, end, duration) {
+        var first = Math.max(0, Math.floor(start / this.windowDuration));
+        var last = Math.floor(Math.min(end, duration) / this.windowDuration);
+        for (var index = first; index <= last; index++) {
+            this.load(index);
+        }
+    },
+
+    load: function(index) {
+        if (this.requested[index]) {
+            return;
+        }
+        this.requested[index] = true;
+        var my = this;
+        var params = {start: index * this.windowDuration, end: (index + 1) * this.windowDuration};
+        if (this.reference) {
+            params.reference = 1;
+        }
+        $.getJSON(this.url, params)
+        .done(function(data) {
+            data.segments.forEach(function(segment) {
+                if (!my.added[segment.id]) {
+                    my.added[segment.id] = true;
+                    my.addSegment(segment, data.revision);
+                }
+            });
+        })
+        .fail(function() {
+            // requested again the next time it is in view
+            delete my.requested[index];
+        });
+    },
+
+    // Load the windows when the view or the playhead change
+    bind: function() {
+        var update = this.update.bind(this);
+        this.wavesurfer.drawer.wrapper.addEventListener('scroll', update);
+        this.wavesurfer.on('zoom', update);
+        this.wavesurfer.on('seek', update);
+        this.wavesurfer.on('audioprocess', update);
+        update();
+    }
+};
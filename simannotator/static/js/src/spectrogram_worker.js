@@ -0,0 +1,140 @@
+'use strict';
+
+/*
+ * Purpose:
+ *   Web Worker that computes the spectrogram drawn by WaveSurfer.Drawer.Canvas.drawSpectrogram
+ *   (src/wavesurfer.drawer.extended.js), so the FFT and the colour mapping don't block the annotation
+ *   interface. The columns in view are computed first and the rest after them, each block of columns is
+ *   sent as rgba pixels as soon as it is ready. A new draw cancels the blocks of the previous one.
+ * Messages:
+ *   {type: 'load', samples: Float32Array of the first channel, colorMap: array of 256 [r, g, b]}
+ *   {type: 'draw', id, width: columns of the canvas, rows: rows of the canvas, fftSamples,
+ *    first: first column in view}
+ * Posts:
+ *   {id, x: first column of the block, width, rows, pixels: Uint8ClampedArray of rgba pixels}
+ */
+var BLOCK_SIZE = 128;
+var samples = null;
+var colorMap = null;
+var currentId = null;
+
+// Radix-2 FFT of a real frame with a Hann window, the magnitudes are scaled as in wavesurfer.spectrogram
+function FFT(size) {
+    this.size = size;
+    this.window = new Float32Array(size);
+    for (var i = 0; i < size; i++) {
+        this.window[i] = 0.5 * (1 - Math.cos(2 * Math.PI * i / (size - 1)));
+    }
+    this.reverse = new Uint32Array(size);
+    var bits = Math.round(Math.log(size) / Math.LN2);
+    for (var i = 0; i < size; i++) {
+        var reversed = 0;
+        for (var b = 0; b < bits; b++) {
+            reversed = (reversed << 1) | ((i >> b) & 1);
+        }
+        this.reverse[i] = reversed;
+    }
+    this.real = new Float32Array(size);
+    this.imag = new Float32Array(size);
+}
+
+FFT.prototype.spectrum = function(frame, output) {
+    var size = this.size;
+    var real = this.real;
+    var imag = this.imag;
+    for (var i = 0; i < size; i++) {
+        var j = this.reverse[i];
+        real[i] = j < frame.length ? frame[j] * this.window[j] : 0;
+        imag[i] = 0;
+    }
+    for (var half = 1; half < size; half *= 2) {
+        var angle = -Math.PI / half;
+        var stepReal = Math.cos(angle);
+        var stepImag = Math.sin(angle);
+        for (var start = 0; start < size; start += half * 2) {
+            var wReal = 1;
+            var wImag = 0;
+            for (var k = 0; k < half; k++) {
+                var a = start + k;
+                var b = a + half;
+                var tReal = wReal * real[b] - wImag * imag[b];
+                var tImag = wReal * imag[b] + wImag * real[b];
+                real[b] = real[a] - tReal;
+                imag[b] = imag[a] - tImag;
+                real[a] += tReal;
+                imag[a] += tImag;
+                var nextReal = wReal * stepReal - wImag * stepImag;
+                wImag = wReal * stepImag + wImag * stepReal;
+                wReal = nextReal;
+            }
+        }
+    }
+    for (var i = 0; i < output.length; i++) {
+        var magnitude = 2 / size * Math.sqrt(real[i] * real[i] + imag[i] * imag[i]);
+        // the same values as WaveSurfer.Drawer.Canvas.getFrequencies
+        output[i] = Math.max(-255, Math.log(magnitude) / Math.LN10 * 45);
+    }
+};
+
+// Order the blocks of columns: the ones in view, then the ones after them and then the ones before them
+function blocksOrder(job) {
+    var blocks = [];
+    var firstBlock = Math.max(0, Math.floor(job.first / BLOCK_SIZE));
+    var numBlocks = Math.ceil(job.width / BLOCK_SIZE);
+    for (var i = firstBlock; i < numBlocks; i++) {
+        blocks.push(i);
+    }
+    for (var i = firstBlock - 1; i >= 0; i--) {
+        blocks.push(i);
+    }
+    return blocks;
+}
+
+function renderBlock(job, x, width) {
+    var rows = job.rows;
+    var bins = job.fftSamples / 2;
+    var pixels = new Uint8ClampedArray(width * rows * 4);
+    var values = new Uint8Array(bins);
+    for (var column = 0; column < width; column++) {
+        var offset = Math.floor((x + column) * samples.length / job.width);
+        job.fft.spectrum(samples.subarray(offset, offset + job.fftSamples), values);
+        for (var row = 0; row < rows; row++) {
+            // the lowest frequencies are at the bottom
+            var value = values[Math.floor((rows - 1 - row) * bins / rows)];
+            var rgb = colorMap ? colorMap[value] : [value, value, value];
+            var index = (row * width + column) * 4;
+            pixels[index] = rgb[0];
+            pixels[index + 1] = rgb[1];
+            pixels[index + 2] = rgb[2];
+            pixels[index + 3] = 255;
+        }
+    }
+    return pixels;
+}
+
+function drawBlocks(job) {
+    if (job.id !== currentId || !job.blocks.length) {
+        return;
+    }
+    var x = job.blocks.shift() * BLOCK_SIZE;
+    var width = Math.min(BLOCK_SIZE, job.width - x);
+    var pixels = renderBlock(job, x, width);
+    postMessage({id: job.id, x: x, width: width, rows: job.rows, pixels: pixels}, [pixels.buffer]);
+    // the next block is computed after the messages received in the meantime, a new draw stops this one
+    setTimeout(function() {
+        drawBlocks(job);
+    }, 0);
+}
+
+onmessage = function(event) {
+    var data = event.data;
+    if (data.type === 'load') {
+        samples = data.samples;
+        colorMap = data.colorMap;
+    } else if (data.type === 'draw' && samples) {
+        currentId = data.id;
+        data.fft = new FFT(data.fftSamples);
+        data.blocks = blocksOrder(data);
+        drawBlocks(data);
+    }
+};
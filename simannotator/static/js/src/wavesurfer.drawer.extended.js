@@ -6,14 +6,16 @@
 
 /**
  * Purpose: 
- *   Add methods getFrequencyRGB, getFrequencies, resample, drawSpectrogram 
+ *   Add methods getFrequencyRGB, getFrequencies, resample, drawSpectrogram, drawSpectrogramTiles
  *   to WaveSurfer.Drawer.Canvas. These methods are modified versions from the the 
  *   spectrogram plugin (https://github.com/katspaugh/wavesurfer.js/blob/master/plugin/wavesurfer.spectrogram.js)
  *   to allow the wavesurfer drawer to draw a spectrogram representation when this.params.visualization is 
- *   set to "spectrogram"
+ *   set to "spectrogram". The spectrogram is computed in a Web Worker when the browser supports them.
  * Dependencies:
  *   WaveSurfer (lib/wavesurfer.min.js & lib/wavesurfer.spectrogram.min.js)
  */
+var SPECTROGRAM_WORKER_URL = '/static/js/src/spectrogram_worker.js';
+
 WaveSurfer.util.extend(WaveSurfer.Drawer.Canvas, {
 
     // Takes in integer 0-255 and maps it to rgb string
@@ -111,7 +113,50 @@ WaveSurfer.util.extend(WaveSurfer.Drawer.Canvas, {
         return newMatrix;
     },
 
+    // Draw the spectrogram computed in a Web Worker (src/spectrogram_worker.js), the columns in view first.
+    // The samples are sent to the worker once for each buffer.
     drawSpectrogram: function (buffer) {
+        if (!window.Worker) {
+            this.drawSpectrogramInline(buffer);
+            return;
+        }
+        var my = this;
+        if (!this.spectrogramWorker) {
+            this.spectrogramWorker = new Worker(SPECTROGRAM_WORKER_URL);
+            this.spectrogramWorker.onmessage = function (event) {
+                var data = event.data;
+                if (data.id === my.spectrogramId) {
+                    my.waveCc.putImageData(new ImageData(data.pixels, data.width, data.rows), data.x, 0);
+                }
+            };
+        }
+        if (this.spectrogramBuffer !== buffer) {
+            this.spectrogramBuffer = buffer;
+            var samples = new Float32Array(buffer.getChannelData(0));
+            this.spectrogramWorker.postMessage({type: 'load', samples: samples, colorMap: this.params.colorMap},
+                                               [samples.buffer]);
+        }
+        this.spectrogramId = (this.spectrogramId || 0) + 1;
+        var id = this.spectrogramId;
+        // the columns in view are known when the wavesurfer has been scrolled to the cursor
+        requestAnimationFrame(function () {
+            if (id !== my.spectrogramId) {
+                return;
+            }
+            var pixelRatio = my.params.pixelRatio;
+            my.spectrogramWorker.postMessage({
+                type: 'draw',
+                id: id,
+                width: my.width,
+                rows: my.waveCc.canvas.height,
+                fftSamples: my.params.fftSamples || 512,
+                first: Math.floor(my.wrapper.scrollLeft * pixelRatio)
+            });
+        });
+    },
+
+    // Draw the spectrogram in the main thread, for the browsers without Web Workers
+    drawSpectrogramInline: function (buffer) {
         var pixelRatio = this.params.pixelRatio;
         var length = buffer.duration;
         var height = (this.params.fftSamples / 2) * pixelRatio;
@@ -127,12 +172,84 @@ WaveSurfer.util.extend(WaveSurfer.Drawer.Canvas, {
                 this.waveCc.fillRect(i, height - j * heightFactor, 1, heightFactor);
             }
         }
+    },
+
+    // Draw the spectrogram with the tiles rendered by the backend (params.spectrogramTiles), as images over
+    // the canvas. Only the tiles in view are requested, the rest when the wavesurfer is scrolled.
+    drawSpectrogramTiles: function (length, duration) {
+        var my = this;
+        if (!this.tilesContainer) {
+            this.tilesContainer = this.wrapper.appendChild(this.style(document.createElement('div'), {
+                position: 'absolute',
+                zIndex: 1,
+                left: 0,
+                top: 0,
+                height: '100%',
+                overflow: 'hidden'
+            }));
+            this.wrapper.addEventListener('scroll', function () {
+                my.showSpectrogramTiles();
+            });
+        }
+        this.clearWave();
+        this.tilesContainer.innerHTML = '';
+        this.tileImages = {};
+        this.tilesWidth = length / this.params.pixelRatio;
+        this.tilesDuration = duration;
+        this.style(this.tilesContainer, {width: this.tilesWidth + 'px'});
+        this.showSpectrogramTiles();
+    },
+
+    showSpectrogramTiles: function () {
+        var tiles = this.params.spectrogramTiles;
+        if (!this.tilesContainer || !this.tilesDuration) {
+            return;
+        }
+        var pxPerSec = this.tilesWidth / this.tilesDuration;
+        // the level with a column for each pixel of the canvas
+        var hop = tiles.sampleRate / (pxPerSec * this.params.pixelRatio);
+        var level = Math.min(Math.max(Math.round(Math.log(hop / tiles.minHop) / Math.LN2), 0), tiles.levels - 1);
+        var tileSeconds = tiles.tileWidth * tiles.minHop * Math.pow(2, level) / tiles.sampleRate;
+        var tilePx = tileSeconds * pxPerSec;
+        var first = Math.floor(this.wrapper.scrollLeft / tilePx);
+        var last = Math.min(Math.floor((this.wrapper.scrollLeft + this.wrapper.clientWidth) / tilePx),
+                            Math.ceil(this.tilesDuration / tileSeconds) - 1);
+        for (var i = first; i <= last; i++) {
+            var key = level + '_' + i;
+            if (this.tileImages[key]) {
+                continue;
+            }
+            var image = this.tilesContainer.appendChild(this.style(document.createElement('img'), {
+                position: 'absolute',
+                left: i * tilePx + 'px',
+                width: tilePx + 'px',
+                top: 0,
+                height: '100%'
+            }));
+            this.loadSpectrogramTile(image, tiles.url + '?level=' + level + '&index=' + i, 0);
+            this.tileImages[key] = image;
+        }
+    },
+
+    // Load the image of a tile. The backend answers 202 for a tile that is not rendered yet and renders it in the
+    // background, so the tile is requested again a few times, later each time, while it is still shown.
+    loadSpectrogramTile: function (image, url, attempt) {
+        var my = this;
+        image.alt = '';
+        image.onerror = function () {
+            if (attempt < 5 && image.parentNode === my.tilesContainer) {
+                setTimeout(function () {
+                    my.loadSpectrogramTile(image, url, attempt + 1);
+                }, 1000 * Math.pow(2, attempt));
+            }
+        };
+        image.src = attempt ? url + '&attempt=' + attempt : url;
     }
 });
 
 /** 
- * Override the method WaveSurfer.drawBuffer to pass in the this.backend.buffer to
- * WaveSurfer.Drawer.drawPeaks since the buffer is needed to draw the spectrogram
+ * Override the method WaveSurfer.drawBuffer to pass in the this.backend.buffer and the duration to
+ * WaveSurfer.Drawer.drawPeaks since they are needed to draw the spectrogram
  */
 WaveSurfer.util.extend(WaveSurfer, {
     drawBuffer: function () {
@@ -148,7 +265,7 @@ WaveSurfer.util.extend(WaveSurfer, {
         }
 
         var peaks = this.backend.getPeaks(width);
-        this.drawer.drawPeaks(peaks, width, this.backend.buffer);
+        this.drawer.drawPeaks(peaks, width, this.backend.buffer, this.getDuration());
         this.fireEvent('redraw', peaks, width);
     },
 });
@@ -158,12 +275,14 @@ WaveSurfer.util.extend(WaveSurfer, {
  * spectrogram representations
  */
 WaveSurfer.util.extend(WaveSurfer.Drawer, {
-    drawPeaks: function (peaks, length, buffer) {
+    drawPeaks: function (peaks, length, buffer, duration) {
         this.resetScroll();
         this.setWidth(length);
         var visualization = this.params.visualization;
         if (visualization === 'invisible') {
             //draw nothing
+        } else if (visualization === 'spectrogram' && this.params.spectrogramTiles) {
+            this.drawSpectrogramTiles(length, duration);
         } else if (visualization === 'spectrogram' && buffer) {
             this.drawSpectrogram(buffer);
         } else {
@@ -2,7 +2,8 @@
 
 /**
  * Purpose:
- *   Add labels of the annotation above the corresponding regions
+ *   Add labels of the annotation above the corresponding regions. Like the regions, only the labels of the regions
+ *   in view have an element, they are drawn when the regions manager fires 'region-render'.
  * Dependencies:
  *   WaveSurfer (lib/wavesurfer.min.js), WaveSurfer.Regions (src/wavesurfer.regions.js)
  */
@@ -32,26 +33,28 @@ WaveSurfer.Labels = {
         this.height = this.params.height || 40;
         this.labelsElement = null;
         this.labels = {};
+        // labels with an element, elements to reuse and widths of the label elements for each text
+        this.shown = [];
+        this.pool = [];
+        this.textWidths = {};
+        this.renderCount = 0;
 
         // Create & append wrapper element to container
         this.createWrapper();
         // Create & append label container element to wrapper element
-        this.render();
+        this.createLabelsElement();
 
         // When the user scrolls in the wavesurfer, make the labels scroll with it
         drawer.wrapper.addEventListener('scroll', function (e) {
             this.updateScroll(e);
         }.bind(this));
 
-        // Replace the label container with a empty one when the wavesurfer is redrawn
-        //wavesurfer.on('redraw', this.render.bind(this));
         // Destory the wrapper when the wavesurfer is destroyed
         wavesurfer.on('destroy', this.destroy.bind(this));
         // Add a label when a region is created
         wavesurfer.on('region-created', this.add.bind(this));
-        // Update a label when its region is updated
-        wavesurfer.on('region-updated', this.rearrange.bind(this));
-        wavesurfer.on('zoom-end', this.render.bind(this));
+        // Draw the labels of the regions in view when the regions are drawn
+        wavesurfer.on('region-render', this.render.bind(this));
     },
 
     // Remove the wrapper element
@@ -87,45 +90,21 @@ WaveSurfer.Labels = {
         }
     },
 
-    // Remove the label container element
-    clear: function () {
-        if (this.labelsElement) {
-            this.labelsElement.parentElement.removeChild(this.labelsElement);
-            this.labelsElement = null;
-        }
-    },
-
     // Create and append the label container element
-    render: function () {
-        this.clear();
+    createLabelsElement: function () {
         this.labelsElement = this.wrapper.appendChild(document.createElement('div'));
         this.style(this.labelsElement, {
             height: this.height + 'px',
             width: this.drawer.wrapper.scrollWidth * this.pixelRatio + 'px',
             left: 10
         });
-
-        if (this.wavesurfer.regions) {
-            var regions = [];
-
-            for (var id in this.labels) {
-              regions.push(this.labels[id].region.id);
-            }
-            for (var id in this.wavesurfer.regions.list) {
-                if (!(id in regions)) {
-                    this.add(this.wavesurfer.regions.list[id]);
-                }
-            }
-        }
     },
 
-
     updateScroll: function () {
-       // TODO: FIXME
         this.wrapper.scrollLeft = this.drawer.wrapper.scrollLeft;
     },
 
-    // Create & append a label element that is associated with the given region
+    // Create the label of the given region, its element is created when the region is in view
     add: function (region) {
         var label = Object.create(WaveSurfer.Label);
         label.init(region, this.labelsElement, this.wavesurfer);
@@ -133,45 +112,120 @@ WaveSurfer.Labels = {
         this.labels[region.id] = label;
 
         region.on('remove', (function () {
-            this.labels[region.id].remove();
+            this.release(label);
             delete this.labels[region.id];
         }).bind(this));
 
         return label;
     },
 
-    // Rearrange the labels to reduce overlap
-    rearrange: function () {
-        this.updateScroll();
-        // First place all label elements in bottom row
-        for (var id in this.labels) {
-            // 2 px above wavesurfer canvas
-            this.labels[id].updateRender(2);
+    // Take the element of a label and keep it to reuse it
+    release: function (label) {
+        var element = label.element;
+        if (element) {
+            label.detach();
+            element.style.display = 'none';
+            this.pool.push(element);
         }
+    },
 
-        // If a label overlaps with another, move it up to the top row
-        for (var id in this.labels) {
-            if (this.doesItOverlap(this.labels[id])) {
-                // 22 px above wavesurfer canvas
-                this.labels[id].updateRender(22);
-            }
-        }
+    // Create a label element, the events are sent to the label that has the element
+    createElement: function () {
+        var labelEl = this.labelsElement.appendChild(document.createElement('tag'));
+        labelEl.label = null;
+        this.style(labelEl, {
+            position: 'absolute',
+            whiteSpace: 'nowrap',
+            backgroundColor: '#7C7C7C',
+            color: '#ffffff',
+            padding: '0px 5px',
+            borderRadius: '2px',
+            fontSize: '12px',
+            textTransform: 'uppercase'
+        });
+
+        // Add play button inside the label
+        labelEl.playBtn = labelEl.appendChild(document.createElement('i'));
+        labelEl.playBtn.className = 'fa fa-play-circle'; // Font Awesome Icon
+        this.style(labelEl.playBtn, {
+            marginRight: '5px',
+            cursor: 'pointer'
+        });
+
+        labelEl.textEl = labelEl.appendChild(document.createElement('span'));
+
+        // If the user click the play button in the label, play the sound for the associated region
+        labelEl.playBtn.addEventListener('click', function (e) {
+            labelEl.label && labelEl.label.region.play();
+        });
+        // If the user dbl clicks the label, trigger the dblclick event for the assiciated region
+        labelEl.addEventListener('dblclick', function (e) {
+            labelEl.label && labelEl.label.region.wavesurfer.fireEvent('label-dblclick', labelEl.label.region, e);
+        });
+        return labelEl;
     },
 
-    // Calcuates if a label overlaps with any other label elements
-    doesItOverlap: function(label) {
-        for (var id in this.labels) {
-            var otherLabel = this.labels[id];
-            if (otherLabel === label) {
-                continue;
+    // Draw the labels of the regions in view. The texts are written first and the new texts are measured at once,
+    // then the labels are placed: centered above their region, on the bottom row (2 px above the wavesurfer canvas),
+    // or on the top row (22 px above) if they overlap the label of a wider region
+    render: function (regions, view) {
+        var my = this;
+        var count = ++this.renderCount;
+        var labels = regions.map(function (region) {
+            var label = region.annotationLabel || my.add(region);
+            label.renderCount = count;
+            return label;
+        });
+        this.shown.forEach(function (label) {
+            if (label.renderCount !== count) {
+                my.release(label);
+            }
+        });
+
+        var unmeasured = [];
+        labels.forEach(function (label) {
+            if (!label.element) {
+                label.attach(my.pool.pop() || my.createElement());
+            }
+            label.updateText();
+            if (!my.textWidths[label.text]) {
+                unmeasured.push(label);
             }
-            if ((label.left() <=  otherLabel.right() && label.left() >=  otherLabel.left()) ||
-                (label.right() >=  otherLabel.left() && label.right()  <= otherLabel.right()) ||
-                (label.right() >=  otherLabel.right() && label.left()  <= otherLabel.left())) {
-                return label.region.element.offsetWidth < otherLabel.region.element.offsetWidth;
+        });
+        unmeasured.forEach(function (label) {
+            my.textWidths[label.text] = label.element.offsetWidth;
+        });
+
+        labels.forEach(function (label) {
+            var region = label.region;
+            label.width = my.textWidths[label.text];
+            label.regionWidth = ~~((region.end - region.start) / view.duration * view.width);
+            var regionLeft = ~~(region.start / view.duration * view.width);
+            label.left = Math.max(regionLeft + (label.regionWidth - label.width) / 2, 0);
+            label.top = false;
+        });
+        var byLeft = labels.slice().sort(function (a, b) {
+            return a.left - b.left;
+        });
+        for (var i = 0; i < byLeft.length; i++) {
+            var label = byLeft[i];
+            for (var j = i + 1; j < byLeft.length && byLeft[j].left <= label.left + label.width; j++) {
+                if (label.regionWidth < byLeft[j].regionWidth) {
+                    label.top = true;
+                } else if (byLeft[j].regionWidth < label.regionWidth) {
+                    byLeft[j].top = true;
+                }
             }
         }
-        return false;
+
+        this.style(this.labelsElement, {
+            width: view.width * this.pixelRatio + 'px'
+        });
+        labels.forEach(function (label) {
+            label.updateRender(label.top ? 22 : 2, view.width);
+        });
+        this.wrapper.scrollLeft = view.scrollLeft;
+        this.shown = labels;
     }
 };
 
@@ -179,7 +233,7 @@ WaveSurfer.util.extend(WaveSurfer.Labels, WaveSurfer.Observer);
 
 /**
  * Purpose:
- *   Individual label elements
+ *   Individual labels, drawn in an element of WaveSurfer.Labels while their region is in view
  * Dependencies:
  *   WaveSurfer (lib/wavesurfer.min.js), WaveSurfer.Region (src/wavesurfer.regions.js), Font Awesome
  */
@@ -190,80 +244,66 @@ WaveSurfer.Label = {
         this.container = container;
         this.wavesurfer = region.wavesurfer;
         this.element = null;
-        this.playBtn = null;
         this.text = null;
+        this.classes = [];
         region.annotationLabel = this;
         this.region = region;
-        this.render();
     },
 
-    // Create and append individual label element
-    render: function() {
-        var labelEl = document.createElement('tag');
-
-        this.element = this.container.appendChild(labelEl);
-        this.style(this.element, {
-            position: 'absolute',
-            whiteSpace: 'nowrap',
-            backgroundColor: '#7C7C7C',
-            color: '#ffffff',
-            padding: '0px 5px',
-            borderRadius: '2px',
-            fontSize: '12px',
-            textTransform: 'uppercase'
-        });
-
-        // Add play button inside the label
-        this.playBtn = this.element.appendChild(document.createElement('i'));
-        this.playBtn.className = 'fa fa-play-circle'; // Font Awesome Icon
-        this.style(this.playBtn, {
-            marginRight: '5px',
-            cursor: 'pointer'
-        });
+    // Draw the label in an element of WaveSurfer.Labels
+    attach: function (labelEl) {
+        this.element = labelEl;
+        labelEl.label = this;
+        labelEl.className = this.classes.join(' ');
+        labelEl.style.display = '';
+        // the text of the element is the one of the previous label
+        this.text = labelEl.textEl.textContent;
+    },
 
-        this.text = this.element.appendChild(document.createElement('span'));
-        this.text.innerHTML = '?';
+    detach: function () {
+        if (this.element) {
+            this.element.label = null;
+            this.element = null;
+        }
+    },
 
-        // Place the label on the bottom row
-        this.updateRender(2);
-        this.bindEvents();
+    // Update the label element with it's corresponding region's annotation
+    updateText: function () {
+        var text = this.region.annotation || '?';
+        if (text !== this.text) {
+            this.element.textEl.textContent = text;
+            this.text = text;
+        }
     },
 
-    // Update the label element with it's corresponding region's annotation. Also update the label elements position.
-    // The bottom parameter is how many pixels away from the label container's bottom the label element will be placed
-    updateRender: function(bottom) {
-        this.text.innerHTML = (this.region.annotation || '?');
-        var offset = (this.region.element.offsetWidth - this.element.offsetWidth) / 2
+    // Update the label elements position. The bottom parameter is how many pixels away from the label container's
+    // bottom the label element will be placed
+    updateRender: function(bottom, width) {
         this.style(this.element, {
-            left: Math.max(this.region.element.offsetLeft + offset, 0) + 'px',
+            left: this.left + 'px',
             bottom: bottom + 'px',
-            zIndex: this.wavesurfer.drawer.wrapper.scrollWidth - this.element.offsetWidth
+            zIndex: width - this.width
         });
     },
 
-    left: function() {
-        return this.element.offsetLeft;
-    },
-
-    right: function() {
-        return this.element.offsetLeft + this.element.offsetWidth;
-    },
-
-    remove: function() {
-        this.container.removeChild(this.element);
+    // Add a class to the label element, it is kept when the label gets another element
+    addClass: function (className) {
+        if (this.classes.indexOf(className) < 0) {
+            this.classes.push(className);
+        }
+        if (this.element) {
+            this.element.classList.add(className);
+        }
     },
 
-    // Add event handlers for when the user clicks the labels play btn or double clicks the label
-    bindEvents: function() {
-        var my = this;
-        // If the user click the play button in the label, play the sound for the associated region
-        this.playBtn.addEventListener('click', function (e) {
-            my.region.play();
-        });
-        // If the user dbl clicks the label, trigger the dblclick event for the assiciated region
-        this.element.addEventListener('dblclick', function (e) {
-            my.region.wavesurfer.fireEvent('label-dblclick', my.region, e);
-        });
+    removeClass: function (className) {
+        var index = this.classes.indexOf(className);
+        if (index >= 0) {
+            this.classes.splice(index, 1);
+        }
+        if (this.element) {
+            this.element.classList.remove(className);
+        }
     }
 };
 
@@ -10,26 +10,74 @@
  *   https://github.com/katspaugh/wavesurfer.js/blob/master/plugin/wavesurfer.regions.js
  * Modifications made:
  * - To fix issue when draging region past the end of the wavesurfer representation
- *   by saving wavesurfer.drawer.wrapper.scrollWidth to this.width on init since
- *   wavesurfer.drawer.wrapper.scrollWidth changes as regions are dragged outside 
- * - Trigger region eventUp when user does a mouseup on anywhere on the document instead of just 
+ *   by saving the width of the wavesurfer drawer instead of wavesurfer.drawer.wrapper.scrollWidth,
+ *   since wavesurfer.drawer.wrapper.scrollWidth changes as regions are dragged outside
+ * - Trigger region eventUp when user does a mouseup on anywhere on the document instead of just
  *   the wrapper element
  * - Added this.proximity and this.annotation fields
- * - Added X button element to the top right corner of each region that deletes the region 
+ * - Added X button element to the top right corner of each region that deletes the region
  *   on click. The X icon uses font awesome styling
- * - Pass regionUpdateType when the event 'region-update-end' is fired to show if the start or the end of the 
+ * - Pass regionUpdateType when the event 'region-update-end' is fired to show if the start or the end of the
  *   region was updated, or if the whole region was dragged
  * - Give smaller regions higher z-indexs
+ * - Only the regions in view (and half a view on each side) have a DOM element. The regions are kept sorted by
+ *   their start, the elements of the regions that go out of view are reused for the ones that come into view, and
+ *   the elements are updated once per animation frame after a scroll, a zoom or a change of the regions. The
+ *   event 'region-render' is fired with the regions in view after each update. The classes of a region are set
+ *   with region.addClass and region.removeClass, since its element can change
+ * - The manager listens to the audio process, zoom and mouse events once for all the regions
  */
 
 /* Regions manager */
 WaveSurfer.Regions = {
     init: function (wavesurfer) {
+        var my = this;
         this.wavesurfer = wavesurfer;
         this.wrapper = this.wavesurfer.drawer.wrapper;
 
         /* Id-based hash of regions. */
         this.list = {};
+        /* Regions sorted by start, sorted again in the next frame when a region changes. */
+        this.sorted = [];
+        this.sortedDirty = false;
+        /* Length of the longest region, the regions in view start at most this long before the view. */
+        this.maxLength = 0;
+        /* Regions with an element, and the elements of the regions out of view to reuse. */
+        this.rendered = [];
+        this.pool = [];
+        this.renderCount = 0;
+        this.frame = null;
+        /* Region being dragged or resized. */
+        this.moving = null;
+
+        this.onScroll = function () {
+            my.scheduleRender();
+        };
+        this.onProcess = function (time) {
+            my.sorted.forEach(function (region) {
+                if (!region.removed) {
+                    region.onProcess(time);
+                }
+            });
+        };
+        this.onMove = this.moveRegion.bind(this);
+        this.onUp = this.endMove.bind(this);
+
+        this.wrapper.addEventListener('scroll', this.onScroll);
+        this.wrapper.addEventListener('mousemove', this.onMove);
+        document.body.addEventListener('mouseup', this.onUp);
+        this.wavesurfer.on('zoom', this.onScroll);
+        this.wavesurfer.on('redraw', this.onScroll);
+        this.wavesurfer.backend.on('audioprocess', this.onProcess);
+        this.wavesurfer.on('destroy', function () {
+            my.wrapper.removeEventListener('scroll', my.onScroll);
+            my.wrapper.removeEventListener('mousemove', my.onMove);
+            document.body.removeEventListener('mouseup', my.onUp);
+            if (my.frame != null) {
+                window.cancelAnimationFrame(my.frame);
+                my.frame = null;
+            }
+        });
     },
 
     /* Add a region. */
@@ -38,11 +86,15 @@ WaveSurfer.Regions = {
         region.init(params, this.wavesurfer);
 
         this.list[region.id] = region;
+        this.sorted.push(region);
 
         region.on('remove', (function () {
             delete this.list[region.id];
+            this.releaseElement(region);
+            this.changed();
         }).bind(this));
 
+        this.changed();
         return region;
     },
 
@@ -53,6 +105,250 @@ WaveSurfer.Regions = {
         }, this);
     },
 
+    /* Width of the waveform in css pixels. */
+    getWidth: function () {
+        return this.wavesurfer.drawer.width / this.wavesurfer.params.pixelRatio;
+    },
+
+    /* Mark the regions as changed, they are sorted and drawn in the next frame. */
+    changed: function () {
+        this.sortedDirty = true;
+        this.scheduleRender();
+    },
+
+    scheduleRender: function () {
+        if (this.frame == null) {
+            this.frame = window.requestAnimationFrame(this.render.bind(this));
+        }
+    },
+
+    /* Sort the regions by start and remove the removed ones. */
+    sort: function () {
+        var maxLength = 0;
+        this.sorted = this.sorted.filter(function (region) {
+            if (!region.removed) {
+                maxLength = Math.max(maxLength, region.end - region.start);
+            }
+            return !region.removed;
+        });
+        this.sorted.sort(function (a, b) {
+            return a.start - b.start;
+        });
+        this.maxLength = maxLength;
+        this.sortedDirty = false;
+    },
+
+    /* Regions that intersect the time range [start, end], in order of start. */
+    regionsBetween: function (start, end) {
+        var sorted = this.sorted;
+        // first region that starts after start - maxLength
+        var low = 0;
+        var high = sorted.length;
+        while (low < high) {
+            var middle = (low + high) >>> 1;
+            if (sorted[middle].start < start - this.maxLength) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        var regions = [];
+        for (var i = low; i < sorted.length && sorted[i].start <= end; i++) {
+            if (sorted[i].end >= start) {
+                regions.push(sorted[i]);
+            }
+        }
+        return regions;
+    },
+
+    /* Give elements to the regions in view, take them from the other ones and update their position. */
+    render: function () {
+        this.frame = null;
+        var duration = this.wavesurfer.getDuration();
+        var width = this.getWidth();
+        if (!duration || !width) {
+            return;
+        }
+        if (this.sortedDirty) {
+            this.sort();
+        }
+
+        // all the reads before the writes, so the layout is computed once
+        var scrollLeft = this.wrapper.scrollLeft;
+        var viewWidth = this.wrapper.clientWidth || width;
+        var start = (scrollLeft - viewWidth / 2) / width * duration;
+        var end = (scrollLeft + viewWidth * 1.5) / width * duration;
+        var visible = this.regionsBetween(start, end);
+
+        var count = ++this.renderCount;
+        visible.forEach(function (region) {
+            region.renderCount = count;
+        });
+        this.rendered.forEach(function (region) {
+            if (region.renderCount !== count) {
+                this.releaseElement(region);
+            }
+        }, this);
+        visible.forEach(function (region) {
+            if (!region.element) {
+                region.attach(this.pool.pop() || this.createElement());
+            }
+            region.renderElement(width, duration);
+        }, this);
+        this.rendered = visible;
+
+        this.wavesurfer.fireEvent('region-render', visible, {
+            width: width,
+            duration: duration,
+            scrollLeft: scrollLeft
+        });
+    },
+
+    /* Take the element of a region and keep it to reuse it. */
+    releaseElement: function (region) {
+        var element = region.element;
+        if (element) {
+            region.detach();
+            element.style.display = 'none';
+            this.pool.push(element);
+        }
+    },
+
+    /* Create an element for a region, the events are sent to the region that has the element. */
+    createElement: function () {
+        var my = this;
+        var regionEl = document.createElement('region');
+        regionEl.region = null;
+
+        WaveSurfer.Region.style(regionEl, {
+            position: 'absolute',
+            zIndex: 2,
+            height: '100%',
+            top: '0px',
+            textAlign: 'center'
+        });
+
+        /* Resize handles */
+        regionEl.handleLeft = regionEl.appendChild(document.createElement('handle'));
+        regionEl.handleRight = regionEl.appendChild(document.createElement('handle'));
+        regionEl.handleLeft.className = 'wavesurfer-handle wavesurfer-handle-start';
+        regionEl.handleRight.className = 'wavesurfer-handle wavesurfer-handle-end';
+        var css = {
+            position: 'absolute',
+            left: '-10px',
+            top: '0px',
+            width: '20%',
+            maxWidth: '4px',
+            height: '100%',
+            padding:'5px'
+        };
+        WaveSurfer.Region.style(regionEl.handleLeft, css);
+        WaveSurfer.Region.style(regionEl.handleRight, css);
+        WaveSurfer.Region.style(regionEl.handleRight, {
+            left: '100%'
+        });
+
+        regionEl.deleteRegion = regionEl.appendChild(document.createElement('i'));
+        regionEl.deleteRegion.className = 'fa fa-times-circle';
+        WaveSurfer.Region.style(regionEl.deleteRegion, {
+            position: 'absolute',
+            right: '0px',
+            top: '0px',
+            cursor: 'pointer',
+            fontSize: '20px',
+            borderRadius: '50%',
+            backgroundColor: 'white',
+            height: '17px',
+            width: '17px'
+        });
+
+        regionEl.addEventListener('mouseenter', function (e) {
+            regionEl.region && regionEl.region.onMouseEvent('mouseenter', e);
+        });
+        regionEl.addEventListener('mouseleave', function (e) {
+            regionEl.region && regionEl.region.onMouseEvent('mouseleave', e);
+        });
+        regionEl.addEventListener('click', function (e) {
+            e.preventDefault();
+            regionEl.region && regionEl.region.onMouseEvent('click', e);
+        });
+        regionEl.addEventListener('dblclick', function (e) {
+            e.stopPropagation();
+            e.preventDefault();
+            regionEl.region && regionEl.region.onMouseEvent('dblclick', e);
+        });
+        regionEl.deleteRegion.addEventListener('click', function (e) {
+            e.stopPropagation();
+            regionEl.region && regionEl.region.remove();
+        });
+        regionEl.addEventListener('mousedown', function (e) {
+            regionEl.region && my.startMove(regionEl.region, e);
+        });
+
+        return this.wrapper.appendChild(regionEl);
+    },
+
+    /* Drag or resize a region until the mouse is released. */
+    startMove: function (region, e) {
+        if (!region.movable) {
+            return;
+        }
+        if (region.drag) {
+            e.stopPropagation();
+        }
+        var type = 'drag';
+        if (e.target.tagName.toLowerCase() == 'handle') {
+            if (e.target.classList.contains('wavesurfer-handle-start')) {
+                type = 'start';
+            } else {
+                type = 'end';
+            }
+        }
+        this.moving = {
+            region: region,
+            type: type,
+            time: this.wavesurfer.drawer.handleEvent(e) * this.wavesurfer.getDuration(),
+            moved: false
+        };
+    },
+
+    moveRegion: function (e) {
+        var moving = this.moving;
+        if (!moving) {
+            return;
+        }
+        moving.moved = true;
+        var time = this.wavesurfer.drawer.handleEvent(e) * this.wavesurfer.getDuration();
+        var delta = time - moving.time;
+        moving.time = time;
+
+        // Drag
+        if (moving.type == 'drag' && moving.region.drag) {
+            moving.region.onDrag(delta);
+        }
+
+        // Resize
+        if (moving.type != 'drag' && moving.region.resize) {
+            moving.region.onResize(delta, moving.type);
+        }
+    },
+
+    endMove: function (e) {
+        var moving = this.moving;
+        if (!moving) {
+            return;
+        }
+        this.moving = null;
+        e.stopPropagation();
+        e.preventDefault();
+
+        var region = moving.region;
+        if (moving.moved && (region.drag || region.resize)) {
+            region.fireEvent('update-end', e);
+            this.wavesurfer.fireEvent('region-update-end', region, e, moving.type);
+        }
+    },
+
     enableDragSelection: function (params) {
         var my = this;
         var drag;
@@ -128,7 +424,7 @@ WaveSurfer.Region = {
     init: function (params, wavesurfer) {
         this.wavesurfer = wavesurfer;
         this.wrapper = wavesurfer.drawer.wrapper;
-        this.width = wavesurfer.drawer.wrapper.scrollWidth;
+        this.width = wavesurfer.regions.getWidth() || this.wrapper.scrollWidth;
 
         this.id = params.id == null ? WaveSurfer.util.getId() : params.id;
         this.start = Number(params.start) || 0;
@@ -139,6 +435,9 @@ WaveSurfer.Region = {
         this.canDelete = params.canDelete === undefined ? true : Boolean(params.canDelete);
         this.resize = params.resize === undefined ? true : Boolean(params.resize);
         this.drag = params.drag === undefined ? true : Boolean(params.drag);
+        // the handles and the mouse events are only for the regions that can be edited when they are created
+        this.hasHandles = this.resize;
+        this.movable = this.drag || this.resize;
         this.loop = Boolean(params.loop);
         this.color = params.color || 'rgba(252, 238, 137, 0.5)';
         this.data = params.data || {};
@@ -156,9 +455,12 @@ WaveSurfer.Region = {
         this.maxLength = params.maxLength;
         this.minLength = params.minLength;
 
+        this.element = null;
+        this.classes = [];
+        this.removed = false;
+
         this.bindInOut();
-        this.render();
-        this.wavesurfer.on('zoom', this.updateRender.bind(this));
+        this.updateRender();
         this.wavesurfer.fireEvent('region-created', this);
 
     },
@@ -221,11 +523,9 @@ WaveSurfer.Region = {
 
     /* Remove a single region. */
     remove: function () {
-        if (this.element) {
-            this.wrapper.removeChild(this.element);
-            this.element = null;
+        if (!this.removed) {
+            this.removed = true;
             this.fireEvent('remove');
-            this.wavesurfer.un('zoom', this.updateRender.bind(this));
             this.wavesurfer.fireEvent('region-removed', this);
         }
     },
@@ -243,68 +543,47 @@ WaveSurfer.Region = {
         this.once('out', this.playLoop.bind(this));
     },
 
-    /* Render a region as a DOM element. */
-    render: function () {
-        var regionEl = document.createElement('region');
-        regionEl.className = 'wavesurfer-region';
-        regionEl.title = this.formatTime(this.start, this.end);
-        regionEl.setAttribute('data-id', this.id);
+    /* Add a class to the element of the region, it is kept when the region gets another element. */
+    addClass: function (className) {
+        if (this.classes.indexOf(className) < 0) {
+            this.classes.push(className);
+        }
+        if (this.element) {
+            this.element.classList.add(className);
+        }
+    },
 
-        for (var attrname in this.attributes) {
-            regionEl.setAttribute('data-region-' + attrname, this.attributes[attrname]);
+    removeClass: function (className) {
+        var index = this.classes.indexOf(className);
+        if (index >= 0) {
+            this.classes.splice(index, 1);
+        }
+        if (this.element) {
+            this.element.classList.remove(className);
         }
+    },
 
-        this.style(regionEl, {
-            position: 'absolute',
-            zIndex: 2,
-            height: '100%',
-            top: '0px',
-            textAlign: 'center'
-        });
+    /* Render the region with an element of the regions manager. */
+    attach: function (regionEl) {
+        this.element = regionEl;
+        regionEl.region = this;
+        regionEl.className = ['wavesurfer-region'].concat(this.classes).join(' ');
+        regionEl.setAttribute('data-id', this.id);
+        regionEl.handleLeft.style.display = this.hasHandles ? '' : 'none';
+        regionEl.handleRight.style.display = this.hasHandles ? '' : 'none';
+        regionEl.deleteRegion.style.display = this.canDelete ? '' : 'none';
+        regionEl.style.display = '';
+    },
 
-        /* Resize handles */
-        if (this.resize) {
-            var handleLeft = regionEl.appendChild(document.createElement('handle'));
-            var handleRight = regionEl.appendChild(document.createElement('handle'));
-            handleLeft.className = 'wavesurfer-handle wavesurfer-handle-start';
-            handleRight.className = 'wavesurfer-handle wavesurfer-handle-end';
-            var css = {
-                position: 'absolute',
-                left: '-10px',
-                top: '0px',
-                width: '20%',
-                maxWidth: '4px',
-                height: '100%',
-                padding:'5px'
-            };
-            this.style(handleLeft, css);
-            this.style(handleRight, css);
-            this.style(handleRight, {
-                left: '100%'
-            });
+    /* Give the element back to the regions manager. */
+    detach: function () {
+        if (this.element) {
+            for (var attrname in this.attributes) {
+                this.element.removeAttribute('data-region-' + attrname);
+            }
+            this.element.region = null;
+            this.element = null;
         }
-
-        if (this.canDelete) {
-          this.deleteRegion = regionEl.appendChild(document.createElement('i'));
-          this.deleteRegion.className = 'fa fa-times-circle'
-
-          this.style(this.deleteRegion, {
-              position: 'absolute',
-              right: '0px',
-              top: '0px',
-              cursor: 'pointer',
-              fontSize: '20px',
-              borderRadius: '50%',
-              backgroundColor: 'white',
-              height: '17px',
-              width: '17px'
-          });
-        }
-        this.element = this.wrapper.appendChild(regionEl);
-        this.handleLeft = handleLeft;
-        this.handleRight = handleRight;
-        this.updateRender();
-        this.bindEvents(regionEl);
     },
 
     formatTime: function (start, end) {
@@ -316,17 +595,9 @@ WaveSurfer.Region = {
         }).join('-');
     },
 
-    /* Update element's position, width, color. */
-    updateRender: function (pxPerSec) {
+    /* Keep the region in the sound and in its length limits, it is redrawn in the next frame. */
+    updateRender: function () {
         var dur = this.wavesurfer.getDuration();
-        var width;
-        if (pxPerSec) {
-            width = Math.round(this.wavesurfer.getDuration() * pxPerSec);
-            this.width = width;
-        }
-        else {
-          width = this.width;
-        }
 
         if (this.start < 0) {
           this.start = 0;
@@ -345,35 +616,34 @@ WaveSurfer.Region = {
             this.end = Math.min(this.start + this.maxLength, this.end);
         }
 
-        if (this.element != null) {
-            var regionWidth = ~~((this.end - this.start) / dur * width);
-            this.style(this.element, {
-                left: ~~(this.start / dur * width) + 'px',
-                width: regionWidth + 'px',
-                backgroundColor: this.color,
-                cursor: this.drag ? 'move' : 'default',
-                zIndex: width - regionWidth
-            });
+        if (this.wavesurfer.regions) {
+            this.wavesurfer.regions.changed();
+        }
+    },
 
-            for (var attrname in this.attributes) {
-                this.element.setAttribute('data-region-' + attrname, this.attributes[attrname]);
-            }
+    /* Update element's position, width, color. */
+    renderElement: function (width, dur) {
+        this.width = width;
+        var regionWidth = ~~((this.end - this.start) / dur * width);
+        this.style(this.element, {
+            left: ~~(this.start / dur * width) + 'px',
+            width: regionWidth + 'px',
+            backgroundColor: this.color,
+            cursor: this.drag ? 'move' : 'default',
+            zIndex: width - regionWidth
+        });
 
-            this.element.title = this.formatTime(this.start, this.end);
+        for (var attrname in this.attributes) {
+            this.element.setAttribute('data-region-' + attrname, this.attributes[attrname]);
         }
 
-        if (this.handleLeft != null) {
-            this.style(this.handleLeft, {
-                cursor: this.resize ? 'col-resize' : 'default',
-            });
-        }
+        this.element.title = this.formatTime(this.start, this.end);
 
-        if (this.handleRight != null) {
-            this.style(this.handleRight, {
-                cursor: this.resize ? 'col-resize' : 'default',
-            });
+        if (this.hasHandles) {
+            var cursor = this.resize ? 'col-resize' : 'default';
+            this.style(this.element.handleLeft, {cursor: cursor});
+            this.style(this.element.handleRight, {cursor: cursor});
         }
-        this.wavesurfer.fireEvent('zoom-end');
     },
 
     /* Bind audio events. */
@@ -383,27 +653,6 @@ WaveSurfer.Region = {
         my.firedIn = false;
         my.firedOut = false;
 
-        var onProcess = function (time) {
-            if (!my.firedOut && my.firedIn && (my.start >= Math.round(time * 100) / 100 || my.end <= Math.round(time * 100) / 100)) {
-                my.firedOut = true;
-                my.firedIn = false;
-                my.fireEvent('out');
-                my.wavesurfer.fireEvent('region-out', my);
-            }
-            if (!my.firedIn && my.start <= time && my.end > time) {
-                my.firedIn = true;
-                my.firedOut = false;
-                my.fireEvent('in');
-                my.wavesurfer.fireEvent('region-in', my);
-            }
-        };
-
-        this.wavesurfer.backend.on('audioprocess', onProcess);
-
-        this.on('remove', function () {
-            my.wavesurfer.backend.un('audioprocess', onProcess);
-        });
-
         /* Loop playback. */
         this.on('out', function () {
             if (my.loop) {
@@ -412,111 +661,27 @@ WaveSurfer.Region = {
         });
     },
 
-    /* Bind DOM events. */
-    bindEvents: function () {
-        var my = this;
-
-        this.element.addEventListener('mouseenter', function (e) {
-            my.fireEvent('mouseenter', e);
-            my.wavesurfer.fireEvent('region-mouseenter', my, e);
-        });
-
-        this.element.addEventListener('mouseleave', function (e) {
-            my.fireEvent('mouseleave', e);
-            my.wavesurfer.fireEvent('region-mouseleave', my, e);
-        });
-
-        this.element.addEventListener('click', function (e) {
-            e.preventDefault();
-            my.fireEvent('click', e);
-            my.wavesurfer.fireEvent('region-click', my, e);
-        });
-
-        if (this.canDelete) {
-          this.deleteRegion.addEventListener('click', function (e) {
-              e.stopPropagation();
-              my.remove();
-          });
+    /* Called by the regions manager as the audio plays. */
+    onProcess: function (time) {
+        var rounded = Math.round(time * 100) / 100;
+        if (!this.firedOut && this.firedIn && (this.start >= rounded || this.end <= rounded)) {
+            this.firedOut = true;
+            this.firedIn = false;
+            this.fireEvent('out');
+            this.wavesurfer.fireEvent('region-out', this);
+        }
+        if (!this.firedIn && this.start <= time && this.end > time) {
+            this.firedIn = true;
+            this.firedOut = false;
+            this.fireEvent('in');
+            this.wavesurfer.fireEvent('region-in', this);
         }
+    },
 
-        this.element.addEventListener('dblclick', function (e) {
-            e.stopPropagation();
-            e.preventDefault();
-            my.fireEvent('dblclick', e);
-            my.wavesurfer.fireEvent('region-dblclick', my, e);
-        });
-
-        /* Drag or resize on mousemove. */
-        (this.drag || this.resize) && (function () {
-            var duration = my.wavesurfer.getDuration();
-            var drag;
-            var resize;
-            var moved;
-            var startTime;
-
-            var onDown = function (e) {
-                if (my.drag) {
-                    e.stopPropagation();
-                }
-                startTime = my.wavesurfer.drawer.handleEvent(e) * duration;
-
-                if (e.target.tagName.toLowerCase() == 'handle') {
-                    if (e.target.classList.contains('wavesurfer-handle-start')) {
-                        resize = 'start';
-                    } else {
-                        resize = 'end';
-                    }
-                } else {
-                    drag = true;
-                }
-            };
-            var onUp = function (e) {
-                if (drag || resize) {
-                    var regionUpdateType = resize ? resize : 'drag';
-                    drag = false;
-                    resize = false;
-                    e.stopPropagation();
-                    e.preventDefault();
-
-                    if (moved && (my.drag || my.resize)) {
-                        my.fireEvent('update-end', e);
-                        my.wavesurfer.fireEvent('region-update-end', my, e, regionUpdateType);
-                        moved = false;
-                    }
-                }
-            };
-            var onMove = function (e) {
-                if (drag || resize) {
-                    moved = true;
-                    var time = my.wavesurfer.drawer.handleEvent(e) * duration;
-                    var delta = time - startTime;
-                    startTime = time;
-
-                    // Drag
-                    if (my.drag && drag) {
-                        my.onDrag(delta);
-                    }
-
-                    // Resize
-                    if (my.resize && resize) {
-                        my.onResize(delta, resize);
-                    }
-                }
-            };
-
-            my.element.addEventListener('mousedown', onDown);
-            my.wrapper.addEventListener('mousemove', onMove);
-            document.body.addEventListener('mouseup', onUp);
-
-            my.on('remove', function () {
-                document.body.removeEventListener('mouseup', onUp);
-                my.wrapper.removeEventListener('mousemove', onMove);
-            });
-
-            my.wavesurfer.on('destroy', function () {
-                document.body.removeEventListener('mouseup', onUp);
-            });
-        }());
+    /* Called by the element of the region on mouseenter, mouseleave, click and dblclick. */
+    onMouseEvent: function (type, e) {
+        this.fireEvent(type, e);
+        this.wavesurfer.fireEvent('region-' + type, this, e);
     },
 
     onDrag: function (delta) {
@@ -568,4 +733,4 @@ WaveSurfer.enableDragSelection = function (options) {
 
 WaveSurfer.disableDragSelection = function () {
     this.regions.disableDragSelection();
-};
+};
\ No newline at end of file
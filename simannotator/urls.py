@@ -16,9 +16,10 @@ Including another URLconf
 from django.conf.urls import url, include
 from django.contrib import admin
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
-import django.views
 from django.conf import settings
 
+import annotation.views
+
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'', include('annotation.urls')),
@@ -26,8 +27,7 @@ urlpatterns = [
 ]
 urlpatterns += staticfiles_urlpatterns()
 urlpatterns += [
-    url(r'^%s/(?P<path>.*)$' % settings.MEDIA_URL.strip('/'), django.views.static.serve,
-        {'document_root': settings.MEDIA_ROOT, 'show_indexes': True}),
+    url(r'^%s/(?P<path>.*)$' % settings.MEDIA_URL.strip('/'), annotation.views.serve_media, name='media'),
 ]
 
 if settings.DEBUG: